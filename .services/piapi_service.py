@@ -1,38 +1,79 @@
-import requests
 import streamlit as st
-import time
 import json
 
+from http_pool import get_session
+from image_store import ImageStore
+from piapi_client import PIAPI_BASE_URL, result_image_url, wait_for_webhook
+from polling import FETCH_ERROR_STATUS, PollScheduler
+from prompt_cache import PromptCache
+from tracing import span, traced
+from webhook import start_receiver
+
 class PiapiService:
     def __init__(self):
         self.api_key = st.secrets["PIAPI_API_KEY"]
-        self.base_url = "https://api.piapi.ai/mj/v2"
+        self.base_url = PIAPI_BASE_URL
         self.headers = {
             "Content-Type": "application/json",
             "X-API-Key": self.api_key
         }
+        # Sessão compartilhada: keep-alive, timeouts e retry em 429/5xx
+        self.session = get_session(self.base_url)
+        self.cache = PromptCache()
+        # Webhook opcional: a PIAPI avisa a conclusão e o polling vira só um fallback
+        self.webhook = None
+        if "PIAPI_WEBHOOK_URL" in st.secrets:
+            self.webhook = start_receiver(
+                st.secrets["PIAPI_WEBHOOK_URL"],
+                secret=st.secrets.get("PIAPI_WEBHOOK_SECRET", "")
+            )
     
-    def generate_character_images(self, character_name, character_description, episode_context=""):
-        """Gera 4 opções de imagem para um personagem"""
-        
+    def _webhook_params(self):
+        return self.webhook.submit_params() if self.webhook else {}
+    
+    def generate_character_images(self, character_name, character_description, episode_context="", fresh=False,
+                                  upscale=None):
+        """Gera 4 opções de imagem para um personagem (fresh=True ignora o cache)
+
+        upscale (1-4, ou função grade -> índice) encadeia o /upscale assim que a grade fica
+        pronta e devolve o resultado do upscale.
+        """
+        result = self._generate_grid(character_name, character_description, episode_context, fresh)
+        if result and upscale:
+            index = upscale(result) if callable(upscale) else upscale
+            return self.upscale_image(result.get("task_id"), index)
+        return result
+    
+    def _generate_grid(self, character_name, character_description, episode_context, fresh):
         # Criar prompt otimizado para Pixar 3D
         prompt = self._create_character_prompt(character_name, character_description, episode_context)
         
+        # Prompt já gerado antes: resultado na hora, sem nova tarefa paga
+        if not fresh:
+            cached = self.cache.get(prompt)
+            if cached:
+                return cached
+        
         try:
             # Chamar API imagine
-            response = requests.post(
-                f"{self.base_url}/imagine",
-                headers=self.headers,
-                json={
-                    "prompt": prompt,
-                    "aspect_ratio": "1:1",
-                    "model": "mj-6"
-                }
-            )
+            with span("piapi.imagine"):
+                response = self.session.post(
+                    f"{self.base_url}/imagine",
+                    headers=self.headers,
+                    json={
+                        "prompt": prompt,
+                        "aspect_ratio": "1:1",
+                        "model": "mj-6",
+                        **self._webhook_params()
+                    }
+                )
             
             if response.status_code == 200:
                 task_id = response.json().get("task_id")
-                return self._wait_for_completion(task_id)
+                result = self._wait_for_completion(task_id)
+                if result:
+                    self.cache.put(prompt, result)
+                return result
             else:
                 st.error(f"Erro na API PIAPI: {response.status_code} - {response.text}")
                 return None
@@ -44,14 +85,16 @@ class PiapiService:
     def upscale_image(self, image_url, index=1):
         """Faz upscale da imagem escolhida"""
         try:
-            response = requests.post(
-                f"{self.base_url}/upscale",
-                headers=self.headers,
-                json={
-                    "origin_task_id": image_url,  # Na verdade é o task_id da imagem original
-                    "index": index  # 1, 2, 3 ou 4
-                }
-            )
+            with span("piapi.upscale"):
+                response = self.session.post(
+                    f"{self.base_url}/upscale",
+                    headers=self.headers,
+                    json={
+                        "origin_task_id": image_url,  # Na verdade é o task_id da imagem original
+                        "index": index,  # 1, 2, 3 ou 4
+                        **self._webhook_params()
+                    }
+                )
             
             if response.status_code == 200:
                 task_id = response.json().get("task_id")
@@ -78,49 +121,46 @@ class PiapiService:
         
         return f"{base_prompt} {technical_params}"
     
+    @traced("piapi.wait")
     def _wait_for_completion(self, task_id, max_wait=300):
-        """Aguarda a conclusão da tarefa"""
+        """Aguarda a conclusão da tarefa (webhook, ou polling adaptativo com backoff)"""
         
-        start_time = time.time()
+        @traced("piapi.fetch")
+        def fetch(task_id):
+            response = self.session.get(
+                f"{self.base_url}/fetch",
+                headers=self.headers,
+                params={"task_id": task_id}
+            )
+            if response.status_code != 200:
+                raise RuntimeError(f"Erro ao verificar status: {response.status_code}")
+            return response.json()
         
-        while time.time() - start_time < max_wait:
-            try:
-                response = requests.get(
-                    f"{self.base_url}/fetch",
-                    headers=self.headers,
-                    params={"task_id": task_id}
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    status = result.get("status")
-                    
-                    if status == "finished":
-                        return result
-                    elif status == "failed":
-                        st.error(f"Tarefa falhou: {result.get('error', 'Erro desconhecido')}")
-                        return None
-                    elif status in ["processing", "waiting"]:
-                        # Continuar aguardando
-                        time.sleep(10)
-                    else:
-                        st.warning(f"Status desconhecido: {status}")
-                        time.sleep(5)
-                else:
-                    st.error(f"Erro ao verificar status: {response.status_code}")
-                    return None
-                    
-            except Exception as e:
-                st.error(f"Erro ao verificar status: {e}")
-                return None
+        def on_update(_, result):
+            status = result.get("status")
+            if status not in ["processing", "waiting", "finished", "failed", "timeout", FETCH_ERROR_STATUS]:
+                st.warning(f"Status desconhecido: {status}")
         
-        st.error("Timeout: Geração de imagem demorou muito")
+        if self.webhook:
+            result = wait_for_webhook(self.api_key, task_id, self.webhook, max_wait)
+        else:
+            scheduler = PollScheduler(fetch, deadline=max_wait)
+            scheduler.add(task_id)
+            result = scheduler.run(on_update=on_update)[task_id]
+        
+        status = result.get("status")
+        if status == "finished":
+            return result
+        elif status == "timeout":
+            st.error("Timeout: Geração de imagem demorou muito")
+        else:
+            st.error(f"Tarefa falhou: {result.get('error', 'Erro desconhecido')}")
         return None
     
     def test_connection(self):
         """Testa a conexão com a API"""
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/account",
                 headers=self.headers
             )
@@ -134,6 +174,10 @@ class PiapiService:
         except Exception as e:
             return False, f"Erro de conexão: {e}"
 
+@st.cache_resource
+def get_image_store():
+    return ImageStore(thumb_width=200)
+
 # Função para testar o serviço
 def test_piapi_service():
     """Função para testar o serviço PIAPI"""
@@ -160,12 +204,20 @@ def test_piapi_service():
         test_name = st.text_input("Nome do Personagem", value="Davi")
         test_desc = st.text_area("Descrição", value="jovem pastor hebreu, túnica simples, cabelos castanhos, sorriso gentil")
         test_context = st.text_input("Contexto", value="pastoreando ovelhas no campo")
+        test_fresh = st.checkbox("Nova variação (ignorar cache)")
+        test_upscale = st.selectbox("Upscale automático", ["Desligado", "Automático", 1, 2, 3, 4])
         
         submitted = st.form_submit_button("🎨 Gerar Teste")
         
         if submitted:
             with st.spinner("Gerando imagens... (pode demorar 1-2 minutos)"):
-                result = piapi.generate_character_images(test_name, test_desc, test_context)
+                upscale = {
+                    "Desligado": None,
+                    "Automático": lambda grid: get_image_store().best_variant(result_image_url(grid)),
+                }.get(test_upscale, test_upscale)
+                result = piapi.generate_character_images(
+                    test_name, test_desc, test_context, fresh=test_fresh, upscale=upscale
+                )
                 
                 if result:
                     st.success("✅ Imagens geradas com sucesso!")
@@ -174,5 +226,10 @@ def test_piapi_service():
                     # Tentar exibir as imagens se disponíveis
                     if "image_url" in result:
                         st.image(result["image_url"], caption="Resultado Midjourney")
+                    if "image_url" in result and not upscale:
+                        # Variações recortadas da grade localmente, sem um /upscale por variação
+                        thumbnails = get_image_store().variant_thumbnails(result["image_url"])
+                        for col, (index, thumbnail) in zip(st.columns(4), enumerate(thumbnails, start=1)):
+                            col.image(thumbnail, caption=f"V{index}")
                 else:
                     st.error("❌ Falha na geração de imagens")
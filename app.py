@@ -3,9 +3,35 @@ import pandas as pd
 from datetime import datetime
 import openai
 import json
+import math
 import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 import gspread
 from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import AuthorizedSession
+import http_pool
+import rate_limit
+from http_pool import mount_pool
+from sheet_replica import SheetReplica
+from record_index import RecordIndex
+from scenes import PAGES_HEADER, PAGES_SHEET, SCENES_HEADER, SCENES_SHEET, SceneEngine
+from narration import NarrationError, NarrationStore, make_backend
+from video import EpisodeRenderer, RenderError
+from piapi_client import (
+    PIAPI_BASE_URL, ImageBatch, PiapiError, fetch_task, result_image_url, settle_checkpoint,
+    submit_imagine, submit_upscale, wait_for_task, wait_for_webhook
+)
+from webhook import start_receiver
+from polling import FETCH_ERROR_STATUS, POLL_STATS, PollScheduler
+from prompt_cache import PromptCache
+from checkpoints import CheckpointStore
+from image_store import ImageStore
+from jobs import JobQueue
+from assistant_cache import AssistantCache
+from assistants import OPENAI_BASE_URL, AssistantError, AssistantsClient, JsonArrayStreamParser, parse_json_response
+from local_store import cache_path
+from tracing import TRACER, start_trace, traced
 
 # Configuração da página
 st.set_page_config(
@@ -14,13 +40,55 @@ st.set_page_config(
     layout="wide"
 )
 
+# Trace desta execução do script: spans e requisições upstream aparecem no Debug Info
+trace = start_trace()
+# Requisições feitas por quem está na tela passam na frente da geração em segundo plano
+rate_limit.set_priority(rate_limit.INTERACTIVE)
+
 # ID da planilha
 SPREADSHEET_ID = "1USj7J6jVR387eVjxVDzy69404qaRcgjEfxclBv0U5M4"
 ASSISTANT_ID = "asst_QeV7hQfMyuvrXS4zk41pbkTF"
 PERSONAGENS_ASSISTANT_ID = "asst_C3jWk8RdgvwoVFFR8CK5jq6a"  # Diretor de Personagens
+CENAS_ASSISTANT_ID = st.secrets.get("CENAS_ASSISTANT_ID")  # Roteirista de cenas (opcional)
+SCENES_PAGE_SIZE = 5  # cenas geradas/exibidas por página
+TTS_BACKEND = st.secrets.get("TTS_BACKEND", "openai")  # "silencio" = áudio mudo, sem rede (testes)
+NARRATION_VOICE = st.secrets.get("NARRATION_VOICE", "nova")
+NARRATION_WORKERS = 4  # sínteses de narração simultâneas
+VIDEO_WORKERS = None  # processos ffmpeg simultâneos (None = um por núcleo)
+SHEETS_SYNC_INTERVAL = 30  # segundos entre sincronizações da réplica local da planilha
+SHEET_HEADERS = {
+    "Episodios": ["Episódio", "Descrição Curta", "Moral", "Status", "ID"],
+    "Personagens": ["Nome", "Papel", "Descrição", "Prompt Imagem", "Status", "Link", "ID"],
+    SCENES_SHEET: SCENES_HEADER,
+    PAGES_SHEET: PAGES_HEADER,
+}
+PIAPI_MAX_CONCURRENCY = 4  # tarefas Midjourney simultâneas
+UPSCALE_MODES = {"Desligado": None, "Automático": "auto", "V1": 1, "V2": 2, "V3": 3, "V4": 4}
+JOB_WORKERS = 4  # threads da fila de tarefas em segundo plano
+WEBHOOK_PORT = 8765  # receptor local dos callbacks da PIAPI (exposto em PIAPI_WEBHOOK_URL)
+ASSISTANT_MAX_WAIT = 60  # segundos até desistir de uma execução de Assistant
+HTTP_POOL_SIZE = 10  # conexões keep-alive por host
+HTTP_TIMEOUT = (5, 60)  # (conexão, leitura) em segundos
+EPISODES_PAGE_SIZE = 20  # episódios renderizados por página
+CHARACTERS_PAGE_SIZE = 10  # personagens renderizados por página
+# Quotas por upstream, compartilhadas por todas as sessões: (requisições por minuto, simultâneas)
+UPSTREAM_LIMITS = {
+    "sheets.googleapis.com": (60, 10),  # Sheets: 60 requisições/min por usuário (conta de serviço)
+    "www.googleapis.com": (600, 10),  # Drive (modifiedTime da réplica)
+    urlparse(OPENAI_BASE_URL).netloc: (300, 20),
+    urlparse(PIAPI_BASE_URL).netloc: (120, 10),
+}
+METRICS_EXPORT_PATH = st.secrets.get("METRICS_EXPORT_PATH")  # arquivo .prom exportado a cada minuto (opcional)
+
+# Sessões HTTP compartilhadas por host (OpenAI, PIAPI e Sheets)
+http_pool.configure(pool_size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT)
+rate_limit.configure(UPSTREAM_LIMITS)
+if METRICS_EXPORT_PATH:
+    TRACER.export_every(METRICS_EXPORT_PATH)
 
 # Configurar Google Sheets
 @st.cache_resource
+@traced("sheets.init_gsheet")
 def init_gsheet():
     try:
         # Usar credenciais do secrets
@@ -29,13 +97,24 @@ def init_gsheet():
             "https://www.googleapis.com/auth/spreadsheets",
             "https://www.googleapis.com/auth/drive"
         ])
-        client = gspread.authorize(creds)
+        # Sessão autenticada com pool keep-alive, timeouts e retry em 429/5xx
+        session = mount_pool(AuthorizedSession(creds))
+        client = gspread.authorize(creds, session=session)
+        client.set_timeout(HTTP_TIMEOUT)
         sheet = client.open_by_key(SPREADSHEET_ID)
         return sheet
     except Exception as e:
         st.error(f"Erro ao conectar Google Sheets: {e}")
         return None
 
+# Réplica local das abas Episodios/Personagens (a interface lê do SQLite; a planilha
+# é sincronizada por deltas em segundo plano). Sem conexão, funciona só com os dados locais.
+@st.cache_resource
+def get_sheet_replica():
+    replica = SheetReplica(init_gsheet(), SHEET_HEADERS, interval=SHEETS_SYNC_INTERVAL)
+    replica.start()
+    return replica
+
 # Configurar OpenAI
 try:
     if "OPENAI_API_KEY" in st.secrets:
@@ -51,155 +130,82 @@ except Exception as e:
     st.error(f"Erro ao configurar OpenAI: {e}")
     st.stop()
 
-# Função para chamar o Assistant via requests direto
+# Runs de Assistant e tarefas PIAPI em andamento, retomadas depois de timeout/rerun/reinício
+@st.cache_resource
+def get_checkpoints():
+    return CheckpointStore()
+
+# Memória persistente assistant + prompt → resposta (reaprovar não paga outra run)
+@st.cache_resource
+def get_assistant_cache():
+    return AssistantCache()
+
+def assistant_fresh():
+    """Com "Reaproveitar respostas dos Assistants" desligado, toda chamada faz uma run nova"""
+    return not st.session_state.get("assistant_memo", True)
+
+# Cliente de Assistants compartilhado (thread + run numa chamada, polling adaptativo)
+def get_assistants_client():
+    return AssistantsClient(
+        st.secrets["OPENAI_API_KEY"], max_wait=ASSISTANT_MAX_WAIT, checkpoints=get_checkpoints(),
+        cache=get_assistant_cache()
+    )
+
 def generate_episodes(num_episodes):
     try:
-        import requests
-        
-        api_key = st.secrets["OPENAI_API_KEY"]
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "OpenAI-Beta": "assistants=v2"
-        }
-        
-        # Criar thread
-        thread_response = requests.post(
-            "https://api.openai.com/v1/threads",
-            headers=headers,
-            json={}
-        )
-        
-        if thread_response.status_code != 200:
-            st.error(f"Erro ao criar thread: {thread_response.text}")
-            return []
-            
-        thread_id = thread_response.json()["id"]
-        
-        # Enviar mensagem
-        message_response = requests.post(
-            f"https://api.openai.com/v1/threads/{thread_id}/messages",
-            headers=headers,
-            json={
-                "role": "user",
-                "content": f"Gere {num_episodes} ideias de episódios bíblicos infantis"
-            }
+        # O mesmo pedido deve trazer ideias novas: nunca reaproveitar a resposta anterior
+        response_text = get_assistants_client().run(
+            ASSISTANT_ID,
+            f"Gere {num_episodes} ideias de episódios bíblicos infantis",
+            fresh=True
         )
         
-        if message_response.status_code != 200:
-            st.error(f"Erro ao enviar mensagem: {message_response.text}")
-            return []
-        
-        # Executar Assistant
-        run_response = requests.post(
-            f"https://api.openai.com/v1/threads/{thread_id}/runs",
-            headers=headers,
-            json={
-                "assistant_id": ASSISTANT_ID
-            }
-        )
-        
-        if run_response.status_code != 200:
-            st.error(f"Erro ao executar assistant: {run_response.text}")
-            return []
-            
-        run_id = run_response.json()["id"]
-        
-        # Aguardar conclusão
-        max_attempts = 30
-        for attempt in range(max_attempts):
-            status_response = requests.get(
-                f"https://api.openai.com/v1/threads/{thread_id}/runs/{run_id}",
-                headers=headers
-            )
-            
-            if status_response.status_code != 200:
-                st.error(f"Erro ao verificar status: {status_response.text}")
-                return []
-                
-            status = status_response.json()["status"]
-            
-            if status == "completed":
-                break
-            elif status in ["failed", "cancelled", "expired"]:
-                st.error(f"Assistant falhou: {status}")
-                return []
-            
-            time.sleep(2)
-        else:
-            st.error("Timeout - Assistant demorou muito para responder")
-            return []
-        
-        # Buscar resposta
-        messages_response = requests.get(
-            f"https://api.openai.com/v1/threads/{thread_id}/messages",
-            headers=headers
-        )
-        
-        if messages_response.status_code != 200:
-            st.error(f"Erro ao buscar mensagens: {messages_response.text}")
-            return []
-            
-        messages = messages_response.json()["data"]
-        
-        if not messages:
-            st.error("Nenhuma resposta encontrada")
-            return []
-            
-        response_text = messages[0]["content"][0]["text"]["value"]
-        
-        # Tentar parsear JSON
+        # Tentar parsear JSON (removendo markdown se existir)
         try:
-            # Limpar markdown se existir
-            response_clean = response_text.strip()
-            if response_clean.startswith("```json"):
-                response_clean = response_clean[7:]  # Remove ```json
-            if response_clean.startswith("```"):
-                response_clean = response_clean[3:]   # Remove ```
-            if response_clean.endswith("```"):
-                response_clean = response_clean[:-3]  # Remove ```
-            response_clean = response_clean.strip()
-            
-            episodes = json.loads(response_clean)
+            episodes = parse_json_response(response_text)
             if isinstance(episodes, dict):
                 episodes = [episodes]
             return episodes
         except json.JSONDecodeError as e:
             st.error(f"Erro ao processar JSON: {e}")
-            st.text(f"Resposta limpa: {response_clean}")
+            st.text(f"Resposta recebida: {response_text}")
             return []
             
+    except AssistantError as e:
+        st.error(str(e))
+        return []
     except Exception as e:
         st.error(f"Erro geral: {e}")
         return []
 
-def generate_characters_for_episode(episode_title, episode_description, episode_moral):
-    """Chama o Agent Diretor de Personagens para criar personagens"""
+def generate_episodes_streaming(num_episodes, on_episode=None):
+    """Gera episódios em streaming: on_episode(ep) é chamado para cada um assim que chega"""
+    episodes = []
+    parser = JsonArrayStreamParser()
     try:
-        import requests
-        
-        api_key = st.secrets["OPENAI_API_KEY"]
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "OpenAI-Beta": "assistants=v2"
-        }
-        
-        # Criar thread
-        thread_response = requests.post(
-            "https://api.openai.com/v1/threads",
-            headers=headers,
-            json={}
-        )
-        
-        if thread_response.status_code != 200:
-            st.error(f"Erro ao criar thread para personagens: {thread_response.text}")
-            return []
-            
-        thread_id = thread_response.json()["id"]
-        
-        # Prompt para o Diretor de Personagens (SEM f-string problemática)
-        prompt = """
+        for chunk in get_assistants_client().stream(
+            ASSISTANT_ID,
+            f"Gere {num_episodes} ideias de episódios bíblicos infantis",
+            fresh=True
+        ):
+            for ep in parser.feed(chunk):
+                episodes.append(ep)
+                if on_episode:
+                    on_episode(ep)
+    except AssistantError as e:
+        st.error(str(e))
+    except Exception as e:
+        st.error(f"Erro geral: {e}")
+    
+    # Elementos malformados são descartados sem perder os demais
+    if parser.errors:
+        st.warning(f"⚠️ {len(parser.errors)} episódio(s) com JSON inválido foram ignorados")
+    return episodes
+
+def build_characters_prompt(episode_title, episode_description, episode_moral):
+    """Prompt para o Diretor de Personagens"""
+    # SEM f-string problemática
+    return """
         EPISÓDIO: """ + episode_title + """
         DESCRIÇÃO: """ + episode_description + """
         MORAL: """ + episode_moral + """
@@ -222,104 +228,92 @@ def generate_characters_for_episode(episode_title, episode_description, episode_
           }
         ]
         """
-        
-        # Enviar mensagem
-        message_response = requests.post(
-            f"https://api.openai.com/v1/threads/{thread_id}/messages",
-            headers=headers,
-            json={
-                "role": "user",
-                "content": prompt
-            }
-        )
-        
-        if message_response.status_code != 200:
-            st.error(f"Erro ao enviar mensagem para personagens: {message_response.text}")
-            return []
-        
-        # Executar Assistant
-        run_response = requests.post(
-            f"https://api.openai.com/v1/threads/{thread_id}/runs",
-            headers=headers,
-            json={
-                "assistant_id": PERSONAGENS_ASSISTANT_ID
-            }
-        )
-        
-        if run_response.status_code != 200:
-            st.error(f"Erro ao executar assistant de personagens: {run_response.text}")
-            return []
-            
-        run_id = run_response.json()["id"]
-        
-        # Aguardar conclusão
-        max_attempts = 30
-        for attempt in range(max_attempts):
-            status_response = requests.get(
-                f"https://api.openai.com/v1/threads/{thread_id}/runs/{run_id}",
-                headers=headers
-            )
-            
-            if status_response.status_code != 200:
-                st.error(f"Erro ao verificar status de personagens: {status_response.text}")
-                return []
-                
-            status = status_response.json()["status"]
-            
-            if status == "completed":
-                break
-            elif status in ["failed", "cancelled", "expired"]:
-                st.error(f"Assistant de personagens falhou: {status}")
-                return []
-            
-            time.sleep(2)
-        else:
-            st.error("Timeout - Diretor de Personagens demorou muito")
-            return []
-        
-        # Buscar resposta
-        messages_response = requests.get(
-            f"https://api.openai.com/v1/threads/{thread_id}/messages",
-            headers=headers
-        )
-        
-        if messages_response.status_code != 200:
-            st.error(f"Erro ao buscar mensagens de personagens: {messages_response.text}")
-            return []
-            
-        messages = messages_response.json()["data"]
-        
-        if not messages:
-            st.error("Nenhuma resposta do Diretor de Personagens")
-            return []
-            
-        response_text = messages[0]["content"][0]["text"]["value"]
-        
-        # Limpar markdown e parsear JSON
-        try:
-            response_clean = response_text.strip()
-            if response_clean.startswith("```json"):
-                response_clean = response_clean[7:]
-            if response_clean.startswith("```"):
-                response_clean = response_clean[3:]
-            if response_clean.endswith("```"):
-                response_clean = response_clean[:-3]
-            response_clean = response_clean.strip()
-            
-            characters = json.loads(response_clean)
-            return characters
-        except json.JSONDecodeError as e:
-            st.error(f"Erro ao processar JSON de personagens: {e}")
-            st.text(f"Resposta recebida: {response_text}")
-            return []
-            
+
+def parse_characters_response(response_text):
+    """Converte a resposta do Diretor de Personagens em lista (ou [] com erro na tela)"""
+    try:
+        return parse_json_response(response_text)
+    except json.JSONDecodeError as e:
+        st.error(f"Erro ao processar JSON de personagens: {e}")
+        st.text(f"Resposta recebida: {response_text}")
+        return []
+
+def generate_characters_for_episode(episode_title, episode_description, episode_moral, fresh=False):
+    """Chama o Agent Diretor de Personagens para criar personagens
+
+    A resposta fica memorizada pelo conteúdo do episódio; fresh=True pede personagens novos.
+    """
+    prompt = build_characters_prompt(episode_title, episode_description, episode_moral)
+    try:
+        response_text = get_assistants_client().run(PERSONAGENS_ASSISTANT_ID, prompt, fresh=fresh)
+        characters = parse_characters_response(response_text)
+        if not characters:
+            # Resposta inválida não fica memorizada: a próxima tentativa faz outra run
+            get_assistant_cache().forget(PERSONAGENS_ASSISTANT_ID, prompt)
+        return characters
+    except AssistantError as e:
+        st.error(f"Diretor de Personagens: {e}")
+        return []
     except Exception as e:
         st.error(f"Erro geral no Diretor de Personagens: {e}")
         return []
-def generate_character_images_piapi(prompt_midjourney, character_name):
-    """Gera 4 opções de imagem via PIAPI/Midjourney"""
+
+def generate_characters_for_episodes(episodes, fresh=False):
+    """Roda o Diretor de Personagens para vários episódios ao mesmo tempo (mesma ordem da entrada)"""
+    prompts = [
+        build_characters_prompt(ep.get('Episódio', ''), ep.get('Descrição Curta', ''), ep.get('Moral', ''))
+        for ep in episodes
+    ]
     try:
-        import requests
+        responses = get_assistants_client().run_many(
+            [(PERSONAGENS_ASSISTANT_ID, prompt) for prompt in prompts], fresh=fresh
+        )
+    except Exception as e:
+        st.error(f"Erro geral no Diretor de Personagens: {e}")
+        return [[] for _ in episodes]
+    
+    results = []
+    for ep, prompt, response in zip(episodes, prompts, responses):
+        if isinstance(response, Exception):
+            st.error(f"Diretor de Personagens ({ep.get('Episódio', '')}): {response}")
+            results.append([])
+            continue
+        characters = parse_characters_response(response)
+        if not characters:
+            get_assistant_cache().forget(PERSONAGENS_ASSISTANT_ID, prompt)
+        results.append(characters)
+    return results
+
+# Cache persistente prompt → resultado Midjourney
+@st.cache_resource
+def get_prompt_cache():
+    return PromptCache()
+
+# Cópia local das imagens + miniaturas WebP na largura de exibição
+@st.cache_resource
+def get_image_store():
+    return ImageStore(thumb_width=200)
+
+def show_thumbnail(url, **kwargs):
+    """Miniatura local; se o download ou a decodificação falhar, mostra a URL original"""
+    try:
+        data = get_image_store().thumbnail(url)
+    except Exception:
+        data = None
+    try:
+        st.image(data or url, **kwargs)
+    except Exception:
+        st.caption("🖼️ Imagem não disponível")
+
+def generate_character_images_piapi(prompt_midjourney, character_name, fresh=False):
+    """Gera 4 opções de imagem via PIAPI/Midjourney (fresh=True ignora o cache e pede nova variação)"""
+    try:
+        # Mesmo prompt já gerado: devolver na hora, sem nova tarefa paga
+        if not fresh:
+            cached = get_prompt_cache().get(prompt_midjourney)
+            if cached:
+                st.info(f"♻️ {character_name}: imagens reaproveitadas do cache")
+                return cached
         
         if "PIAPI_API_KEY" not in st.secrets:
             st.error("❌ PIAPI_API_KEY não encontrada nas secrets")
@@ -327,238 +321,803 @@ def generate_character_images_piapi(prompt_midjourney, character_name):
             
         api_key = st.secrets["PIAPI_API_KEY"]
         
-        headers = {
-            "Content-Type": "application/json",
-            "X-API-Key": api_key
-        }
-        
-        # Chamar API imagine
-        response = requests.post(
-            "https://api.piapi.ai/mj/v2/imagine",
-            headers=headers,
-            json={
-                "prompt": prompt_midjourney,
-                "aspect_ratio": "1:1",
-                "model": "mj-6"
-            }
+        # Chamar API imagine (com webhook, se configurado)
+        task_id = submit_imagine(
+            api_key, prompt_midjourney, webhook=get_webhook_receiver(), checkpoints=get_checkpoints()
         )
-        
-        if response.status_code == 200:
-            task_id = response.json().get("task_id")
-            return wait_for_piapi_completion(task_id, character_name)
-        else:
-            st.error(f"Erro na API PIAPI: {response.status_code} - {response.text}")
-            return None
+        result = wait_for_piapi_completion(task_id, character_name)
+        if result:
+            get_prompt_cache().put(prompt_midjourney, result)
+        return result
             
+    except PiapiError as e:
+        st.error(str(e))
+        return None
     except Exception as e:
         st.error(f"Erro ao gerar imagens: {e}")
         return None
 
+# Receptor de webhooks da PIAPI (opcional: só com PIAPI_WEBHOOK_URL nas secrets)
+def get_webhook_receiver():
+    if "PIAPI_WEBHOOK_URL" not in st.secrets:
+        return None
+    return start_receiver(
+        st.secrets["PIAPI_WEBHOOK_URL"],
+        port=WEBHOOK_PORT,
+        secret=st.secrets.get("PIAPI_WEBHOOK_SECRET", "")
+    )
+
 def wait_for_piapi_completion(task_id, character_name, max_wait=300):
-    """Aguarda a conclusão da tarefa PIAPI"""
-    
-    import requests
-    import time
+    """Aguarda a conclusão da tarefa PIAPI (webhook, ou polling adaptativo com backoff)"""
     
     api_key = st.secrets["PIAPI_API_KEY"]
-    headers = {
-        "Content-Type": "application/json",
-        "X-API-Key": api_key
-    }
     
     start_time = time.time()
     progress_bar = st.progress(0)
     status_text = st.empty()
     
-    while time.time() - start_time < max_wait:
-        try:
-            response = requests.get(
-                f"https://api.piapi.ai/mj/v2/fetch",
-                headers=headers,
-                params={"task_id": task_id}
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                status = result.get("status")
-                
-                # Atualizar progresso
-                elapsed = time.time() - start_time
-                progress = min(elapsed / max_wait, 0.9)
-                progress_bar.progress(progress)
-                status_text.text(f"🎨 Gerando {character_name}: {status}...")
-                
-                if status == "finished":
-                    progress_bar.progress(1.0)
-                    status_text.text(f"✅ {character_name} concluído!")
-                    return result
-                elif status == "failed":
-                    st.error(f"Geração falhou: {result.get('error', 'Erro desconhecido')}")
-                    return None
-                elif status in ["processing", "waiting"]:
-                    time.sleep(10)
+    def on_update(_, result):
+        status = result.get("status")
+        
+        # Atualizar progresso
+        elapsed = time.time() - start_time
+        progress = min(elapsed / max_wait, 0.9)
+        progress_bar.progress(progress)
+        status_text.text(f"🎨 Gerando {character_name}: {status}...")
+        
+        if status not in ["processing", "waiting", "finished", "failed", "timeout", FETCH_ERROR_STATUS]:
+            st.warning(f"Status desconhecido: {status}")
+    
+    webhook = get_webhook_receiver()
+    if webhook:
+        # Bloqueia no evento do callback em vez de consultar /fetch
+        status_text.text(f"🎨 Gerando {character_name}: aguardando webhook...")
+        result = wait_for_webhook(
+            api_key, task_id, webhook, max_wait,
+            on_status=lambda status: on_update(task_id, {"status": status})
+        )
+    else:
+        scheduler = PollScheduler(lambda t: fetch_task(api_key, t), deadline=max_wait)
+        scheduler.add(task_id)
+        result = scheduler.run(on_update=on_update)[task_id]
+    settle_checkpoint(get_checkpoints(), task_id, result)
+    
+    status = result.get("status")
+    if status == "finished":
+        progress_bar.progress(1.0)
+        status_text.text(f"✅ {character_name} concluído!")
+        return result
+    elif status == "timeout":
+        st.error("Timeout: Geração de imagem demorou muito (a tarefa continua na PIAPI; gere de novo para retomá-la)")
+    else:
+        st.error(f"Geração falhou: {result.get('error', 'Erro desconhecido')}")
+    return None
+
+# Pool de threads compartilhado para as tarefas PIAPI (limita a concorrência do processo)
+@st.cache_resource
+def get_piapi_executor():
+    return ThreadPoolExecutor(max_workers=PIAPI_MAX_CONCURRENCY, thread_name_prefix="piapi")
+
+def upscale_selector(mode):
+    """Índice fixo (1-4) ou, em "auto", a escolha feita sobre as variações recortadas localmente"""
+    if mode != "auto":
+        return mode
+    image_store = get_image_store()
+    return lambda grid: image_store.best_variant(result_image_url(grid))
+
+def generate_character_images_concurrently(characters, max_wait=300, fresh=False, upscale=None):
+    """Gera as imagens de vários personagens ao mesmo tempo [(nome, prompt)], com progresso por personagem
+
+    Com upscale (1-4 ou "auto"), cada grade pronta já segue para o /upscale e o resultado é o upscale.
+    """
+    if "PIAPI_API_KEY" not in st.secrets:
+        st.error("❌ PIAPI_API_KEY não encontrada nas secrets")
+        return {}
+    
+    batch = ImageBatch(
+        st.secrets["PIAPI_API_KEY"],
+        get_piapi_executor(),
+        max_wait=max_wait,
+        cache=get_prompt_cache(),
+        fresh=fresh,
+        webhook=get_webhook_receiver(),
+        checkpoints=get_checkpoints(),
+        upscale=upscale_selector(upscale) if upscale else None
+    )
+    widgets = {}
+    for name, prompt in characters:
+        batch.submit(name, prompt)
+        widgets[name] = (st.progress(0), st.empty())
+    
+    # As threads só fazem rede; a interface é atualizada aqui, na thread do script.
+    # O prazo cobre grade + upscale com folga; depois disso a tela para de esperar.
+    deadline = time.monotonic() + max_wait * (2 if upscale else 1) + 30
+    while True:
+        finished = batch.done()
+        timed_out = not finished and time.monotonic() > deadline
+        for name, state in batch.progress().items():
+            progress_bar, status_text = widgets[name]
+            if state["status"] == "finished":
+                progress_bar.progress(1.0)
+                if state.get("upscale_index"):
+                    status_text.text(f"✅ {name}: V{state['upscale_index']} em alta resolução")
                 else:
-                    st.warning(f"Status desconhecido: {status}")
-                    time.sleep(5)
+                    status_text.text(f"♻️ {name} (cache)" if state.get("cached") else f"✅ {name} concluído!")
+            elif state["status"] == "failed":
+                progress_bar.progress(1.0)
+                status_text.text(f"❌ {name}: {state['error']}")
             else:
-                st.error(f"Erro ao verificar status: {response.status_code}")
-                return None
-                
-        except Exception as e:
-            st.error(f"Erro ao verificar status: {e}")
-            return None
+                progress_bar.progress(min(state["elapsed"] / max_wait, 0.9))
+                status_text.text(f"🎨 Gerando {name}: {state['status']}...")
+        if finished:
+            break
+        if timed_out:
+            pending = [name for name, state in batch.progress().items() if state["status"] not in ("finished", "failed")]
+            st.warning(f"⏱️ Tempo esgotado esperando: {', '.join(pending)} (gere de novo para retomar as tarefas)")
+            break
+        time.sleep(1)
     
-    st.error("Timeout: Geração de imagem demorou muito")
-    return None
+    return batch.results()
 
 def upscale_character_image(task_id, index):
     """Faz upscale da imagem escolhida"""
     try:
-        import requests
-        
         api_key = st.secrets["PIAPI_API_KEY"]
-        headers = {
-            "Content-Type": "application/json",
-            "X-API-Key": api_key
-        }
-        
-        response = requests.post(
-            "https://api.piapi.ai/mj/v2/upscale",
-            headers=headers,
-            json={
-                "origin_task_id": task_id,
-                "index": index
-            }
+        upscale_task_id = submit_upscale(
+            api_key, task_id, index, webhook=get_webhook_receiver(), checkpoints=get_checkpoints()
         )
-        
-        if response.status_code == 200:
-            upscale_task_id = response.json().get("task_id")
-            return wait_for_piapi_completion(upscale_task_id, "Upscale")
-        else:
-            st.error(f"Erro no upscale: {response.status_code} - {response.text}")
-            return None
+        return wait_for_piapi_completion(upscale_task_id, "Upscale")
             
+    except PiapiError as e:
+        st.error(str(e))
+        return None
     except Exception as e:
         st.error(f"Erro ao fazer upscale: {e}")
         return None
+@traced("sheets.add_characters_to_sheet")
+def append_characters(characters):
+    """Adiciona personagens à aba Personagens (réplica local; enviados à planilha num lote); levanta em erro"""
+    get_sheet_replica().append("Personagens", [
+        {
+            'Nome': char.get('nome', ''),
+            'Papel': char.get('papel', ''),
+            'Descrição': char.get('descricao', ''),
+            'Prompt Imagem': char.get('prompt_imagem', ''),
+            'Status': char.get('status', 'Pendente'),
+            'Link': ''  # Link vazio inicialmente
+        }
+        for char in characters
+    ])
+
 def add_characters_to_sheet(characters, episode_title):
-    """Adiciona personagens à aba Personagens do Google Sheets"""
+    """append_characters para o script: erro vira st.error e False"""
     try:
-        sheet = init_gsheet()
-        if sheet is None:
-            return False
-            
-        # Tentar acessar aba Personagens
-        try:
-            personagens_sheet = sheet.worksheet("Personagens")
-        except:
-            # Criar aba se não existir
-            personagens_sheet = sheet.add_worksheet(title="Personagens", rows="100", cols="6")
-            # Adicionar cabeçalho
-            personagens_sheet.append_row(["Nome", "Papel", "Descrição", "Prompt Imagem", "Status", "Link"])
-        
-        # Adicionar cada personagem
-        for char in characters:
-            personagens_sheet.append_row([
-                char.get('nome', ''),
-                char.get('papel', ''),
-                char.get('descricao', ''),
-                char.get('prompt_imagem', ''),
-                char.get('status', 'Pendente'),
-                ''  # Link vazio inicialmente
-            ])
-        
+        append_characters(characters)
         return True
     except Exception as e:
         st.error(f"Erro ao adicionar personagens à planilha: {e}")
         return False
 
 # Funcões Google Sheets
+@traced("sheets.get_episodes_from_sheet")
 def get_episodes_from_sheet():
     try:
-        sheet = init_gsheet()
-        if sheet is None:
-            return []
-            
-        # Aba Episodios
-        episodios_sheet = sheet.worksheet("Episodios")
-        data = episodios_sheet.get_all_records()
-        return data
+        # Aba Episodios lida da réplica local (milissegundos, sem chamada à API)
+        return get_sheet_replica().records("Episodios")
     except Exception as e:
         st.error(f"Erro ao ler episódios: {e}")
         return []
 
+@traced("sheets.add_episodes_to_sheet")
+def append_episodes(episodes):
+    """Adiciona episódios à aba Episodios; levanta em erro"""
+    # Todos os episódios vão para a planilha no mesmo lote da próxima sincronização
+    get_sheet_replica().append("Episodios", [
+        {
+            'Episódio': ep.get('episodio', ''),
+            'Descrição Curta': ep.get('descricao', ''),
+            'Moral': ep.get('moral', ''),
+            'Status': 'Aguardando Aprovação'
+        }
+        for ep in episodes
+    ])
+
 def add_episodes_to_sheet(episodes):
+    """append_episodes para o script: erro vira st.error e False"""
     try:
-        sheet = init_gsheet()
-        if sheet is None:
-            return False
-            
-        episodios_sheet = sheet.worksheet("Episodios")
-        
-        # Adicionar cada episódio
-        for ep in episodes:
-            episodios_sheet.append_row([
-                ep.get('episodio', ''),
-                ep.get('descricao', ''),
-                ep.get('moral', ''),
-                'Aguardando Aprovação'
-            ])
-        
+        append_episodes(episodes)
         return True
     except Exception as e:
         st.error(f"Erro ao adicionar episódios: {e}")
         return False
 
-def update_episode_status(row_index, new_status, episode_data=None):
+@traced("sheets.update_episodes_status")
+def update_episodes_status(updates):
+    """Grava vários status [(ID do episódio, status)]; enviados à planilha num único batch_update"""
     try:
-        sheet = init_gsheet()
-        if sheet is None:
-            return False
-            
-        episodios_sheet = sheet.worksheet("Episodios")
-        episodios_sheet.update_cell(row_index + 2, 4, new_status)
-        
-        # Se episódio foi aprovado, gerar personagens
-        if new_status == "Approved" and episode_data:
-            st.info("🎭 Episódio aprovado! Gerando personagens...")
-            
-            with st.spinner("Criando personagens com Diretor de Personagens..."):
-                characters = generate_characters_for_episode(
-                    episode_data.get('Episódio', ''),
-                    episode_data.get('Descrição Curta', ''),
-                    episode_data.get('Moral', '')
-                )
-                
-                if characters:
-                    if add_characters_to_sheet(characters, episode_data.get('Episódio', '')):
-                        st.success(f"✅ {len(characters)} personagens criados!")
-                        # Mostrar personagens criados
-                        for char in characters:
-                            st.write(f"👤 **{char.get('nome')}** - {char.get('papel')}")
-                    else:
-                        st.error("Erro ao salvar personagens na planilha")
-                else:
-                    st.error("Erro ao gerar personagens")
-        
+        get_sheet_replica().update("Episodios", [
+            (episode_id, 'Status', new_status) for episode_id, new_status in updates
+        ])
         return True
     except Exception as e:
         st.error(f"Erro ao atualizar status: {e}")
         return False
 
+def create_characters_for_approved_episode(episode_data):
+    """Gera e salva os personagens de um episódio recém-aprovado"""
+    st.info("🎭 Episódio aprovado! Gerando personagens...")
+    
+    with st.spinner("Criando personagens com Diretor de Personagens..."):
+        characters = generate_characters_for_episode(
+            episode_data.get('Episódio', ''),
+            episode_data.get('Descrição Curta', ''),
+            episode_data.get('Moral', ''),
+            fresh=assistant_fresh()
+        )
+        
+        if characters:
+            if add_characters_to_sheet(characters, episode_data.get('Episódio', '')):
+                st.success(f"✅ {len(characters)} personagens criados!")
+                # Mostrar personagens criados
+                for char in characters:
+                    st.write(f"👤 **{char.get('nome')}** - {char.get('papel')}")
+            else:
+                st.error("Erro ao salvar personagens na planilha")
+        else:
+            st.error("Erro ao gerar personagens")
+
+def create_characters_for_approved_episodes(episodes):
+    """Gera os personagens de vários episódios aprovados em paralelo e salva tudo numa escrita"""
+    st.info(f"🎭 {len(episodes)} episódios aprovados! Gerando personagens...")
+    
+    with st.spinner("Criando personagens com Diretor de Personagens..."):
+        results = generate_characters_for_episodes(episodes, fresh=assistant_fresh())
+        all_characters = [char for characters in results for char in characters]
+        
+        if all_characters:
+            if add_characters_to_sheet(all_characters, ""):
+                for ep, characters in zip(episodes, results):
+                    if characters:
+                        st.success(f"✅ {ep.get('Episódio', '')}: {len(characters)} personagens criados!")
+            else:
+                st.error("Erro ao salvar personagens na planilha")
+        else:
+            st.error("Erro ao gerar personagens")
+
+def save_episode_status(episode_id, background=False):
+    """Callback do "Salvar Status" de um cartão: grava o status escolhido no selectbox"""
+    new_status = st.session_state[f"status_{episode_id}"]
+    if not update_episodes_status([(episode_id, new_status)]):
+        return
+    st.toast("Status atualizado!")
+    
+    # Se episódio foi aprovado, gerar personagens
+    if new_status == "Approved":
+        if background:
+            enqueue_characters_job(get_sheet_replica().record("Episodios", episode_id), fresh=assistant_fresh())
+            st.toast("📥 Geração de personagens enfileirada")
+        else:
+            # A geração mostra progresso: roda no corpo do cartão, não no callback
+            st.session_state[f"generate_characters_{episode_id}"] = True
+
+@traced("sheets.get_personagens_from_sheet")
 def get_personagens_from_sheet():
     try:
-        sheet = init_gsheet()
-        if sheet is None:
-            return []
-            
-        personagens_sheet = sheet.worksheet("Personagens")
-        data = personagens_sheet.get_all_records()
-        return data
+        return get_sheet_replica().records("Personagens")
     except Exception as e:
         st.error(f"Erro ao ler personagens: {e}")
         return []
 
+# Índices em memória por versão da réplica: filtros, páginas e métricas sem varrer as abas
+@st.cache_resource(max_entries=2)
+def build_episodes_index(version):
+    return RecordIndex(get_episodes_from_sheet(), ["Episódio", "Descrição Curta"])
+
+def get_episodes_index():
+    return build_episodes_index(get_sheet_replica().version("Episodios"))
+
+@st.cache_resource(max_entries=2)
+def build_personagens_index(version):
+    return RecordIndex(
+        get_personagens_from_sheet(),
+        ["Nome", "Descrição"],
+        flags={"sem_imagem": lambda p: p.get('Prompt Imagem') and not (p.get('Link Imagem') or p.get('Link'))}
+    )
+
+def get_personagens_index():
+    return build_personagens_index(get_sheet_replica().version("Personagens"))
+
+def render_list_filters(index, key, page_size, search_label):
+    """Filtro por status, busca e seletor de página; devolve (total filtrado, itens da página)"""
+    col1, col2, col3 = st.columns([1, 2, 1])
+    status_counts = index.status_counts()
+    with col1:
+        status = st.selectbox(
+            "Status:",
+            ["Todos"] + sorted(status_counts),
+            format_func=lambda s: s if s == "Todos" else f"{s or 'Sem status'} ({status_counts[s]})",
+            key=f"{key}_status_filter"
+        )
+    with col2:
+        search = st.text_input(search_label, key=f"{key}_search")
+    
+    status = None if status == "Todos" else status
+    total, _ = index.query(status, search, limit=0)
+    pages = max(1, math.ceil(total / page_size))
+    with col3:
+        # O rótulo muda com o número de páginas: um filtro novo volta para a página 1
+        page = st.number_input(f"Página (de {pages})", min_value=1, max_value=pages, value=1)
+    return index.query(status, search, offset=(page - 1) * page_size, limit=page_size)
+
+@traced("sheets.save_character_image_links")
+def write_character_image_links(links):
+    """Grava os links de imagem {ID do personagem: url} na aba Personagens num único batch_update; levanta em erro"""
+    replica = get_sheet_replica()
+    link_field = "Link Imagem" if "Link Imagem" in replica.header("Personagens") else "Link"
+    replica.update("Personagens", [(char_id, link_field, url) for char_id, url in links.items()])
+
+def save_character_image_links(links):
+    """write_character_image_links para o script: erro vira st.error e False"""
+    try:
+        write_character_image_links(links)
+        return True
+    except Exception as e:
+        st.error(f"Erro ao salvar links das imagens: {e}")
+        return False
+
+# Tarefas em segundo plano: rodam em threads sem contexto do script, então não chamam st.*
+# (só leem st.secrets); erros sobem como exceções e ficam registrados na tarefa
+def job_generate_episodes(payload, report):
+    report(0.1, "Gerando episódios com OpenAI Assistant...")
+    episodes = parse_json_response(get_assistants_client().run(
+        ASSISTANT_ID,
+        f"Gere {payload['num_episodes']} ideias de episódios bíblicos infantis",
+        fresh=True
+    ))
+    if isinstance(episodes, dict):
+        episodes = [episodes]
+    
+    report(0.9, f"Salvando {len(episodes)} episódios...")
+    append_episodes(episodes)
+    return {"episodios": len(episodes)}
+
+def job_generate_characters(payload, report):
+    ep = payload["episodio"]
+    report(0.1, f"Criando personagens de {ep.get('Episódio', '')}...")
+    prompt = build_characters_prompt(ep.get('Episódio', ''), ep.get('Descrição Curta', ''), ep.get('Moral', ''))
+    response_text = get_assistants_client().run(PERSONAGENS_ASSISTANT_ID, prompt, fresh=payload.get("fresh", False))
+    try:
+        characters = parse_json_response(response_text)
+    except json.JSONDecodeError:
+        get_assistant_cache().forget(PERSONAGENS_ASSISTANT_ID, prompt)
+        raise
+    
+    report(0.9, f"Salvando {len(characters)} personagens...")
+    append_characters(characters)
+    return {"personagens": [char.get('nome') for char in characters]}
+
+def job_generate_image(payload, report):
+    prompt = payload["prompt"]
+    prompt_cache = get_prompt_cache()
+    result = None if payload.get("fresh") else prompt_cache.get(prompt)
+    
+    if result is None:
+        api_key = st.secrets["PIAPI_API_KEY"]
+        webhook = get_webhook_receiver()
+        task_id = submit_imagine(api_key, prompt, webhook=webhook, checkpoints=get_checkpoints())
+        report(0.1, f"Tarefa {task_id} enviada")
+        result = wait_for_task(
+            api_key, task_id, on_status=lambda status: report(0.5, status), webhook=webhook,
+            checkpoints=get_checkpoints()
+        )
+        prompt_cache.put(prompt, result)
+    
+    image_url = result_image_url(result)
+    get_image_store().prefetch_variants([image_url])
+    
+    # Modo pipeline: a grade pronta segue direto para o upscale e o Link recebe a final
+    index = payload.get("upscale")
+    if index and image_url:
+        if index == "auto":
+            index = get_image_store().best_variant(image_url)
+        api_key = st.secrets["PIAPI_API_KEY"]
+        webhook = get_webhook_receiver()
+        task_id = submit_upscale(api_key, result.get("task_id"), index, webhook=webhook, checkpoints=get_checkpoints())
+        report(0.6, f"Upscale V{index} ({task_id}) enviado")
+        result = wait_for_task(
+            api_key, task_id, on_status=lambda status: report(0.8, f"upscale: {status}"), webhook=webhook,
+            checkpoints=get_checkpoints()
+        )
+        image_url = result_image_url(result)
+    
+    if payload.get("character_id") and image_url:
+        write_character_image_links({payload["character_id"]: image_url})
+    return {"task_id": result.get("task_id"), "image_url": image_url}
+
+def job_upscale(payload, report):
+    api_key = st.secrets["PIAPI_API_KEY"]
+    webhook = get_webhook_receiver()
+    task_id = submit_upscale(
+        api_key, payload["task_id"], payload["index"], webhook=webhook, checkpoints=get_checkpoints()
+    )
+    report(0.1, f"Upscale {task_id} enviado")
+    result = wait_for_task(
+        api_key, task_id, on_status=lambda status: report(0.5, status), webhook=webhook,
+        checkpoints=get_checkpoints()
+    )
+    
+    image_url = result_image_url(result)
+    if payload.get("character_id") and image_url:
+        write_character_image_links({payload["character_id"]: image_url})
+    return {"task_id": task_id, "image_url": image_url}
+
+# Fila persistente compartilhada pelo processo (sobrevive a reruns e refresh do navegador)
+@st.cache_resource
+def get_job_queue():
+    queue = JobQueue(workers=JOB_WORKERS)
+    queue.register("episodios", job_generate_episodes)
+    queue.register("personagens", job_generate_characters)
+    queue.register("imagem", job_generate_image)
+    queue.register("upscale", job_upscale)
+    queue.start()
+    return queue
+
+def enqueue_characters_job(episode_data, fresh=False):
+    title = episode_data.get('Episódio', '')
+    return get_job_queue().enqueue(
+        "personagens",
+        {"episodio": episode_data, "fresh": fresh},
+        title=f"Personagens: {title}",
+        dedupe_key=None if fresh else f"personagens:{title}"
+    )
+
+def enqueue_image_job(personagem, fresh=False, upscale=None):
+    character_id = personagem.get('ID')
+    return get_job_queue().enqueue(
+        "imagem",
+        {"character_id": character_id, "prompt": personagem.get('Prompt Imagem', ''), "fresh": fresh, "upscale": upscale},
+        title=f"Imagem: {personagem.get('Nome', 'Sem nome')}",
+        dedupe_key=None if fresh else f"imagem:{character_id}"
+    )
+
+def enqueue_upscale_job(personagem, task_id, index):
+    character_id = personagem.get('ID')
+    return get_job_queue().enqueue(
+        "upscale",
+        {"character_id": character_id, "task_id": task_id, "index": index},
+        title=f"Upscale V{index}: {personagem.get('Nome', 'Sem nome')}",
+        dedupe_key=f"upscale:{character_id}"
+    )
+
+@st.fragment(run_every=3)
+def render_jobs_panel():
+    """Estado da fila: lido do SQLite local, sem tocar nas APIs (barato a cada 3 s)"""
+    queue = get_job_queue()
+    counts = queue.counts()
+    st.caption(
+        f"⏳ {counts['queued']} na fila · ⚙️ {counts['running']} rodando · "
+        f"✅ {counts['done']} · ❌ {counts['failed']}"
+    )
+    
+    jobs = queue.list(limit=8)
+    for job in jobs:
+        if job["state"] in ("queued", "running"):
+            st.progress(job["progress"], text=f"{job['title']} — {job['message'] or job['state']}")
+        elif job["state"] == "done":
+            st.write(f"✅ {job['title']}")
+        else:
+            st.write(f"❌ {job['title']}: {job['error']}")
+            if st.button("🔁 Reenfileirar", key=f"retry_job_{job['id']}"):
+                queue.retry(job["id"])
+                st.rerun(scope="fragment")
+    
+    # Tarefa terminou desde a última olhada: recarregar a página para mostrar os dados novos
+    # (as tarefas gravam na réplica local, então a releitura não custa chamadas à API)
+    done_ids = {job["id"] for job in jobs if job["state"] == "done"}
+    seen = st.session_state.setdefault("jobs_done_seen", set(done_ids))
+    if done_ids - seen:
+        seen.update(done_ids)
+        st.rerun()
+
+# Áudio das narrações: cache em disco por hash de texto + voz, sintetizado em paralelo
+@st.cache_resource
+def get_narration_store():
+    backend = make_backend(TTS_BACKEND, api_key=st.secrets["OPENAI_API_KEY"], voice=NARRATION_VOICE)
+    return NarrationStore(backend, max_workers=NARRATION_WORKERS)
+
+# Vídeo do episódio: clipes por cena num pool de processos, cacheados pelo hash das entradas
+@st.cache_resource
+def get_video_renderer():
+    return EpisodeRenderer(get_image_store(), get_narration_store(), max_workers=VIDEO_WORKERS)
+
+# Motor de cenas: texto em páginas de 5 (streaming), imagens de cada cena enviadas assim
+# que ela chega e prefetch da página seguinte em segundo plano
+@st.cache_resource
+def get_scene_engine():
+    api_key = st.secrets["PIAPI_API_KEY"]
+    executor = get_piapi_executor()
+    prompt_cache = get_prompt_cache()
+    checkpoints = get_checkpoints()
+    webhook = get_webhook_receiver()
+    return SceneEngine(
+        get_assistants_client(),
+        CENAS_ASSISTANT_ID,
+        get_sheet_replica(),
+        new_image_batch=lambda on_done: ImageBatch(
+            api_key, executor, cache=prompt_cache, webhook=webhook, on_done=on_done,
+            checkpoints=checkpoints
+        ),
+        page_size=SCENES_PAGE_SIZE,
+        narration=get_narration_store()
+    )
+
+def render_scene(scene):
+    with st.container(border=True):
+        st.markdown(f"**Cena {scene.get('Número')} — {scene.get('Título', '')}**")
+        st.write(scene.get('Descrição', ''))
+        narracao = scene.get('Narração', '')
+        st.caption(f"🎙️ {narracao}")
+        if narracao:
+            narration = get_narration_store()
+            audio_path = narration.cached(narracao)
+            if audio_path:
+                st.audio(audio_path, format="audio/mpeg")
+            elif narration.pending(narracao):
+                st.write("🎙️ Gravando narração...")
+            elif narration.error(narracao):
+                st.warning(f"Erro na narração: {narration.error(narracao)}")
+        
+        for col, slot in zip(st.columns(2), (1, 2)):
+            with col:
+                link = scene.get(f'Link Imagem {slot}', '')
+                if link.startswith('http'):
+                    show_thumbnail(link, width=240)
+                elif scene.get('Status') == "Gerando imagens":
+                    st.write("🎨 Gerando imagem...")
+                else:
+                    st.write("🖼️ Imagem não disponível")
+
+def render_scene_pages(episode, pages):
+    """Cenas das páginas já abertas; enquanto algo está sendo gerado, redesenha a cada 2 s"""
+    engine = get_scene_engine()
+    scenes = engine.scenes(episode['ID'])
+    for scene in scenes[:pages * SCENES_PAGE_SIZE]:
+        render_scene(scene)
+    
+    state = engine.page_state(episode['ID'], pages - 1)
+    if state["status"] == "gerando":
+        st.info("✍️ Escrevendo as próximas cenas...")
+    elif state["status"] == "erro":
+        st.error(f"Erro ao gerar cenas: {state['erro']}")
+        # Sem nova tentativa automática a cada rerun: só por aqui (ou depois do intervalo de espera)
+        if st.button("🔄 Tentar de novo", key=f"cenas_retry_{episode['ID']}_{pages}"):
+            engine.ensure_page(episode, pages - 1, retry=True)
+            st.rerun()
+    
+    # Tudo pronto desde a última olhada: uma rodada completa desliga o redesenho periódico
+    busy = (
+        state["status"] == "gerando"
+        or engine.images_pending(episode['ID'])
+        or engine.narration_pending(episode['ID'])
+    )
+    if st.session_state.get("cenas_ocupado") and not busy:
+        st.session_state["cenas_ocupado"] = False
+        st.rerun()
+    st.session_state["cenas_ocupado"] = busy
+
+def render_episode_audio(episode):
+    """Narração do episódio inteiro: sintetiza o que falta (em paralelo) e junta os arquivos"""
+    textos = [s.get('Narração', '') for s in get_scene_engine().scenes(episode['ID'])]
+    textos = [texto for texto in textos if texto]
+    if not textos:
+        return
+    
+    narration = get_narration_store()
+    if st.button("🎧 Montar narração do episódio", key=f"audio_{episode['ID']}"):
+        with st.spinner(f"Sintetizando {len(textos)} narrações..."):
+            falhas = [r for r in narration.synthesize_many(textos).values() if isinstance(r, Exception)]
+        if falhas:
+            st.error(f"❌ {len(falhas)} narrações falharam: {falhas[0]}")
+        else:
+            try:
+                st.session_state[f"audio_episodio_{episode['ID']}"] = narration.concat(textos)
+            except (NarrationError, OSError) as e:
+                st.error(f"Erro ao montar o áudio: {e}")
+    
+    audio_path = st.session_state.get(f"audio_episodio_{episode['ID']}")
+    if audio_path:
+        st.audio(audio_path, format="audio/mpeg")
+        with open(audio_path, "rb") as f:
+            st.download_button(
+                "⬇️ Baixar narração (MP3)", f, file_name=f"{episode.get('Episódio', 'episodio')}.mp3",
+                mime="audio/mpeg", key=f"baixar_audio_{episode['ID']}"
+            )
+
+def render_episode_video(episode):
+    """Vídeo do episódio: só os clipes de cenas que mudaram são renderizados de novo"""
+    scenes = get_scene_engine().scenes(episode['ID'])
+    if not scenes:
+        return
+    
+    renderer = get_video_renderer()
+    if not renderer.available():
+        st.caption("🎬 Instale o ffmpeg para renderizar o vídeo do episódio.")
+        return
+    if st.button("🎬 Renderizar vídeo do episódio", key=f"video_{episode['ID']}"):
+        progress = st.progress(0.0, text="Preparando imagens e narrações...")
+        try:
+            result = renderer.render(
+                scenes,
+                on_progress=lambda done, total: progress.progress(done / total, text=f"Clipes: {done}/{total}")
+            )
+        except (RenderError, NarrationError, OSError) as e:
+            st.error(f"Erro ao renderizar o vídeo: {e}")
+        else:
+            st.session_state[f"video_episodio_{episode['ID']}"] = result["caminho"]
+            st.success(f"✅ {result['renderizados']} clipes renderizados, {result['reaproveitados']} reaproveitados")
+    
+    video_path = st.session_state.get(f"video_episodio_{episode['ID']}")
+    if video_path:
+        st.video(video_path)
+        with open(video_path, "rb") as f:
+            st.download_button(
+                "⬇️ Baixar vídeo (MP4)", f, file_name=f"{episode.get('Episódio', 'episodio')}.mp4",
+                mime="video/mp4", key=f"baixar_video_{episode['ID']}"
+            )
+
+# Cartões de episódio e de personagem: cada um é um fragmento, então editar um cartão
+# re-renderiza só ele (sem reler a planilha nem redesenhar a lista inteira)
+@st.fragment
+def render_episode_card(episode_id, background):
+    ep = get_sheet_replica().record("Episodios", episode_id)
+    if ep is None:
+        return
+    
+    with st.expander(f"📖 {ep.get('Episódio', 'Sem título')} - {ep.get('Status', 'Sem status')}"):
+        col1, col2 = st.columns([3, 1])
+        
+        with col1:
+            st.write(f"**Descrição:** {ep.get('Descrição Curta', '')}")
+            st.write(f"**Moral:** {ep.get('Moral', '')}")
+        
+        with col2:
+            current_status = ep.get('Status', 'Aguardando Aprovação')
+            new_status = st.selectbox(
+                "Status:",
+                ["Aguardando Aprovação", "Approved", "Pendente", "Rejected"],
+                index=["Aguardando Aprovação", "Approved", "Pendente", "Rejected"].index(current_status) if current_status in ["Aguardando Aprovação", "Approved", "Pendente", "Rejected"] else 0,
+                key=f"status_{episode_id}"
+            )
+            
+            if new_status != current_status:
+                # O callback grava antes de o fragmento ser redesenhado: o cartão já volta atualizado
+                st.button(
+                    f"💾 Salvar Status",
+                    key=f"save_{episode_id}",
+                    on_click=save_episode_status,
+                    args=(episode_id, background)
+                )
+            if st.session_state.pop(f"generate_characters_{episode_id}", False):
+                create_characters_for_approved_episode(ep)
+            
+            # Indicador visual do status
+            if new_status == "Approved":
+                st.success("✅ Aprovado")
+            elif new_status == "Rejected":
+                st.error("❌ Rejeitado")
+            elif new_status == "Pendente":
+                st.warning("⏳ Pendente")
+            else:
+                st.info("⏰ Aguardando")
+
+def render_variant_picker(personagem, grid_url, task_id, background):
+    """Variações V1–V4 recortadas localmente da grade: comparar na hora, upscale só da escolhida"""
+    character_id = personagem.get('ID')
+    image_store = get_image_store()
+    image_store.prefetch_variants([grid_url])
+    if not st.checkbox("🔲 Ver variações", key=f"variants_{character_id}"):
+        return
+    try:
+        thumbnails = image_store.variant_thumbnails(grid_url)
+    except Exception as e:
+        st.write(f"🖼️ Variações indisponíveis: {e}")
+        return
+    for row in (0, 2):
+        for col, index in zip(st.columns(2), (row + 1, row + 2)):
+            col.image(thumbnails[index - 1], caption=f"V{index}")
+    
+    index = st.radio(
+        "Variação:", [1, 2, 3, 4], format_func=lambda i: f"V{i}", horizontal=True,
+        key=f"variant_choice_{character_id}"
+    )
+    if st.checkbox("🔍 Variação em tamanho real", key=f"variant_full_{character_id}"):
+        st.image(image_store.variants(grid_url)[index - 1])
+    if st.button(f"⬆️ Upscale V{index}", key=f"upscale_{character_id}"):
+        if background:
+            enqueue_upscale_job(personagem, task_id, index)
+            st.info("📥 Upscale enfileirado")
+        else:
+            result = upscale_character_image(task_id, index)
+            image_url = result_image_url(result) if result else None
+            if image_url and save_character_image_links({character_id: image_url}):
+                st.success(f"✅ V{index} em alta resolução salva!")
+
+@st.fragment
+def render_character_card(character_id, background, upscale=None):
+    personagem = get_sheet_replica().record("Personagens", character_id)
+    if personagem is None:
+        return
+    image_store = get_image_store()
+    
+    with st.expander(f"👤 {personagem.get('Nome', 'Sem nome')} - {personagem.get('Status', 'Sem status')}"):
+        col1, col2, col3 = st.columns([1, 2, 1])
+        
+        with col1:
+            # Tentar exibir imagem se houver link
+            img_link = personagem.get('Link Imagem') or personagem.get('Link', '')
+            if img_link and img_link.startswith('http'):
+                try:
+                    show_thumbnail(img_link, caption=personagem.get('Nome', ''), width=200)
+                    # Tamanho real só sob demanda
+                    if st.checkbox("🔍 Tamanho real", key=f"full_img_{character_id}"):
+                        st.image(image_store.original(img_link))
+                except:
+                    st.write("🖼️ Imagem não disponível")
+                # Link ainda é a grade 2×2 de um /imagine: escolher a variação antes do upscale
+                origin = get_prompt_cache().find_by_image(img_link)
+                if origin and origin.get("task_id"):
+                    render_variant_picker(personagem, img_link, origin["task_id"], background)
+            else:
+                st.write("🖼️ Aguardando imagem")
+        
+        with col2:
+            st.write(f"**Papel:** {personagem.get('Papel', '')}")
+            st.write(f"**Descrição:** {personagem.get('Descrição', '')}")
+            
+            # Campo para updates
+            update_text = st.text_area(
+                "Atualizações/Correções:",
+                placeholder="Digite aqui se precisar de ajustes...",
+                key=f"update_char_{character_id}"
+            )
+        
+        with col3:
+            current_status = personagem.get('Status', 'Pendente')
+            new_status = st.selectbox(
+                "Status:",
+                ["Gerando imagem", "Approved", "Pendente", "Rejected"],
+                index=["Gerando imagem", "Approved", "Pendente", "Rejected"].index(current_status) if current_status in ["Gerando imagem", "Approved", "Pendente", "Rejected"] else 2,
+                key=f"char_status_{character_id}"
+            )
+            
+            if new_status == "Approved":
+                st.success("✅ Aprovado")
+            elif new_status == "Rejected":
+                st.error("❌ Rejeitado")
+                if st.button(f"🔄 Regenerar", key=f"regen_{character_id}"):
+                    # Regenerar = nova variação explícita: não usar o cache
+                    if background:
+                        enqueue_image_job(personagem, fresh=True, upscale=upscale)
+                        st.info("📥 Regeneração enfileirada")
+                    else:
+                        st.info("🎨 Regenerando personagem...")
+                        result = generate_character_images_piapi(
+                            personagem.get('Prompt Imagem', ''),
+                            personagem.get('Nome', ''),
+                            fresh=True
+                        )
+                        if result and upscale:
+                            index = get_image_store().best_variant(result_image_url(result)) if upscale == "auto" else upscale
+                            result = upscale_character_image(result.get("task_id"), index)
+                        image_url = result_image_url(result) if result else None
+                        if image_url and save_character_image_links({character_id: image_url}):
+                            st.success("✅ Nova imagem gerada!")
+                            show_thumbnail(image_url, width=200)
+            elif new_status == "Gerando imagem":
+                st.info("🎨 Gerando...")
+            else:
+                st.warning("⏳ Pendente")
+
 # Título principal
 st.title("📖 Tenda dos Pequenos - Sistema de Vídeos Bíblicos")
 st.markdown("---")
@@ -570,6 +1129,16 @@ tab_selected = st.sidebar.selectbox(
     ["Episódios", "Personagens Visuais", "Cenas"]
 )
 
+# Aprovações e gerações vão para a fila em vez de travar a sessão
+background = st.sidebar.toggle("⚙️ Processar em segundo plano", value=True)
+# Pipeline imagine → upscale: sem esperar a escolha manual da variação
+auto_upscale = UPSCALE_MODES[st.sidebar.selectbox("⬆️ Upscale automático", list(UPSCALE_MODES))]
+# Desligado: os personagens vêm de uma run nova (e a resposta nova substitui a memorizada)
+st.sidebar.toggle("♻️ Reaproveitar respostas dos Assistants", value=True, key="assistant_memo")
+with st.sidebar:
+    st.markdown("**📋 Tarefas**")
+    render_jobs_panel()
+
 # Aba 1: Episódios
 if tab_selected == "Episódios":
     st.header("📚 Ideias de Episódios")
@@ -578,70 +1147,91 @@ if tab_selected == "Episódios":
     col1, col2, col3 = st.columns([2, 1, 1])
     with col1:
         num_ideias = st.number_input("Quantas novas ideias gerar?", min_value=0, max_value=10, value=0)
+        salvar_conforme_chegam = st.checkbox("Salvar cada episódio na planilha assim que chegar")
     with col2:
-        if st.button("🎲 Gerar Episódios", type="primary"):
-            if num_ideias > 0:
-                with st.spinner(f"Gerando {num_ideias} novas ideias com OpenAI Assistant..."):
-                    new_episodes = generate_episodes(num_ideias)
-                    if new_episodes:
-                        # Adicionar à planilha
-                        if add_episodes_to_sheet(new_episodes):
-                            st.success(f"✅ {len(new_episodes)} episódios gerados e salvos na planilha!")
-                            st.rerun()  # Recarregar para mostrar novos dados
-                        else:
-                            st.error("Erro ao salvar na planilha")
-                    else:
-                        st.error("Erro ao gerar episódios")
-            else:
-                st.warning("Digite um número maior que 0")
+        gerar_episodios = st.button("🎲 Gerar Episódios", type="primary")
     
     with col3:
         if st.button("🔄 Atualizar Lista"):
+            try:
+                get_sheet_replica().sync()
+            except Exception as e:
+                st.error(f"Erro ao sincronizar com a planilha: {e}")
             st.rerun()
     
+    if gerar_episodios and background:
+        if num_ideias > 0:
+            get_job_queue().enqueue("episodios", {"num_episodes": num_ideias}, title=f"{num_ideias} episódios")
+            st.success("📥 Geração enfileirada! Os episódios aparecem na lista quando a tarefa terminar.")
+        else:
+            st.warning("Digite um número maior que 0")
+    elif gerar_episodios:
+        if num_ideias > 0:
+            # Cada episódio aparece (e opcionalmente é salvo) assim que o Assistant termina de escrevê-lo
+            novos = st.container()
+            saved = []
+            
+            def on_episode(ep):
+                with novos:
+                    st.info(f"📖 **{ep.get('episodio', 'Sem título')}** — {ep.get('descricao', '')}")
+                if salvar_conforme_chegam and add_episodes_to_sheet([ep]):
+                    saved.append(ep)
+            
+            with st.spinner(f"Gerando {num_ideias} novas ideias com OpenAI Assistant..."):
+                new_episodes = generate_episodes_streaming(num_ideias, on_episode)
+            
+            if new_episodes:
+                # Adicionar à planilha o que ainda não foi salvo
+                pending = [ep for ep in new_episodes if ep not in saved]
+                if not pending or add_episodes_to_sheet(pending):
+                    st.success(f"✅ {len(new_episodes)} episódios gerados e salvos na planilha!")
+                    st.rerun()  # Recarregar para mostrar novos dados
+                else:
+                    st.error("Erro ao salvar na planilha")
+            else:
+                st.error("Erro ao gerar episódios")
+        else:
+            st.warning("Digite um número maior que 0")
+    
     st.markdown("---")
     
-    # Carregar episódios da planilha
-    episodes_data = get_episodes_from_sheet()
+    # Carregar episódios da planilha (só a página visível vira widgets)
+    episodes_index = get_episodes_index()
     
-    if episodes_data:
-        st.subheader(f"📋 Episódios na Planilha ({len(episodes_data)} total)")
+    if len(episodes_index):
+        st.subheader(f"📋 Episódios na Planilha ({len(episodes_index)} total)")
+        total, page_items = render_list_filters(
+            episodes_index, "ep", EPISODES_PAGE_SIZE, "Buscar por título ou descrição:"
+        )
+        if not page_items:
+            st.info("🔍 Nenhum episódio corresponde ao filtro")
         
-        for i, ep in enumerate(episodes_data):
-            with st.expander(f"📖 {ep.get('Episódio', 'Sem título')} - {ep.get('Status', 'Sem status')}"):
-                col1, col2 = st.columns([3, 1])
-                
-                with col1:
-                    st.write(f"**Descrição:** {ep.get('Descrição Curta', '')}")
-                    st.write(f"**Moral:** {ep.get('Moral', '')}")
-                
-                with col2:
-                    current_status = ep.get('Status', 'Aguardando Aprovação')
-                    new_status = st.selectbox(
-                        "Status:",
-                        ["Aguardando Aprovação", "Approved", "Pendente", "Rejected"],
-                        index=["Aguardando Aprovação", "Approved", "Pendente", "Rejected"].index(current_status) if current_status in ["Aguardando Aprovação", "Approved", "Pendente", "Rejected"] else 0,
-                        key=f"status_{i}"
-                    )
-                    
-                    if new_status != current_status:
-                        if st.button(f"💾 Salvar Status", key=f"save_{i}"):
-                            if update_episode_status(i, new_status, ep):  # Passa os dados do episódio
-                                st.success("Status atualizado!")
-                                time.sleep(1)
-                                st.rerun()
-                            else:
-                                st.error("Erro ao atualizar")
-                    
-                    # Indicador visual do status
-                    if new_status == "Approved":
-                        st.success("✅ Aprovado")
-                    elif new_status == "Rejected":
-                        st.error("❌ Rejeitado")
-                    elif new_status == "Pendente":
-                        st.warning("⏳ Pendente")
-                    else:
-                        st.info("⏰ Aguardando")
+        for _, ep in page_items:
+            render_episode_card(ep['ID'], background)
+        
+        # Salvar de uma vez todos os status alterados (um único batch_update). Os cartões
+        # rodam como fragmentos, então as alterações são conferidas só no clique.
+        if page_items and st.button("💾 Salvar todos os status alterados", type="primary"):
+            replica = get_sheet_replica()
+            current = [replica.record("Episodios", ep['ID']) or ep for _, ep in page_items]
+            changed = [
+                (ep['ID'], st.session_state[f"status_{ep['ID']}"], ep)
+                for ep in current
+                if st.session_state.get(f"status_{ep['ID']}", ep.get('Status', 'Aguardando Aprovação')) != ep.get('Status', 'Aguardando Aprovação')
+            ]
+            if not changed:
+                st.info("Nenhum status alterado")
+            elif update_episodes_status([(ep_id, new_status) for ep_id, new_status, _ in changed]):
+                approved = [ep for _, new_status, ep in changed if new_status == "Approved"]
+                if approved and background:
+                    for ep in approved:
+                        enqueue_characters_job(ep, fresh=assistant_fresh())
+                elif approved:
+                    create_characters_for_approved_episodes(approved)
+                st.toast(f"✅ {len(changed)} status atualizados!")
+                st.rerun()
+            else:
+                st.error("Erro ao atualizar")
     else:
         st.info("📝 Nenhum episódio encontrado. Gere algumas ideias para começar!")
 
@@ -649,57 +1239,50 @@ if tab_selected == "Episódios":
 elif tab_selected == "Personagens Visuais":
     st.header("👥 Personagens Visuais")
     
-    # Carregar personagens da planilha
-    personagens_data = get_personagens_from_sheet()
+    # Carregar personagens da planilha (só a página visível vira widgets)
+    personagens_index = get_personagens_index()
     
-    if personagens_data:
-        st.subheader(f"👤 Personagens na Planilha ({len(personagens_data)} total)")
+    if len(personagens_index):
+        st.subheader(f"👤 Personagens na Planilha ({len(personagens_index)} total)")
+        total, page_items = render_list_filters(
+            personagens_index, "char", CHARACTERS_PAGE_SIZE, "Buscar por nome ou descrição:"
+        )
+        if not page_items:
+            st.info("🔍 Nenhum personagem corresponde ao filtro")
         
-        for i, personagem in enumerate(personagens_data):
-            with st.expander(f"👤 {personagem.get('Nome', 'Sem nome')} - {personagem.get('Status', 'Sem status')}"):
-                col1, col2, col3 = st.columns([1, 2, 1])
-                
-                with col1:
-                    # Tentar exibir imagem se houver link
-                    img_link = personagem.get('Link Imagem', '')
-                    if img_link and img_link.startswith('http'):
-                        try:
-                            st.image(img_link, caption=personagem.get('Nome', ''), width=200)
-                        except:
-                            st.write("🖼️ Imagem não disponível")
-                    else:
-                        st.write("🖼️ Aguardando imagem")
-                
-                with col2:
-                    st.write(f"**Papel:** {personagem.get('Papel', '')}")
-                    st.write(f"**Descrição:** {personagem.get('Descrição', '')}")
-                    
-                    # Campo para updates
-                    update_text = st.text_area(
-                        "Atualizações/Correções:",
-                        placeholder="Digite aqui se precisar de ajustes...",
-                        key=f"update_char_{i}"
-                    )
-                
-                with col3:
-                    current_status = personagem.get('Status', 'Pendente')
-                    new_status = st.selectbox(
-                        "Status:",
-                        ["Gerando imagem", "Approved", "Pendente", "Rejected"],
-                        index=["Gerando imagem", "Approved", "Pendente", "Rejected"].index(current_status) if current_status in ["Gerando imagem", "Approved", "Pendente", "Rejected"] else 2,
-                        key=f"char_status_{i}"
-                    )
-                    
-                    if new_status == "Approved":
-                        st.success("✅ Aprovado")
-                    elif new_status == "Rejected":
-                        st.error("❌ Rejeitado")
-                        if st.button(f"🔄 Regenerar", key=f"regen_{i}"):
-                            st.info("🎨 Regenerando personagem...")
-                    elif new_status == "Gerando imagem":
-                        st.info("🎨 Gerando...")
-                    else:
-                        st.warning("⏳ Pendente")
+        # Baixar (uma vez, em paralelo) as imagens da página que ainda não estão no disco
+        image_store = get_image_store()
+        image_store.prefetch([
+            p.get('Link Imagem') or p.get('Link', '')
+            for _, p in page_items
+            if str(p.get('Link Imagem') or p.get('Link', '')).startswith('http')
+        ])
+        
+        # Personagens que ainda não têm imagem (de todas as páginas): gerar todos de uma vez
+        sem_imagem = personagens_index.flagged("sem_imagem")
+        if sem_imagem and st.button(f"🎨 Gerar imagens pendentes ({len(sem_imagem)})", type="primary"):
+            if background:
+                for _, p in sem_imagem:
+                    enqueue_image_job(p, upscale=auto_upscale)
+                st.success(f"📥 {len(sem_imagem)} imagens enfileiradas!")
+            else:
+                # Nomes podem se repetir entre episódios: a chave inclui a linha
+                jobs = {f"{p.get('Nome', 'Sem nome')} #{i + 1}": (p['ID'], p.get('Prompt Imagem')) for i, p in sem_imagem}
+                results = generate_character_images_concurrently(
+                    [(name, prompt) for name, (_, prompt) in jobs.items()], upscale=auto_upscale
+                )
+                links = {
+                    jobs[name][0]: result_image_url(result)
+                    for name, result in results.items() if result_image_url(result)
+                }
+                if links and save_character_image_links(links):
+                    st.success(f"✅ {len(links)} imagens geradas!")
+                    st.rerun()
+                elif not links:
+                    st.error("❌ Nenhuma imagem foi gerada")
+        
+        for _, personagem in page_items:
+            render_character_card(personagem['ID'], background, auto_upscale)
     else:
         st.info("👥 Nenhum personagem encontrado. Os personagens são criados automaticamente quando um episódio é aprovado.")
 
@@ -708,8 +1291,8 @@ elif tab_selected == "Cenas":
     st.header("🎬 Cenas do Episódio")
     
     # Buscar episódios aprovados
-    episodes_data = get_episodes_from_sheet()
-    approved_episodes = [ep for ep in episodes_data if ep.get('Status') == 'Approved']
+    _, approved = get_episodes_index().query("Approved")
+    approved_episodes = [ep for _, ep in approved]
     
     if approved_episodes:
         # Seletor de episódio
@@ -721,27 +1304,48 @@ elif tab_selected == "Cenas":
         
         if episodio_selecionado:
             st.subheader(f"🎬 Cenas de: {episodio_selecionado}")
-            st.info("🚧 Sistema de cenas em desenvolvimento. Em breve você poderá visualizar e gerenciar as cenas aqui!")
+            episode = approved_episodes[episode_options.index(episodio_selecionado)]
             
-            # Placeholder para cenas futuras
-            st.markdown("### 📝 Próximas funcionalidades:")
-            st.markdown("- ✅ Geração automática de 5 cenas por episódio")
-            st.markdown("- ✅ Duas imagens por cena")
-            st.markdown("- ✅ Narração personalizada")
-            st.markdown("- ✅ Botão 'Próximas 5 cenas'")
+            if not CENAS_ASSISTANT_ID:
+                st.warning("⚠️ Configure CENAS_ASSISTANT_ID nas secrets para gerar as cenas.")
+            else:
+                engine = get_scene_engine()
+                pages_key = f"cenas_paginas_{episode['ID']}"
+                pages = st.session_state.setdefault(pages_key, 1)
+                
+                # Garante a página atual e já adianta a próxima em segundo plano
+                engine.ensure_page(episode, pages - 1)
+                busy = (
+                    engine.page_state(episode['ID'], pages - 1)["status"] == "gerando"
+                    or engine.images_pending(episode['ID'])
+                    or engine.narration_pending(episode['ID'])
+                )
+                st.fragment(render_scene_pages, run_every=2 if busy else None)(episode, pages)
+                
+                next_state = engine.page_state(episode['ID'], pages)
+                if next_state["status"] == "fim":
+                    st.caption("🏁 Fim do episódio")
+                else:
+                    label = "➡️ Próximas 5 cenas" + (" (prontas)" if next_state["status"] == "pronta" else "")
+                    if st.button(label, type="primary"):
+                        st.session_state[pages_key] = pages + 1
+                        st.rerun()
+                
+                render_episode_audio(episode)
+                render_episode_video(episode)
     else:
         st.warning("⚠️ Nenhum episódio aprovado encontrado. Aprove pelo menos um episódio na aba 'Episódios' para gerar cenas.")
 
 # Footer
 st.markdown("---")
 col1, col2, col3 = st.columns(3)
+episodes_index = get_episodes_index()
 with col1:
-    st.metric("📚 Episódios", len(get_episodes_from_sheet()))
+    st.metric("📚 Episódios", len(episodes_index))
 with col2:
-    st.metric("👥 Personagens", len(get_personagens_from_sheet()))
+    st.metric("👥 Personagens", len(get_personagens_index()))
 with col3:
-    approved_count = len([ep for ep in get_episodes_from_sheet() if ep.get('Status') == 'Approved'])
-    st.metric("✅ Aprovados", approved_count)
+    st.metric("✅ Aprovados", episodes_index.count("Approved"))
 
 st.markdown("🙏 **Tenda dos Pequenos** - Criando histórias bíblicas com amor e tecnologia")
 
@@ -749,6 +1353,59 @@ st.markdown("🙏 **Tenda dos Pequenos** - Criando histórias bíblicas com amor
 if st.sidebar.checkbox("🔧 Debug Info"):
     st.sidebar.write("**Planilha ID:**", SPREADSHEET_ID)
     st.sidebar.write("**Assistant ID:**", ASSISTANT_ID)
+    for aba, sync_stats in get_sheet_replica().stats().items():
+        synced_ago = sync_stats['sincronizado_ha_s']
+        st.sidebar.write(
+            f"**Réplica {aba}:** {sync_stats['linhas']} linhas, {sync_stats['pendentes']} pendentes, "
+            + (f"sincronizada há {synced_ago:.0f}s" if synced_ago is not None else "nunca sincronizada")
+        )
+        if sync_stats['erro']:
+            st.sidebar.warning(f"Sincronização de {aba}: {sync_stats['erro']}")
+    checkpoint_stats = get_checkpoints().stats()
+    st.sidebar.write(
+        f"**Checkpoints:** {checkpoint_stats['pendentes']} jobs retomáveis "
+        f"({', '.join(f'{n} {kind}' for kind, n in checkpoint_stats['por_tipo'].items()) or 'nenhum'}), "
+        f"{checkpoint_stats['retomados']} retomados"
+    )
+    prompt_cache_stats = get_prompt_cache().stats()
+    st.sidebar.write(
+        f"**Cache Midjourney:** {prompt_cache_stats['entradas']} prompts, "
+        f"{prompt_cache_stats['hits']} hits / {prompt_cache_stats['misses']} misses"
+    )
+    assistant_cache_stats = get_assistant_cache().stats()
+    st.sidebar.write(
+        f"**Memória Assistants:** {assistant_cache_stats['entradas']} respostas, "
+        f"{assistant_cache_stats['hits']} hits / {assistant_cache_stats['misses']} misses"
+    )
+    if st.sidebar.button("🗑️ Limpar memória dos Assistants"):
+        get_assistant_cache().clear()
+        st.sidebar.success("✅ Memória dos Assistants limpa")
+    webhook = get_webhook_receiver()
+    st.sidebar.write("**Webhook PIAPI:**", webhook.endpoint if webhook else "desativado (polling)")
+    poll_stats = POLL_STATS.summary()
+    if poll_stats["tarefas"]:
+        st.sidebar.write(
+            f"**Polling PIAPI:** {poll_stats['tarefas']} tarefas, p50 {poll_stats['p50_s']:.0f}s, "
+            f"p90 {poll_stats['p90_s']:.0f}s, {poll_stats['consultas_por_tarefa']:.1f} consultas/tarefa"
+        )
+    summary = trace.summary()
+    st.sidebar.write(
+        f"**Este rerun:** {summary['duracao_s'] * 1000:.0f} ms, {summary['requisicoes']} requisições, "
+        f"{summary['retries']} retries, {summary['bytes'] / 1024:.1f} KB"
+    )
+    if summary["spans"]:
+        st.sidebar.dataframe(pd.DataFrame(summary["spans"]).round(1), hide_index=True)
+    if summary["hosts"]:
+        st.sidebar.dataframe(
+            pd.DataFrame.from_dict(summary["hosts"], orient="index").round(3),
+        )
+    limiter_stats = rate_limit.stats()
+    if limiter_stats:
+        st.sidebar.write("**Limites por upstream** (fila, espera em ms):")
+        st.sidebar.dataframe(pd.DataFrame.from_dict(limiter_stats, orient="index").round(1))
+    if st.sidebar.button("📈 Exportar métricas (Prometheus)"):
+        path = TRACER.export_prometheus(METRICS_EXPORT_PATH or cache_path("metrics.prom"))
+        st.sidebar.success(f"✅ Métricas gravadas em {path}")
     if st.sidebar.button("Test Sheets Connection"):
         sheet = init_gsheet()
         if sheet:
@@ -770,7 +1427,8 @@ if st.sidebar.button("🧪 Teste Manual Personagens"):
         characters = generate_characters_for_episode(
             test_episode['Episódio'],
             test_episode['Descrição Curta'],
-            test_episode['Moral']
+            test_episode['Moral'],
+            fresh=assistant_fresh()
         )
         
         if characters:
@@ -0,0 +1,38 @@
+import hashlib
+import json
+
+from local_store import LruCache, cache_path
+from prompt_cache import normalize_prompt
+
+
+def cache_key(assistant_id, prompt):
+    payload = json.dumps([assistant_id, normalize_prompt(prompt)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AssistantCache(LruCache):
+    """Memória persistente (SQLite) assistant + prompt → resposta dos Assistants
+
+    A chave é o hash do ID do Assistant + prompt normalizado: reaprovar um episódio com o
+    mesmo título, descrição e moral devolve os mesmos personagens na hora, sem nova run paga.
+    """
+
+    table = "responses"
+    columns = """
+                    assistant_id TEXT NOT NULL,
+                    prompt TEXT NOT NULL,
+                    response TEXT NOT NULL"""
+
+    def __init__(self, path=None, max_entries=500, max_age_days=30):
+        super().__init__(path or cache_path("assistants.sqlite3"), max_entries, max_age_days)
+
+    def get(self, assistant_id, prompt):
+        """Resposta memorizada (texto) ou None"""
+        return self._lookup(cache_key(assistant_id, prompt), "response")
+
+    def put(self, assistant_id, prompt, response):
+        """Guarda a resposta (substitui a anterior do mesmo assistant + prompt)"""
+        self._store(cache_key(assistant_id, prompt), assistant_id, prompt, response)
+
+    def forget(self, assistant_id, prompt):
+        self._delete(cache_key(assistant_id, prompt))
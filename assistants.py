@@ -0,0 +1,350 @@
+import asyncio
+import json
+import os
+
+from http_pool import get_session
+from polling import PollScheduler, PollStats
+from tracing import traced
+
+# OPENAI_BASE_URL permite apontar para um servidor local (devtools/fake_openai.py)
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
+RUN_TERMINAL_STATUS = {"completed", "failed", "cancelled", "expired", "incomplete", "requires_action"}
+RUN_MAX_AGE = 600  # a OpenAI expira runs não concluídas em 10 minutos: checkpoint mais velho não vale
+
+# Tempos das execuções de Assistant, separados dos da PIAPI
+ASSISTANT_POLL_STATS = PollStats()
+
+
+class AssistantError(Exception):
+    """Falha numa execução de Assistant (erro HTTP, run falhou ou timeout)"""
+
+
+class AssistantTimeout(AssistantError):
+    """A run não terminou a tempo (com checkpoints, continua retomável)"""
+
+
+def parse_json_response(text):
+    """Remove cercas de markdown (```json ... ```) e faz json.loads"""
+    response_clean = text.strip()
+    if response_clean.startswith("```json"):
+        response_clean = response_clean[7:]
+    if response_clean.startswith("```"):
+        response_clean = response_clean[3:]
+    if response_clean.endswith("```"):
+        response_clean = response_clean[:-3]
+    return json.loads(response_clean.strip())
+
+
+class JsonArrayStreamParser:
+    """Parser incremental de um array JSON de objetos que chega em pedaços
+
+    feed() devolve cada objeto assim que ele fecha; cercas de markdown e texto fora do
+    JSON são ignorados, e um elemento malformado é descartado sem perder os outros.
+    """
+
+    def __init__(self):
+        self.errors = []
+        self._buffer = ""
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_depth = None
+
+    def feed(self, text):
+        objects = []
+        for char in text:
+            if self._object_depth is not None:
+                self._buffer += char
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"' and self._depth > 0:
+                self._in_string = True
+            elif char in "[{":
+                # Objeto de primeiro nível: dentro do array, ou resposta com um objeto só
+                if char == "{" and self._object_depth is None and self._depth <= 1:
+                    self._object_depth = self._depth
+                    self._buffer = char
+                self._depth += 1
+            elif char in "]}" and self._depth > 0:
+                self._depth -= 1
+                if char == "}" and self._depth == self._object_depth:
+                    try:
+                        objects.append(json.loads(self._buffer))
+                    except json.JSONDecodeError as e:
+                        self.errors.append((str(e), self._buffer))
+                    self._buffer = ""
+                    self._object_depth = None
+        return objects
+
+
+class AssistantsClient:
+    """Cliente da API de Assistants (v2): uma chamada cria thread + run, depois polling adaptativo
+
+    run() é síncrono; arun() e run_many() permitem executar vários Assistants ao mesmo tempo
+    (episódios + personagens de vários episódios aprovados). Com um CheckpointStore, a
+    thread/run de cada pedido fica gravada até a resposta ser lida: o mesmo pedido depois de
+    um timeout, rerun ou reinício volta a consultar a run em vez de pagar outra. Com um
+    AssistantCache, a resposta de cada assistant + prompt fica memorizada. fresh=True não lê
+    nem grava a memória e não usa checkpoints: é sempre uma run nova, mesmo com outra
+    chamada igual em andamento.
+    """
+
+    def __init__(self, api_key, max_wait=60, initial_interval=0.5, max_interval=4.0, checkpoints=None, cache=None):
+        self.max_wait = max_wait
+        self.checkpoints = checkpoints
+        self.cache = cache
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.session = get_session(OPENAI_BASE_URL)
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "OpenAI-Beta": "assistants=v2"
+        }
+
+    @traced("assistant.run")
+    def run(self, assistant_id, prompt, fresh=False):
+        """Executa o Assistant com a mensagem prompt e devolve o texto da resposta"""
+        cached = self._cached(assistant_id, prompt, fresh)
+        if cached is not None:
+            return cached
+        checkpoint = self._checkpoint(assistant_id, prompt, fresh)
+        if checkpoint:
+            thread_id, run_id = checkpoint["ids"]["thread_id"], checkpoint["ref"]
+        else:
+            run = self._create_thread_and_run(assistant_id, prompt)
+            thread_id, run_id = run["thread_id"], run["id"]
+            self._save_checkpoint(assistant_id, prompt, thread_id, run_id, fresh)
+        text = self._finish_run(thread_id, run_id, wait=not checkpoint or checkpoint["stage"] != "concluido")
+        self._remember(assistant_id, prompt, text, fresh)
+        return text
+
+    async def arun(self, assistant_id, prompt, fresh=False):
+        return await asyncio.to_thread(self.run, assistant_id, prompt, fresh)
+
+    async def arun_many(self, jobs, fresh=False):
+        """Executa [(assistant_id, prompt)] em paralelo; exceções voltam no lugar do texto"""
+        return await asyncio.gather(
+            *(self.arun(assistant_id, prompt, fresh) for assistant_id, prompt in jobs),
+            return_exceptions=True
+        )
+
+    def run_many(self, jobs, fresh=False):
+        """Versão síncrona de arun_many (para o script do Streamlit)"""
+        return asyncio.run(self.arun_many(jobs, fresh))
+
+    @traced("assistant.stream")
+    def stream(self, assistant_id, prompt, fresh=False):
+        """Executa o Assistant em modo streaming, gerando os pedaços de texto conforme chegam
+
+        Uma resposta memorizada, ou a de uma run que ficou pela metade com o mesmo pedido
+        (stream cortado, rerun), vem inteira num pedaço só, sem criar outra run. Se a conexão
+        fecha sem evento final, o restante da resposta é lido da própria run.
+        """
+        cached = self._cached(assistant_id, prompt, fresh)
+        if cached is not None:
+            yield cached
+            return
+        checkpoint = self._checkpoint(assistant_id, prompt, fresh)
+        if checkpoint:
+            text = self._finish_run(
+                checkpoint["ids"]["thread_id"], checkpoint["ref"], wait=checkpoint["stage"] != "concluido"
+            )
+            self._remember(assistant_id, prompt, text, fresh)
+            yield text
+            return
+
+        response = self.session.post(
+            f"{OPENAI_BASE_URL}/threads/runs",
+            headers=self.headers,
+            json={
+                "assistant_id": assistant_id,
+                "thread": {
+                    "messages": [{"role": "user", "content": prompt}]
+                },
+                "stream": True
+            },
+            stream=True
+        )
+        with response:
+            if response.status_code != 200:
+                raise AssistantError(f"Erro ao executar assistant: {response.text}")
+
+            run_id = thread_id = None
+            parts = []
+            for event, data in _iter_sse(response):
+                if event == "thread.run.created":
+                    run = json.loads(data)
+                    run_id, thread_id = run["id"], run["thread_id"]
+                    self._save_checkpoint(assistant_id, prompt, run["thread_id"], run_id, fresh)
+                elif event == "thread.message.delta":
+                    for part in json.loads(data)["delta"].get("content", []):
+                        if part.get("type") == "text":
+                            parts.append(part["text"].get("value", ""))
+                            yield parts[-1]
+                elif event in ("thread.run.failed", "thread.run.cancelled", "thread.run.expired",
+                               "thread.run.incomplete", "thread.run.requires_action"):
+                    run = json.loads(data)
+                    self._forget(run.get("id", run_id))
+                    error = run.get("last_error")
+                    raise AssistantError(f"Assistant falhou: {run.get('status')}" + (f" - {error}" if error else ""))
+                elif event == "error":
+                    raise AssistantError(f"Erro no streaming do assistant: {data}")
+                elif event in ("thread.run.completed", "done"):
+                    self._forget(run_id)
+                    self._remember(assistant_id, prompt, "".join(parts), fresh)
+                    return
+
+        # Conexão fechou sem evento final: a resposta que chegou pode estar cortada
+        if run_id is None:
+            raise AssistantError("Erro no streaming do assistant: stream interrompido")
+        text = self._finish_run(thread_id, run_id)
+        streamed = "".join(parts)
+        if not text.startswith(streamed):
+            raise AssistantError("Erro no streaming do assistant: stream interrompido")
+        self._remember(assistant_id, prompt, text, fresh)
+        if text[len(streamed):]:
+            yield text[len(streamed):]
+
+    def stream_json_objects(self, assistant_id, prompt, fresh=False):
+        """Gera cada objeto do array JSON da resposta assim que ele termina de chegar"""
+        parser = JsonArrayStreamParser()
+        for chunk in self.stream(assistant_id, prompt, fresh):
+            yield from parser.feed(chunk)
+
+    def _finish_run(self, thread_id, run_id, wait=True):
+        """Espera a run (se preciso) e lê a resposta; o checkpoint só sai com o texto em mãos"""
+        if wait:
+            try:
+                self._wait_for_run(thread_id, run_id)
+            except AssistantTimeout:
+                raise
+            except AssistantError:
+                self._forget(run_id)
+                raise
+            if self.checkpoints:
+                self.checkpoints.set_stage(run_id, "concluido")
+        text = self._latest_message_text(thread_id, run_id)
+        self._forget(run_id)
+        return text
+
+    def _cached(self, assistant_id, prompt, fresh):
+        if not self.cache or fresh:
+            return None
+        return self.cache.get(assistant_id, prompt)
+
+    def _remember(self, assistant_id, prompt, text, fresh=False):
+        # Respostas de chamadas fresh nunca são lidas de volta: não ocupam a memória
+        if self.cache and text and not fresh:
+            self.cache.put(assistant_id, prompt, text)
+
+    def _checkpoint(self, assistant_id, prompt, fresh=False):
+        # fresh pede uma run nova: retomar a de outra chamada igual em andamento duplicaria a resposta
+        if not self.checkpoints or fresh:
+            return None
+        return self.checkpoints.find("assistant", [assistant_id, prompt], max_age=RUN_MAX_AGE)
+
+    def _save_checkpoint(self, assistant_id, prompt, thread_id, run_id, fresh=False):
+        if self.checkpoints and not fresh:
+            self.checkpoints.save("assistant", [assistant_id, prompt], run_id, {"thread_id": thread_id})
+
+    def _forget(self, run_id):
+        if self.checkpoints and run_id:
+            self.checkpoints.finish(run_id)
+
+    @traced("assistant.create_run")
+    def _create_thread_and_run(self, assistant_id, prompt):
+        response = self.session.post(
+            f"{OPENAI_BASE_URL}/threads/runs",
+            headers=self.headers,
+            json={
+                "assistant_id": assistant_id,
+                "thread": {
+                    "messages": [{"role": "user", "content": prompt}]
+                }
+            }
+        )
+        if response.status_code != 200:
+            raise AssistantError(f"Erro ao executar assistant: {response.text}")
+        return response.json()
+
+    @traced("assistant.poll")
+    def _fetch_run(self, thread_id, run_id):
+        response = self.session.get(
+            f"{OPENAI_BASE_URL}/threads/{thread_id}/runs/{run_id}",
+            headers=self.headers
+        )
+        if response.status_code != 200:
+            raise AssistantError(f"Erro ao verificar status: {response.text}")
+        return response.json()
+
+    def _wait_for_run(self, thread_id, run_id):
+        scheduler = PollScheduler(
+            lambda rid: self._fetch_run(thread_id, rid),
+            deadline=self.max_wait,
+            initial_interval=self.initial_interval,
+            max_interval=self.max_interval,
+            stats=ASSISTANT_POLL_STATS,
+            terminal=RUN_TERMINAL_STATUS,
+            success="completed",
+        )
+        scheduler.add(run_id)
+        run = scheduler.run()[run_id]
+
+        status = run.get("status")
+        if status == "completed":
+            return run
+        if status == "timeout":
+            if self.checkpoints:
+                raise AssistantTimeout(
+                    "Timeout - Assistant demorou muito para responder (a execução continua; "
+                    "tente de novo para aproveitar o resultado)"
+                )
+            raise AssistantTimeout("Timeout - Assistant demorou muito para responder")
+        error = run.get("last_error") or run.get("error")
+        if error:
+            raise AssistantError(f"Assistant falhou: {status} - {error}")
+        raise AssistantError(f"Assistant falhou: {status}")
+
+    @traced("assistant.messages")
+    def _latest_message_text(self, thread_id, run_id):
+        response = self.session.get(
+            f"{OPENAI_BASE_URL}/threads/{thread_id}/messages",
+            headers=self.headers,
+            params={"run_id": run_id, "order": "desc", "limit": 1}
+        )
+        if response.status_code != 200:
+            raise AssistantError(f"Erro ao buscar mensagens: {response.text}")
+
+        messages = response.json()["data"]
+        if not messages:
+            raise AssistantError("Nenhuma resposta encontrada")
+        return messages[0]["content"][0]["text"]["value"]
+
+
+def _iter_sse(response):
+    """Lê um stream Server-Sent Events, gerando (evento, dados)
+
+    SSE é sempre UTF-8: sem charset no Content-Type, decode_unicode do requests usaria ISO-8859-1.
+    """
+    event, data = None, []
+    for raw in response.iter_lines():
+        line = raw.decode("utf-8")
+        if not line:
+            if event or data:
+                yield event, "\n".join(data)
+            event, data = None, []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+    if event or data:
+        yield event, "\n".join(data)
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import threading
+import time
+
+from local_store import cache_path, connect
+
+
+def checkpoint_key(kind, request):
+    payload = json.dumps([kind, request], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CheckpointStore:
+    """Jobs upstream em andamento (SQLite): IDs e etapa, para retomar em vez de refazer
+
+    Cada run de Assistant ou tarefa PIAPI é gravada assim que o upstream devolve o ID,
+    com a requisição que a originou (assistant + prompt, prompt Midjourney, upscale de
+    uma tarefa). Se a espera estoura, o script é interrompido por um rerun ou o processo
+    reinicia, o mesmo pedido encontra o checkpoint e volta a consultar o job pago em vez
+    de criar outro. O checkpoint some quando o resultado é entregue ou o job falha de vez.
+    """
+
+    def __init__(self, path=None, max_age_hours=24):
+        self.path = path or cache_path("checkpoints.sqlite3")
+        self.max_age = max_age_hours * 3600
+        self.resumed = 0
+        self._lock = threading.Lock()
+        with connect(self.path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    key TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    request TEXT NOT NULL,
+                    ref TEXT NOT NULL,
+                    ids TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS checkpoints_ref ON checkpoints (ref)")
+
+    def find(self, kind, request, max_age=None):
+        """Checkpoint do mesmo pedido ({"ref", "ids", "stage", "created_at"}) ou None
+
+        max_age (segundos) descarta jobs que o upstream já terá expirado.
+        """
+        max_age = self.max_age if max_age is None else min(max_age, self.max_age)
+        key = checkpoint_key(kind, request)
+        with self._lock, connect(self.path) as conn:
+            row = conn.execute(
+                "SELECT ref, ids, stage, created_at FROM checkpoints WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[3] > max_age:
+                conn.execute("DELETE FROM checkpoints WHERE key = ?", (key,))
+                return None
+            self.resumed += 1
+        return {"ref": row[0], "ids": json.loads(row[1]), "stage": row[2], "created_at": row[3]}
+
+    def save(self, kind, request, ref, ids=None, stage="enviado"):
+        """Grava o job recém-criado; ref é o ID consultado no polling (run_id, task_id)"""
+        now = time.time()
+        with self._lock, connect(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    checkpoint_key(kind, request),
+                    kind,
+                    json.dumps(request, ensure_ascii=False),
+                    ref,
+                    json.dumps(ids or {}),
+                    stage,
+                    now,
+                    now,
+                )
+            )
+            conn.execute("DELETE FROM checkpoints WHERE created_at < ?", (now - self.max_age,))
+
+    def set_stage(self, ref, stage):
+        with self._lock, connect(self.path) as conn:
+            conn.execute(
+                "UPDATE checkpoints SET stage = ?, updated_at = ? WHERE ref = ?", (stage, time.time(), ref)
+            )
+
+    def finish(self, ref):
+        """Resultado entregue (ou falha definitiva): não há mais o que retomar"""
+        with self._lock, connect(self.path) as conn:
+            conn.execute("DELETE FROM checkpoints WHERE ref = ?", (ref,))
+
+    def pending(self):
+        with self._lock, connect(self.path) as conn:
+            rows = conn.execute(
+                "SELECT kind, ref, stage, created_at FROM checkpoints ORDER BY created_at"
+            ).fetchall()
+        return [{"tipo": kind, "id": ref, "etapa": stage, "criado_em": created_at} for kind, ref, stage, created_at in rows]
+
+    def stats(self):
+        with self._lock, connect(self.path) as conn:
+            by_kind = dict(conn.execute("SELECT kind, COUNT(*) FROM checkpoints GROUP BY kind").fetchall())
+        return {"pendentes": sum(by_kind.values()), "por_tipo": by_kind, "retomados": self.resumed}
@@ -0,0 +1,329 @@
+"""Benchmarks do app contra servidores falsos de OpenAI, PIAPI e Google Sheets
+
+Cada cenário roda num subprocesso próprio (cache local vazio, servidores novos) e devolve
+suas métricas em JSON; o processo principal compara com devtools/benchmark_baseline.json
+e termina com código 1 se alguma métrica piorou além da tolerância. Todas as métricas são
+"menor é melhor": tempos em segundos (sufixo _s) e contagens de requisições.
+
+Cenários:
+    rerun_N        app.py no AppTest com N episódios e N personagens: primeira execução,
+                   rerun das abas Episódios e Personagens, requisições upstream por rerun
+    aprovacao      aprovar um episódio até as imagens dos personagens ficarem prontas
+                   (segundo plano), com o custo de polling de Assistants e PIAPI
+    piapi_service  PiapiService gerando imagens em sequência: tempo e /fetch por tarefa
+
+Uso:
+    python -m devtools.benchmark                    # roda tudo e compara com o baseline
+    python -m devtools.benchmark --update-baseline  # grava os resultados como baseline
+    python -m devtools.benchmark --only rerun_100 --latency 0.05 --error-rate 0.02
+
+O baseline depende da máquina: gere-o de novo (--update-baseline) onde o benchmark roda.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from devtools.fake_openai import FakeOpenAI
+from devtools.fake_piapi import FakePiapi
+from devtools.fake_sheets import FakeSheets
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(APP_DIR, "app.py")
+BASELINE_PATH = os.path.join(APP_DIR, "devtools", "benchmark_baseline.json")
+CATALOG_SIZES = (10, 100, 1000)
+SCENARIOS = [f"rerun_{size}" for size in CATALOG_SIZES] + ["aprovacao", "piapi_service"]
+DEFAULT_TOLERANCE = 0.25  # piora relativa aceita sobre o baseline
+TIME_SLACK = 0.25  # segundos de folga absoluta (ruído de medição em tempos pequenos)
+COUNT_SLACK = 0.5  # requisições de folga absoluta
+# Opções que mudam o resultado: o baseline só vale para a mesma configuração
+CONFIG_OPTIONS = ("latency", "error_rate", "quota_per_minute", "run_duration", "task_duration", "reruns")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", nargs="*", choices=SCENARIOS, help="cenários a rodar (padrão: todos)")
+    parser.add_argument("--update-baseline", action="store_true", help="grava os resultados como baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--latency", type=float, default=0.0, help="latência de cada requisição (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fração de respostas 500")
+    parser.add_argument("--quota-per-minute", type=int, default=None, help="quota por servidor (429 acima)")
+    parser.add_argument("--run-duration", type=float, default=1.0, help="duração de uma run de Assistant (s)")
+    parser.add_argument("--task-duration", type=float, default=1.0, help="duração de uma tarefa PIAPI (s)")
+    parser.add_argument("--reruns", type=int, default=5, help="reruns medidos por aba")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)  # execução de um cenário no subprocesso
+    args = parser.parse_args()
+
+    if args.scenario:
+        print(json.dumps(run_scenario(args.scenario, args)))
+        return
+
+    config = {option: getattr(args, option) for option in CONFIG_OPTIONS}
+    results = {}
+    for scenario in args.only or SCENARIOS:
+        print(f"▶ {scenario}...", flush=True)
+        results[scenario] = _run_isolated(scenario, args)
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump({"configuracao": config, "cenarios": results}, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        _print_table(results, {})
+        print(f"Baseline gravado em {BASELINE_PATH}")
+        return
+
+    baseline = _load_baseline()
+    if baseline.get("configuracao") != config:
+        _print_table(results, {})
+        print("⚠️ Configuração diferente da do baseline: resultados não comparados")
+        return
+    regressions = _print_table(results, baseline["cenarios"], args.tolerance)
+    if regressions:
+        print(f"❌ {len(regressions)} métrica(s) pioraram além de {args.tolerance:.0%}: " + ", ".join(regressions))
+        sys.exit(1)
+    print("✅ Nenhuma regressão")
+
+
+def run_scenario(scenario, args):
+    """Roda um cenário neste processo (chamado no subprocesso isolado)"""
+    rows = int(scenario.rsplit("_", 1)[1]) if scenario.startswith("rerun_") else 10
+    sheets, openai, piapi = _start_fakes(args, rows)
+    try:
+        if scenario.startswith("rerun_"):
+            return _bench_reruns(args, sheets, openai, piapi)
+        if scenario == "aprovacao":
+            return _bench_approval(sheets, openai, piapi)
+        if scenario == "piapi_service":
+            return _bench_piapi_service(piapi)
+        raise ValueError(scenario)
+    finally:
+        for fake in (sheets, openai, piapi):
+            fake.stop()
+
+
+def catalog(rows, image_base_url):
+    """Abas da planilha falsa: rows episódios e rows personagens (todos já com imagem)"""
+    statuses = ["Aguardando Aprovação", "Approved", "Pendente", "Rejected"]
+    return {
+        "Episodios": [["Episódio", "Descrição Curta", "Moral", "Status", "ID"]] + [
+            [f"Episódio {i}", f"Descrição curta do episódio {i}", "Deus cuida de nós", statuses[i % 4], f"ep{i:05d}"]
+            for i in range(rows)
+        ],
+        "Personagens": [["Nome", "Papel", "Descrição", "Prompt Imagem", "Status", "Link", "ID"]] + [
+            [f"Personagem {i}", "Coadjuvante", f"Descrição do personagem {i}", f"personagem {i}, 3D Pixar style",
+             "Pendente", f"{image_base_url}/images/seed{i}.png", f"ch{i:05d}"]
+            for i in range(rows)
+        ],
+    }
+
+
+def _start_fakes(args, rows):
+    upstream = {"latency": args.latency, "error_rate": args.error_rate, "quota_per_minute": args.quota_per_minute}
+    openai = FakeOpenAI(run_duration=args.run_duration, **upstream).start()
+    piapi = FakePiapi(task_duration=args.task_duration, **upstream).start()
+    sheets = FakeSheets(catalog(rows, piapi.url), **upstream).start()
+    # Lidos quando o app importa assistants/piapi_client (depois daqui, dentro do AppTest)
+    os.environ["OPENAI_BASE_URL"] = openai.base_url
+    os.environ["PIAPI_BASE_URL"] = piapi.base_url
+
+    import gspread
+    from google.auth.credentials import AnonymousCredentials
+    from google.oauth2.service_account import Credentials
+
+    authorize = gspread.authorize
+    mock.patch.object(
+        gspread, "authorize",
+        lambda credentials, session=None, **kwargs: authorize(credentials, session=sheets.install(session), **kwargs)
+    ).start()
+    mock.patch.object(Credentials, "from_service_account_info", lambda *a, **k: AnonymousCredentials()).start()
+    return sheets, openai, piapi
+
+
+def _new_app():
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.secrets["OPENAI_API_KEY"] = "sk-benchmark-000000"
+    at.secrets["PIAPI_API_KEY"] = "piapi-benchmark"
+    at.secrets["google_credentials"] = {"type": "service_account"}
+    return at
+
+
+def _timed_run(at):
+    start = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(f"Exceção no app: {at.exception[0].message}")
+    return elapsed
+
+
+def _upstream_requests(*fakes):
+    """Requisições às APIs (sem contar os downloads de imagem do servidor da PIAPI falsa)"""
+    return sum(
+        count for fake in fakes for endpoint, count in fake.requests.items()
+        if not endpoint.startswith("/images/")
+    )
+
+
+def _bench_reruns(args, sheets, openai, piapi):
+    # Bibliotecas importadas antes: a primeira execução mede o app, não o disco frio
+    import gspread, openai as openai_sdk, pandas, PIL.Image  # noqa: F401
+
+    at = _new_app()
+    first_run = _timed_run(at)
+    _timed_run(at)  # aquecimento (caches de índice e fragmentos)
+
+    before = _upstream_requests(sheets, openai, piapi)
+    episodes = [_timed_run(at) for _ in range(args.reruns)]
+    at.sidebar.selectbox[0].set_value("Personagens Visuais")
+    _timed_run(at)  # primeira visita: baixa as miniaturas da página
+    characters = [_timed_run(at) for _ in range(args.reruns)]
+    requests = _upstream_requests(sheets, openai, piapi) - before
+
+    return {
+        "primeira_execucao_s": round(first_run, 3),
+        "rerun_episodios_s": round(statistics.median(episodes), 3),
+        "rerun_personagens_s": round(statistics.median(characters), 3),
+        "requisicoes_por_rerun": round(requests / (2 * args.reruns), 2),
+    }
+
+
+def _bench_approval(sheets, openai, piapi, timeout=180):
+    at = _new_app()
+    _timed_run(at)
+    episode_id = "ep00000"  # "Aguardando Aprovação" no catálogo
+    at.selectbox(key=f"status_{episode_id}").set_value("Approved")
+    _timed_run(at)
+
+    start = time.perf_counter()
+    at.button(key=f"save_{episode_id}").click()
+    _timed_run(at)
+
+    # Personagens prontos: o botão de imagens pendentes aparece na aba Personagens
+    at.sidebar.selectbox[0].set_value("Personagens Visuais")
+    pending = _wait_for(at, lambda: _pending_images_button(at), start + timeout)
+    characters_ready = time.perf_counter() - start
+    pending.click()
+    _timed_run(at)
+    _wait_for(at, lambda: _pending_images_button(at) is None, start + timeout)
+    images_ready = time.perf_counter() - start
+
+    runs = openai.requests["/v1/threads/runs"]
+    tasks = piapi.requests["/mj/v2/imagine"] + piapi.requests["/mj/v2/upscale"]
+    return {
+        "aprovacao_ate_personagens_s": round(characters_ready, 2),
+        "aprovacao_ate_imagens_s": round(images_ready, 2),
+        "consultas_por_run_assistant": round(openai.requests["/v1/threads/{id}/runs/{id}"] / max(runs, 1), 2),
+        "fetch_por_tarefa_piapi": round(piapi.requests["/mj/v2/fetch"] / max(tasks, 1), 2),
+        "requisicoes_planilha": _upstream_requests(sheets),
+    }
+
+
+def _pending_images_button(at):
+    return next((b for b in at.button if b.label.startswith("🎨 Gerar imagens pendentes")), None)
+
+
+def _wait_for(at, condition, deadline, interval=0.2):
+    while time.perf_counter() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(interval)
+        _timed_run(at)
+    raise TimeoutError("Cenário não terminou no tempo limite")
+
+
+def _bench_piapi_service(piapi, tasks=4):
+    from streamlit.testing.v1 import AppTest
+
+    os.environ["BENCHMARK_PIAPI_TASKS"] = str(tasks)
+    at = AppTest.from_function(_piapi_service_script, default_timeout=120)
+    at.secrets["PIAPI_API_KEY"] = "piapi-benchmark"
+    elapsed = _timed_run(at)
+    if at.session_state["bench_falhas"]:
+        raise RuntimeError(f"{at.session_state['bench_falhas']} tarefas falharam")
+    return {
+        "tempo_por_imagem_s": round(at.session_state["bench_tempo"] / tasks, 2),
+        "execucao_s": round(elapsed, 2),
+        "fetch_por_tarefa": round(piapi.requests["/mj/v2/fetch"] / tasks, 2),
+    }
+
+
+def _piapi_service_script():
+    # Roda como script do AppTest: imports locais, sem acesso ao escopo do benchmark
+    import importlib.util
+    import os
+    import time
+
+    import streamlit as st
+
+    spec = importlib.util.spec_from_file_location("piapi_service", os.path.join(".services", "piapi_service.py"))
+    piapi_service = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(piapi_service)
+
+    service = piapi_service.PiapiService()
+    start = time.perf_counter()
+    results = [
+        service.generate_character_images(f"Personagem {i}", "jovem pastor, túnica simples", fresh=True)
+        for i in range(int(os.environ["BENCHMARK_PIAPI_TASKS"]))
+    ]
+    st.session_state["bench_tempo"] = time.perf_counter() - start
+    st.session_state["bench_falhas"] = sum(result is None for result in results)
+
+
+def _run_isolated(scenario, args):
+    """Roda o cenário num subprocesso com cache local próprio; devolve as métricas"""
+    with tempfile.TemporaryDirectory(prefix="tenda-bench-") as cache_dir:
+        env = dict(os.environ, TENDA_CACHE_DIR=cache_dir)
+        result = subprocess.run(
+            [sys.executable, "-m", "devtools.benchmark", *_config_args(args), "--scenario", scenario],
+            cwd=APP_DIR, env=env, capture_output=True, text=True
+        )
+    if result.returncode != 0:
+        raise SystemExit(f"❌ Cenário {scenario} falhou:\n{result.stderr[-3000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _config_args(args):
+    """Opções de configuração repassadas ao subprocesso"""
+    forwarded = []
+    for option in CONFIG_OPTIONS:
+        value = getattr(args, option)
+        if value is not None:
+            forwarded += [f"--{option.replace('_', '-')}", str(value)]
+    return forwarded
+
+
+def _load_baseline():
+    if not os.path.exists(BASELINE_PATH):
+        raise SystemExit(f"Baseline não encontrado ({BASELINE_PATH}): rode com --update-baseline")
+    with open(BASELINE_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _print_table(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Imprime cenário/métrica/baseline/atual; devolve as métricas que regrediram"""
+    regressions = []
+    print(f"{'cenário':<16}{'métrica':<32}{'baseline':>10}{'atual':>10}")
+    for scenario, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get(scenario, {}).get(metric)
+            mark = ""
+            if base is not None:
+                limit = base * (1 + tolerance) + (TIME_SLACK if metric.endswith("_s") else COUNT_SLACK)
+                if value > limit:
+                    regressions.append(f"{scenario}.{metric}")
+                    mark = "  ❌"
+            shown = "-" if base is None else f"{base:g}"
+            print(f"{scenario:<16}{metric:<32}{shown:>10}{value:>10g}{mark}")
+    return regressions
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Servidor OpenAI falso para testes locais e benchmarks
+
+Implementa o que assistants.py e narration.py usam: /threads/runs (com e sem streaming),
+consulta da run, /threads/{id}/messages e /audio/speech. As respostas seguem o formato
+pedido pelo prompt (episódios, personagens ou cenas), com latência, taxa de erro e quota
+configuráveis.
+
+Uso:
+    python -m devtools.fake_openai --port 8901 --run-duration 2
+    OPENAI_BASE_URL=http://127.0.0.1:8901/v1 streamlit run app.py
+"""
+import argparse
+import json
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+from devtools.fake_upstream import FakeUpstream
+
+STREAM_CHUNK_SIZE = 40  # caracteres por thread.message.delta
+
+
+class FakeOpenAI(FakeUpstream):
+    name = "fake-openai"
+
+    def __init__(self, port=0, latency=0.0, run_duration=1.0, stream_delay=0.01, error_rate=0.0,
+                 quota_per_minute=None, characters_per_episode=3, seed=None):
+        super().__init__(_handler_for(self), port, latency, error_rate, quota_per_minute, seed)
+        self.run_duration = run_duration
+        self.stream_delay = stream_delay
+        self.characters_per_episode = characters_per_episode
+        self.runs = {}  # run_id -> {"thread_id", "created", "text"}
+        self._counter = 0
+
+    @property
+    def base_url(self):
+        return f"{self.url}/v1"
+
+    def create_run(self, body):
+        prompt = body["thread"]["messages"][0]["content"]
+        run_id, thread_id = f"run_{uuid.uuid4().hex[:12]}", f"thread_{uuid.uuid4().hex[:12]}"
+        text = self.answer(prompt)
+        with self._lock:
+            self.runs[run_id] = {"thread_id": thread_id, "created": time.monotonic(), "text": text}
+        return {"id": run_id, "thread_id": thread_id, "status": "queued"}
+
+    def run_json(self, run_id):
+        with self._lock:
+            run = self.runs.get(run_id)
+        if run is None:
+            return None
+        done = time.monotonic() - run["created"] >= self.run_duration
+        return {"id": run_id, "thread_id": run["thread_id"], "status": "completed" if done else "in_progress"}
+
+    def answer(self, prompt):
+        """Resposta em JSON no formato que o prompt pede"""
+        with self._lock:
+            self._counter += 1
+            n = self._counter
+        scenes = re.search(r"Escreva as cenas (\d+) a (\d+)", prompt)
+        if scenes:
+            first, last = int(scenes.group(1)), int(scenes.group(2))
+            items = [
+                {
+                    "numero": i,
+                    "titulo": f"Cena {i}",
+                    "descricao": f"O que acontece na cena {i}",
+                    "narracao": f"Narração da cena {i}, contada com calma para as crianças.",
+                    "prompt_imagem_1": f"cena {i} momento 1, 3D Pixar style",
+                    "prompt_imagem_2": f"cena {i} momento 2, 3D Pixar style",
+                }
+                for i in range(first, last + 1)
+            ]
+        elif "personagens" in prompt:
+            items = [
+                {
+                    "nome": f"Personagem {n}.{i}",
+                    "papel": "Protagonista" if i == 1 else "Coadjuvante",
+                    "descricao": f"Descrição física do personagem {n}.{i}",
+                    "prompt_imagem": f"personagem {n}.{i}, 3D Pixar style, white background, full body",
+                    "status": "Pendente",
+                }
+                for i in range(1, self.characters_per_episode + 1)
+            ]
+        else:
+            count = re.search(r"Gere (\d+) ideias", prompt)
+            items = [
+                {"episodio": f"Episódio {n}.{i}", "descricao": f"Descrição do episódio {n}.{i}", "moral": "Deus cuida de nós"}
+                for i in range(1, int(count.group(1)) + 1 if count else 2)
+            ]
+        return "```json\n" + json.dumps(items, ensure_ascii=False, indent=2) + "\n```"
+
+
+def _handler_for(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = url.path.strip("/").split("/")
+            endpoint = "/" + "/".join(p if not p.startswith(("run_", "thread_")) else "{id}" for p in parts)
+            fake.requests[endpoint] += 1
+            refused = fake.admit()
+            if refused:
+                return self._refuse(*refused)
+            if len(parts) == 5 and parts[:2] == ["v1", "threads"] and parts[3] == "runs":
+                run = fake.run_json(parts[4])
+                return self._json(200 if run else 404, run or {"error": {"message": "run não encontrada"}})
+            if len(parts) == 4 and parts[:2] == ["v1", "threads"] and parts[3] == "messages":
+                with fake._lock:
+                    text = next((r["text"] for r in fake.runs.values() if r["thread_id"] == parts[2]), None)
+                if text is None:
+                    return self._json(404, {"error": {"message": "thread não encontrada"}})
+                return self._json(200, {"data": [{"role": "assistant", "content": [{"type": "text", "text": {"value": text}}]}]})
+            self._json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            fake.requests[url.path] += 1
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            refused = fake.admit()
+            if refused:
+                return self._refuse(*refused)
+            if url.path == "/v1/threads/runs":
+                run = fake.create_run(body)
+                if body.get("stream"):
+                    return self._stream(run)
+                return self._json(200, run)
+            if url.path == "/v1/audio/speech":
+                # Importado aqui: narration lê OPENAI_BASE_URL, que aponta para este servidor
+                from narration import SILENT_FRAME
+                frames = max(20, len(body.get("input", "")) * 3)
+                return self._send(200, SILENT_FRAME * frames, "audio/mpeg")
+            self._json(404, {"error": {"message": "not found"}})
+
+        def _stream(self, run):
+            """Resposta em Server-Sent Events, em pedaços, como o streaming das Assistants"""
+            with fake._lock:
+                text = fake.runs[run["id"]]["text"]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self._event("thread.run.created", run)
+            for i in range(0, len(text), STREAM_CHUNK_SIZE):
+                time.sleep(fake.stream_delay)
+                delta = {"delta": {"content": [{"type": "text", "text": {"value": text[i:i + STREAM_CHUNK_SIZE]}}]}}
+                self._event("thread.message.delta", delta)
+            self._event("thread.run.completed", dict(run, status="completed"))
+            self.wfile.write(b"event: done\ndata: [DONE]\n\n")
+            self.close_connection = True
+
+        def _event(self, event, data):
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+            self.wfile.flush()
+
+        def _refuse(self, code, retry_after):
+            headers = {"Retry-After": str(retry_after)} if retry_after else {}
+            self._json(code, {"error": {"message": "erro simulado"}}, headers)
+
+        def _json(self, code, obj, headers=None):
+            self._send(code, json.dumps(obj).encode(), "application/json", headers)
+
+        def _send(self, code, data, content_type, headers=None):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--run-duration", type=float, default=2.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--quota-per-minute", type=int, default=None)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(
+        port=args.port,
+        latency=args.latency,
+        run_duration=args.run_duration,
+        error_rate=args.error_rate,
+        quota_per_minute=args.quota_per_minute,
+    )
+    print(f"OpenAI falsa em {fake.base_url}")
+    fake.server.serve_forever()
@@ -0,0 +1,171 @@
+"""Servidor PIAPI falso para testes locais e benchmarks
+
+Implementa /imagine, /upscale, /fetch e /account do mj/v2, com latência, taxa de erro e
+quota configuráveis. Tarefas criadas com webhook_endpoint disparam o callback ao terminar,
+como a PIAPI de verdade. As imagens (grades 2×2 coloridas) são servidas pelo próprio servidor.
+
+Uso:
+    python -m devtools.fake_piapi --port 8900 --task-duration 5
+    PIAPI_BASE_URL=http://127.0.0.1:8900/mj/v2 streamlit run app.py
+"""
+import argparse
+import io
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from PIL import Image
+
+from devtools.fake_upstream import FakeUpstream
+
+GRID_COLORS = [(230, 80, 80), (80, 180, 90), (70, 110, 220), (240, 200, 60)]
+
+
+class FakePiapi(FakeUpstream):
+    name = "fake-piapi"
+
+    def __init__(self, port=0, latency=0.0, task_duration=2.0, error_rate=0.0, fail_rate=0.0,
+                 quota_per_minute=None, image_size=512, seed=None):
+        super().__init__(_handler_for(self), port, latency, error_rate, quota_per_minute, seed)
+        self.task_duration = task_duration
+        self.fail_rate = fail_rate
+        self.image_size = image_size
+        self.tasks = {}
+
+    @property
+    def base_url(self):
+        return f"{self.url}/mj/v2"
+
+    def create_task(self, kind, body):
+        task_id = str(uuid.uuid4())
+        failed = self._random.random() < self.fail_rate
+        task = {
+            "task_id": task_id,
+            "kind": kind,
+            "created": time.monotonic(),
+            "failed": failed,
+            "webhook_endpoint": body.get("webhook_endpoint"),
+            "webhook_secret": body.get("webhook_secret", ""),
+            "prompt": body.get("prompt", ""),
+        }
+        with self._lock:
+            self.tasks[task_id] = task
+        if task["webhook_endpoint"]:
+            threading.Timer(self.task_duration, self._fire_webhook, args=(task_id,)).start()
+        return task_id
+
+    def task_json(self, task_id):
+        with self._lock:
+            task = self.tasks.get(task_id)
+        if task is None:
+            return None
+        if time.monotonic() - task["created"] < self.task_duration:
+            return {"task_id": task_id, "status": "processing", "task_result": {}}
+        if task["failed"]:
+            return {"task_id": task_id, "status": "failed", "error": "falha simulada", "task_result": {}}
+        image_url = f"{self.url}/images/{task_id}.png"
+        return {
+            "task_id": task_id,
+            "status": "finished",
+            "task_result": {"image_url": image_url, "image_urls": [image_url]},
+        }
+
+    def grid_png(self, task_id):
+        """Grade 2×2 com uma cor por variação (como o resultado de um /imagine)"""
+        half = self.image_size // 2
+        image = Image.new("RGB", (self.image_size, self.image_size))
+        for i, color in enumerate(GRID_COLORS):
+            image.paste(color, ((i % 2) * half, (i // 2) * half, (i % 2 + 1) * half, (i // 2 + 1) * half))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    def _fire_webhook(self, task_id):
+        with self._lock:
+            task = self.tasks[task_id]
+        try:
+            requests.post(
+                task["webhook_endpoint"],
+                json=self.task_json(task_id),
+                headers={"x-webhook-secret": task["webhook_secret"]},
+                timeout=5
+            )
+        except requests.RequestException:
+            pass  # a PIAPI também não garante a entrega
+
+
+def _handler_for(fake):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            fake.requests[url.path] += 1
+            if url.path.startswith("/images/"):
+                return self._send(200, fake.grid_png(url.path[8:-4]), "image/png")
+            refused = fake.admit()
+            if refused:
+                return self._refuse(*refused)
+            if url.path == "/mj/v2/fetch":
+                task = fake.task_json(parse_qs(url.query).get("task_id", [""])[0])
+                return self._json(200 if task else 404, task or {"error": "task não encontrada"})
+            if url.path == "/mj/v2/account":
+                return self._json(200, {"account": "fake", "credits": 1000})
+            self._json(404, {"error": "not found"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            fake.requests[url.path] += 1
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            refused = fake.admit()
+            if refused:
+                return self._refuse(*refused)
+            if url.path in ("/mj/v2/imagine", "/mj/v2/upscale"):
+                task_id = fake.create_task(url.path.rsplit("/", 1)[1], body)
+                return self._json(200, {"task_id": task_id, "status": "pending"})
+            self._json(404, {"error": "not found"})
+
+        def _refuse(self, code, retry_after):
+            headers = {"Retry-After": str(retry_after)} if retry_after else {}
+            self._json(code, {"error": "erro simulado"}, headers)
+
+        def _json(self, code, obj, headers=None):
+            self._send(code, json.dumps(obj).encode(), "application/json", headers)
+
+        def _send(self, code, data, content_type, headers=None):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--task-duration", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--quota-per-minute", type=int, default=None)
+    args = parser.parse_args()
+
+    fake = FakePiapi(
+        port=args.port,
+        latency=args.latency,
+        task_duration=args.task_duration,
+        error_rate=args.error_rate,
+        fail_rate=args.fail_rate,
+        quota_per_minute=args.quota_per_minute,
+    )
+    print(f"PIAPI falsa em {fake.base_url}")
+    fake.server.serve_forever()
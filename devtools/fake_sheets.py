@@ -0,0 +1,226 @@
+"""Google Sheets falso para testes locais e benchmarks
+
+Implementa o pedaço da API v4 (e do Drive v3) que o gspread usa neste app: metadados da
+planilha, addSheet, leitura de intervalos, append, values:batchUpdate e o modifiedTime do
+Drive. As URLs do gspread são fixas, então as chamadas chegam aqui por um adapter do
+requests montado na sessão autenticada (install). Latência, taxa de erro e quota são
+configuráveis como nos outros servidores falsos.
+
+Uso (num script de teste):
+    fake = FakeSheets({"Episodios": [["Episódio", "Descrição Curta", "Moral", "Status"]]}).start()
+    fake.install(session)  # antes de gspread.authorize(creds, session=session)
+"""
+import json
+import re
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import unquote, urlparse
+
+from requests.adapters import HTTPAdapter
+
+from devtools.fake_upstream import FakeUpstream
+
+GOOGLE_HOSTS = ("https://sheets.googleapis.com", "https://www.googleapis.com")
+_A1_RANGE = re.compile(r"^([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$")
+
+
+class FakeSheets(FakeUpstream):
+    name = "fake-sheets"
+
+    def __init__(self, sheets=None, port=0, latency=0.0, error_rate=0.0, quota_per_minute=None, seed=None):
+        super().__init__(_handler_for(self), port, latency, error_rate, quota_per_minute, seed)
+        self.sheets = {}  # título -> {"id", "rows"}
+        for title, rows in (sheets or {}).items():
+            self.add_sheet(title, rows)
+        self._touch()
+
+    def install(self, session):
+        """Desvia as chamadas do gspread feitas por session para este servidor"""
+        adapter = _RedirectAdapter(self.url)
+        for host in GOOGLE_HOSTS:
+            session.mount(host, adapter)
+        return session
+
+    def add_sheet(self, title, rows=None):
+        with self._lock:
+            sheet = self.sheets[title] = {"id": len(self.sheets) + 1, "rows": [list(r) for r in rows or []]}
+        return sheet
+
+    def rows(self, title):
+        with self._lock:
+            return [list(r) for r in self.sheets[title]["rows"]]
+
+    def metadata(self, spreadsheet_id):
+        with self._lock:
+            sheets = [
+                {"properties": _sheet_properties(title, sheet, index)}
+                for index, (title, sheet) in enumerate(self.sheets.items())
+            ]
+        return {"spreadsheetId": spreadsheet_id, "properties": {"title": "Planilha falsa"}, "sheets": sheets}
+
+    def get_values(self, a1):
+        title, (first_row, first_col, last_row, last_col) = self._parse(a1)
+        with self._lock:
+            rows = self.sheets[title]["rows"][first_row - 1:last_row]
+            values = [row[first_col - 1:last_col] for row in rows]
+        while values and not any(values[-1]):
+            values.pop()
+        return {"range": a1, "majorDimension": "ROWS", "values": values} if values else {"range": a1, "majorDimension": "ROWS"}
+
+    def append(self, a1, values):
+        title, _ = self._parse(a1)
+        with self._lock:
+            rows = self.sheets[title]["rows"]
+            while rows and not any(rows[-1]):
+                rows.pop()
+            start = len(rows) + 1
+            rows.extend([str(v) for v in row] for row in values)
+        self._touch()
+        return {"updates": {"updatedRange": f"'{title}'!A{start}", "updatedRows": len(values)}}
+
+    def batch_update_values(self, data):
+        with self._lock:
+            for item in data:
+                title, (row, col, _, _) = self._parse(item["range"])
+                rows = self.sheets[title]["rows"]
+                for i, values in enumerate(item["values"]):
+                    while len(rows) < row + i:
+                        rows.append([])
+                    target = rows[row + i - 1]
+                    for j, value in enumerate(values):
+                        while len(target) < col + j:
+                            target.append("")
+                        target[col + j - 1] = str(value)
+        self._touch()
+        return {"totalUpdatedCells": sum(len(v) for item in data for v in item["values"])}
+
+    def batch_update(self, body):
+        replies = []
+        for request in body.get("requests", []):
+            if "addSheet" in request:
+                title = request["addSheet"]["properties"]["title"]
+                sheet = self.add_sheet(title)
+                replies.append({"addSheet": {"properties": _sheet_properties(title, sheet, len(self.sheets) - 1)}})
+            else:
+                replies.append({})
+        self._touch()
+        return {"replies": replies}
+
+    def _touch(self):
+        self.modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    def _parse(self, a1):
+        """'Aba'!A5:ZZ -> (aba, (linha inicial, coluna inicial, linha final, coluna final))"""
+        title, _, cells = a1.rpartition("!") if "!" in a1 else (a1, "", "")
+        title = title.strip("'").replace("''", "'")
+        match = _A1_RANGE.match(cells)
+        if title not in self.sheets or not match:
+            raise KeyError(a1)
+        col1, row1, col2, row2 = match.groups()
+        if col2 is None and row2 is None:  # célula única
+            col2, row2 = col1, row1
+        return title, (
+            int(row1 or 1), _column(col1) if col1 else 1,
+            int(row2) if row2 else None, _column(col2) if col2 else None,
+        )
+
+
+class _RedirectAdapter(HTTPAdapter):
+    def __init__(self, target):
+        super().__init__()
+        self.target = target
+
+    def send(self, request, **kwargs):
+        for host in GOOGLE_HOSTS:
+            if request.url.startswith(host):
+                request.url = self.target + request.url[len(host):]
+        return super().send(request, **kwargs)
+
+
+def _column(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord("A") + 1
+    return number
+
+
+def _sheet_properties(title, sheet, index):
+    return {
+        "sheetId": sheet["id"],
+        "title": title,
+        "index": index,
+        "sheetType": "GRID",
+        "gridProperties": {"rowCount": max(1000, len(sheet["rows"])), "columnCount": 26},
+    }
+
+
+def _handler_for(fake):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [unquote(p) for p in url.path.strip("/").split("/")]
+            refused = self._count(parts)
+            if refused:
+                return self._refuse(*refused)
+            if parts[:2] == ["v4", "spreadsheets"] and len(parts) == 3:
+                return self._json(200, fake.metadata(parts[2]))
+            if parts[:2] == ["v4", "spreadsheets"] and len(parts) == 5 and parts[3] == "values":
+                return self._values(lambda: fake.get_values(parts[4]))
+            if parts[:3] == ["drive", "v3", "files"] and len(parts) == 4:
+                return self._json(200, {"id": parts[3], "name": "Planilha falsa", "modifiedTime": fake.modified})
+            self._json(404, {"error": {"code": 404, "message": "not found"}})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            parts = [unquote(p) for p in url.path.strip("/").split("/")]
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            refused = self._count(parts)
+            if refused:
+                return self._refuse(*refused)
+            if parts[:2] == ["v4", "spreadsheets"] and len(parts) == 3 and parts[2].endswith(":batchUpdate"):
+                return self._json(200, fake.batch_update(body))
+            if parts[:2] == ["v4", "spreadsheets"] and len(parts) == 4 and parts[3] == "values:batchUpdate":
+                return self._values(lambda: fake.batch_update_values(body.get("data", [])))
+            if parts[:2] == ["v4", "spreadsheets"] and len(parts) == 5 and parts[4].endswith(":append"):
+                return self._values(lambda: fake.append(parts[4][:-len(":append")], body.get("values", [])))
+            self._json(404, {"error": {"code": 404, "message": "not found"}})
+
+        def _count(self, parts):
+            if parts[:3] == ["drive", "v3", "files"]:
+                endpoint = "drive.files.get"
+            elif len(parts) == 3:
+                endpoint = "batchUpdate" if parts[2].endswith(":batchUpdate") else "metadata"
+            elif len(parts) >= 4 and parts[3] == "values:batchUpdate":
+                endpoint = "values.batchUpdate"
+            elif len(parts) == 5 and parts[4].endswith(":append"):
+                endpoint = "values.append"
+            else:
+                endpoint = "values.get"
+            fake.requests[endpoint] += 1
+            return fake.admit()
+
+        def _values(self, operation):
+            try:
+                return self._json(200, operation())
+            except KeyError as e:
+                return self._json(400, {"error": {"code": 400, "message": f"Unable to parse range: {e}", "status": "INVALID_ARGUMENT"}})
+
+        def _refuse(self, code, retry_after):
+            headers = {"Retry-After": str(retry_after)} if retry_after else {}
+            status = "RESOURCE_EXHAUSTED" if code == 429 else "INTERNAL"
+            self._json(code, {"error": {"code": code, "message": "erro simulado", "status": status}}, headers)
+
+        def _json(self, code, obj, headers=None):
+            data = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
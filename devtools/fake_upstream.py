@@ -0,0 +1,57 @@
+"""Base comum dos servidores falsos (PIAPI, OpenAI, Google Sheets)
+
+Cada servidor roda num ThreadingHTTPServer local, conta as chamadas por endpoint e pode
+simular latência, erros 500 aleatórios e quota por minuto (429 com Retry-After).
+"""
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import ThreadingHTTPServer
+
+
+class FakeUpstream:
+    name = "fake"
+
+    def __init__(self, handler, port=0, latency=0.0, error_rate=0.0, quota_per_minute=None, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota_per_minute = quota_per_minute
+        self.requests = Counter()  # endpoint -> chamadas
+        self._random = random.Random(seed)
+        self._recent = deque()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name=self.name, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def total_requests(self):
+        return sum(self.requests.values())
+
+    def admit(self):
+        """Aplica latência, erros aleatórios e quota; devolve (código, Retry-After) se recusar"""
+        if self.latency:
+            time.sleep(self.latency)
+        if self._random.random() < self.error_rate:
+            return 500, None
+        if self.quota_per_minute:
+            now = time.monotonic()
+            with self._lock:
+                while self._recent and now - self._recent[0] > 60:
+                    self._recent.popleft()
+                if len(self._recent) >= self.quota_per_minute:
+                    return 429, max(1, int(60 - (now - self._recent[0])))
+                self._recent.append(now)
+        return None
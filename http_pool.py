@@ -0,0 +1,147 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import rate_limit
+import tracing
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = (5, 60)  # (conexão, leitura) em segundos
+DEFAULT_RETRIES = 3
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_config = {
+    "pool_size": DEFAULT_POOL_SIZE,
+    "timeout": DEFAULT_TIMEOUT,
+    "retries": DEFAULT_RETRIES,
+}
+_lock = threading.Lock()
+
+
+class _Retry(Retry):
+    """Retry que nunca repete um POST já processado pelo servidor
+
+    Um POST só volta a ser enviado em 429 (a API recusou, nada foi criado) ou em erro de
+    conexão; repetir em 5xx poderia duplicar uma tarefa paga (/imagine, runs).
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method and method.upper() == "POST":
+            return bool(self.total) and status_code == 429
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        host = _host(_pool)
+        tracing.record_retry(host or "?")
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        retry.host = host
+        return retry
+
+    def sleep(self, response=None):
+        """Com limitador, a espera do retry passa por ele: Retry-After pausa o host inteiro"""
+        limiter = rate_limit.limiter_for(getattr(self, "host", None))
+        if limiter is None:
+            return super().sleep(response)
+        if response is not None and response.status == 429:
+            retry_after = self.get_retry_after(response) if self.respect_retry_after_header else None
+            limiter.pause(retry_after or max(self.get_backoff_time(), 1.0))
+        else:
+            self._sleep_backoff()
+        # A vaga de concorrência continua com a requisição original; só falta o token
+        limiter.acquire(slot=False)
+
+
+class _TimeoutAdapter(HTTPAdapter):
+    """HTTPAdapter com timeout padrão: sem ele um socket travado prende o script para sempre
+
+    Também registra cada requisição (host, tempo com retries, bytes, status) no tracing e,
+    se o host tiver limite configurado (rate_limit), espera o token antes de enviar.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        host = urlparse(request.url).netloc
+        limiter = rate_limit.limiter_for(host)
+        start = time.perf_counter()
+        if limiter is None:
+            response = super().send(request, **kwargs)
+        else:
+            with limiter.request():
+                response = super().send(request, **kwargs)
+            if response.status_code == 429:
+                # Retries esgotados (ou POST): os próximos pedidos ainda respeitam o Retry-After
+                limiter.pause(_retry_after(response) or 1.0)
+        # Sem streaming o corpo seria lido logo em seguida de qualquer jeito
+        received = len(response.content) if not kwargs.get("stream") else int(response.headers.get("Content-Length") or 0)
+        tracing.record_request(
+            host, time.perf_counter() - start,
+            len(request.body or b""), received, response.status_code
+        )
+        return response
+
+
+def configure(pool_size=None, timeout=None, retries=None):
+    """Ajusta os parâmetros das próximas sessões (as já criadas são mantidas)"""
+    with _lock:
+        if pool_size is not None:
+            _config["pool_size"] = pool_size
+        if timeout is not None:
+            _config["timeout"] = timeout
+        if retries is not None:
+            _config["retries"] = retries
+
+
+def mount_pool(session, pool_size=None, timeout=None, retries=None):
+    """Instala pool keep-alive, timeouts e retry em 429/5xx numa sessão existente"""
+    adapter = _TimeoutAdapter(
+        timeout=timeout or _config["timeout"],
+        pool_connections=pool_size or _config["pool_size"],
+        pool_maxsize=pool_size or _config["pool_size"],
+        max_retries=_Retry(
+            total=_config["retries"] if retries is None else retries,
+            backoff_factor=0.5,
+            status_forcelist=RETRY_STATUS,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(host_or_url):
+    """Sessão compartilhada (por processo) para um host upstream"""
+    host = urlparse(host_or_url).netloc or host_or_url
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = mount_pool(requests.Session())
+        return session
+
+
+
+def _host(pool):
+    """host[:porta] de um connection pool do urllib3, no formato de urlparse().netloc"""
+    if pool is None:
+        return None
+    default_port = {"http": 80, "https": 443}.get(pool.scheme)
+    return pool.host if pool.port in (None, default_port) else f"{pool.host}:{pool.port}"
+
+
+def _retry_after(response):
+    """Segundos do cabeçalho Retry-After (só o formato numérico; datas HTTP são raras aqui)"""
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
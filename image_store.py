@@ -0,0 +1,240 @@
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from PIL import Image, ImageFilter, ImageStat
+
+from http_pool import get_session
+from local_store import cache_dir
+
+JPEGTRAN = shutil.which("jpegtran")
+# Ordem das variações na grade 2×2 do /imagine (índice do /upscale): V1 V2 em cima, V3 V4 embaixo
+GRID_POSITIONS = ((0, 0), (1, 0), (0, 1), (1, 1))
+
+
+class ImageStore:
+    """Cópia local das imagens dos personagens, com miniaturas WebP
+
+    Cada URL é baixada uma única vez (em paralelo) para o disco; a miniatura na largura
+    de exibição fica no disco e num LRU em memória. A imagem original só é lida quando
+    o usuário pede para vê-la em tamanho real.
+    """
+
+    def __init__(self, root=None, thumb_width=200, memory_items=128, max_workers=8):
+        self.root = root or cache_dir("images")
+        self.thumb_width = thumb_width
+        self.memory_items = memory_items
+        self._memory = OrderedDict()  # url -> bytes da miniatura
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="images")
+        self._downloads = {}  # url -> Future em andamento
+        os.makedirs(self.root, exist_ok=True)
+
+    def original_path(self, url):
+        return os.path.join(self.root, self._key(url))
+
+    def thumbnail_path(self, url):
+        return os.path.join(self.root, f"{self._key(url)}_{self.thumb_width}.webp")
+
+    def prefetch(self, urls, timeout=30):
+        """Baixa (em paralelo) as URLs que ainda não estão no disco e gera as miniaturas"""
+        futures = [self._ensure(url) for url in dict.fromkeys(urls) if url]
+        pending = [future for future in futures if future is not None]
+        if pending:
+            wait(pending, timeout=timeout)
+
+    def thumbnail(self, url):
+        """Bytes da miniatura WebP (memória → disco → download); None se indisponível"""
+        with self._lock:
+            data = self._memory.get(url)
+            if data is not None:
+                self._memory.move_to_end(url)
+                return data
+
+        path = self.thumbnail_path(url)
+        if not os.path.exists(path):
+            future = self._ensure(url)
+            if future is not None:
+                future.result()
+            if not os.path.exists(path):
+                return None
+
+        with open(path, "rb") as f:
+            data = f.read()
+        self._remember(url, data)
+        return data
+
+    def original(self, url):
+        """Caminho da imagem em tamanho real (baixa se necessário)"""
+        future = self._ensure(url)
+        if future is not None:
+            future.result()
+        path = self.original_path(url)
+        return path if os.path.exists(path) else None
+
+    def variant_paths(self, url):
+        """Caminhos das 4 variações da grade (vazio se ainda não foi dividida)"""
+        paths = []
+        for index in range(1, len(GRID_POSITIONS) + 1):
+            base = os.path.join(self.root, f"{self._key(url)}_v{index}")
+            path = next((f"{base}{ext}" for ext in (".png", ".jpg") if os.path.exists(f"{base}{ext}")), None)
+            if path is None:
+                return []
+            paths.append(path)
+        return paths
+
+    def variants(self, url):
+        """Divide a grade 2×2 do /imagine (uma vez, em cache) e devolve os 4 caminhos
+
+        Grades PNG viram 4 PNGs com os mesmos pixels; JPEG é recortado sem recodificar
+        pelo jpegtran quando ele existe e o corte cai na grade de blocos, senão vira PNG.
+        """
+        paths = self.variant_paths(url)
+        if paths:
+            return paths
+        self._ensure_variants(url).result()
+        return self.variant_paths(url)
+
+    def variant_thumbnails(self, url):
+        """Miniaturas WebP das 4 variações (bytes), na largura de exibição"""
+        self.variants(url)
+        thumbnails = []
+        for index in range(1, len(GRID_POSITIONS) + 1):
+            with open(self._variant_thumbnail_path(url, index), "rb") as f:
+                thumbnails.append(f.read())
+        return thumbnails
+
+    def best_variant(self, url):
+        """Índice (1-4) da variação escolhida automaticamente para o upscale
+
+        Os prompts pedem personagem de corpo inteiro em fundo branco: vence a variação com
+        a borda mais branca (personagem inteiro, sem cortes nas bordas) e, no empate, a com
+        mais detalhe (bordas da imagem), medidos nas miniaturas.
+        """
+        scores = []
+        for index, thumbnail in enumerate(self.variant_thumbnails(url), start=1):
+            with Image.open(io.BytesIO(thumbnail)) as image:
+                gray = image.convert("L")
+            width, height = gray.size
+            margin = max(1, min(width, height) // 20)
+            border = [
+                gray.crop(box) for box in (
+                    (0, 0, width, margin), (0, height - margin, width, height),
+                    (0, 0, margin, height), (width - margin, 0, width, height),
+                )
+            ]
+            whiteness = sum(ImageStat.Stat(part).mean[0] for part in border) / len(border)
+            detail = ImageStat.Stat(gray.filter(ImageFilter.FIND_EDGES)).mean[0]
+            scores.append((round(whiteness), detail, -index))
+        return -max(scores)[2]
+
+    def prefetch_variants(self, urls):
+        """Divide as grades em segundo plano, para a escolha da variação ser instantânea"""
+        for url in dict.fromkeys(urls):
+            if url and not self.variant_paths(url):
+                self._ensure_variants(url)
+
+    def _ensure_variants(self, url):
+        with self._lock:
+            future = self._downloads.get(("variantes", url))
+            if future is None:
+                future = self._downloads[("variantes", url)] = self._executor.submit(
+                    self._tracked, ("variantes", url), self._split, url
+                )
+            return future
+
+    def _split(self, url):
+        path = self.original_path(url)
+        if not os.path.exists(path):
+            self._download(url)  # aqui mesmo: esperar outro job do pool poderia travá-lo
+        with Image.open(path) as grid:
+            width, height = grid.size
+            half_width, half_height = width // 2, height // 2
+            # jpegtran só corta sem perda em múltiplos do bloco (16 px cobre o 4:2:0)
+            lossless_jpeg = (
+                grid.format == "JPEG" and JPEGTRAN and half_width % 16 == 0 and half_height % 16 == 0
+            )
+            for index, (col, row) in enumerate(GRID_POSITIONS, start=1):
+                box = (col * half_width, row * half_height, (col + 1) * half_width, (row + 1) * half_height)
+                base = os.path.join(self.root, f"{self._key(url)}_v{index}")
+                variant = grid.crop(box)
+                # Miniatura antes da variação: variant_paths completo implica miniaturas prontas
+                thumbnail = variant.convert("RGBA") if variant.mode not in ("RGB", "RGBA") else variant.copy()
+                thumbnail.thumbnail((self.thumb_width, self.thumb_width * 4))
+                buffer = io.BytesIO()
+                thumbnail.save(buffer, format="WEBP", quality=80, method=4)
+                _write_atomic(self._variant_thumbnail_path(url, index), buffer.getvalue())
+                if lossless_jpeg:
+                    _jpegtran_crop(path, box, f"{base}.jpg")
+                else:
+                    buffer = io.BytesIO()
+                    variant.save(buffer, format="PNG", compress_level=1)
+                    _write_atomic(f"{base}.png", buffer.getvalue())
+
+    def _variant_thumbnail_path(self, url, index):
+        return os.path.join(self.root, f"{self._key(url)}_v{index}_{self.thumb_width}.webp")
+
+    def _ensure(self, url):
+        if os.path.exists(self.thumbnail_path(url)):
+            return None
+        with self._lock:
+            future = self._downloads.get(url)
+            if future is None:
+                future = self._downloads[url] = self._executor.submit(self._tracked, url, self._download, url)
+            return future
+
+    def _tracked(self, key, work, url):
+        """Job registrado em _downloads[key]: só ele remove a entrada (_split chama _download direto)"""
+        try:
+            return work(url)
+        finally:
+            with self._lock:
+                self._downloads.pop(key, None)
+
+    def _download(self, url):
+        path = self.original_path(url)
+        if not os.path.exists(path):
+            response = get_session(url).get(url)
+            response.raise_for_status()
+            _write_atomic(path, response.content)
+
+        with Image.open(path) as image:
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            image.thumbnail((self.thumb_width, self.thumb_width * 4))
+            buffer = io.BytesIO()
+            image.save(buffer, format="WEBP", quality=80, method=4)
+        _write_atomic(self.thumbnail_path(url), buffer.getvalue())
+
+    def _remember(self, url, data):
+        with self._lock:
+            self._memory[url] = data
+            self._memory.move_to_end(url)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    @staticmethod
+    def _key(url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp{threading.get_ident()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _jpegtran_crop(path, box, out_path):
+    left, top, right, bottom = box
+    tmp_path = f"{out_path}.tmp{threading.get_ident()}"
+    subprocess.run(
+        [JPEGTRAN, "-copy", "all", "-crop", f"{right - left}x{bottom - top}+{left}+{top}", "-outfile", tmp_path, path],
+        check=True, capture_output=True
+    )
+    os.replace(tmp_path, out_path)
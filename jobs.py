@@ -0,0 +1,176 @@
+import json
+import threading
+import time
+import traceback
+
+from local_store import cache_path, connect
+
+STATES = ("queued", "running", "done", "failed")
+
+
+class JobQueue:
+    """Fila de tarefas persistente (SQLite) com threads de trabalho
+
+    A interface só enfileira e consulta o estado (leituras locais, baratas); o trabalho
+    pesado (Assistants, PIAPI, planilha) roda nas threads, fora do script do Streamlit,
+    e sobrevive a reruns e a um refresh do navegador. Handlers não podem usar st.*:
+    recebem (payload, report) e devolvem um resultado serializável em JSON.
+    """
+
+    def __init__(self, path=None, workers=4):
+        self.path = path or cache_path("jobs.sqlite3")
+        self.workers = workers
+        self._handlers = {}
+        self._wakeup = threading.Condition()
+        self._threads = []
+        with connect(self.path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    dedupe_key TEXT,
+                    state TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    message TEXT NOT NULL DEFAULT '',
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+            # Tarefas que estavam rodando quando o processo caiu não são repetidas sozinhas
+            # (podem ser pagas); ficam como falha para o usuário reenfileirar
+            conn.execute(
+                "UPDATE jobs SET state = 'failed', error = ?, finished_at = ? WHERE state = 'running'",
+                ("Interrompida: o processo foi reiniciado", time.time())
+            )
+
+    def register(self, kind, handler):
+        self._handlers[kind] = handler
+
+    def start(self):
+        """Inicia as threads de trabalho (uma vez por processo)"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"jobs-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def enqueue(self, kind, payload, title="", dedupe_key=None):
+        """Enfileira uma tarefa; com dedupe_key, reaproveita a que já estiver na fila/rodando"""
+        with connect(self.path) as conn:
+            if dedupe_key:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE dedupe_key = ? AND state IN ('queued', 'running')",
+                    (dedupe_key,)
+                ).fetchone()
+                if row:
+                    return row[0]
+            job_id = conn.execute(
+                "INSERT INTO jobs (kind, title, payload, dedupe_key, state, created_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?)",
+                (kind, title or kind, json.dumps(payload), dedupe_key, time.time())
+            ).lastrowid
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def retry(self, job_id):
+        """Volta uma tarefa que falhou para a fila"""
+        with connect(self.path) as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'queued', progress = 0, message = '', error = NULL "
+                "WHERE id = ? AND state = 'failed'",
+                (job_id,)
+            )
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def get(self, job_id):
+        with connect(self.path) as conn:
+            conn.row_factory = _dict_row
+            return conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def list(self, states=None, limit=20):
+        """Tarefas mais recentes primeiro (opcionalmente filtradas por estado)"""
+        with connect(self.path) as conn:
+            conn.row_factory = _dict_row
+            if states:
+                marks = ", ".join("?" for _ in states)
+                return conn.execute(
+                    f"SELECT * FROM jobs WHERE state IN ({marks}) ORDER BY id DESC LIMIT ?",
+                    (*states, limit)
+                ).fetchall()
+            return conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+
+    def counts(self):
+        with connect(self.path) as conn:
+            counts = dict(conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in STATES}
+
+    def _claim(self):
+        with connect(self.path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.row_factory = _dict_row
+            job = conn.execute(
+                "SELECT * FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if job is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = 'running', started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                (time.time(), job["id"])
+            )
+            return job
+
+    def _report(self, job_id, progress, message=""):
+        with connect(self.path) as conn:
+            conn.execute(
+                "UPDATE jobs SET progress = ?, message = ? WHERE id = ?",
+                (progress, message, job_id)
+            )
+
+    def _finish(self, job_id, result=None, error=None):
+        with connect(self.path) as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, progress = 1, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (
+                    "failed" if error else "done",
+                    None if error else json.dumps(result),
+                    error,
+                    time.time(),
+                    job_id,
+                )
+            )
+
+    def _worker(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(timeout=2)
+                continue
+
+            handler = self._handlers.get(job["kind"])
+            if handler is None:
+                self._finish(job["id"], error=f"Tipo de tarefa desconhecido: {job['kind']}")
+                continue
+            try:
+                result = handler(
+                    json.loads(job["payload"]),
+                    lambda progress, message="", job_id=job["id"]: self._report(job_id, progress, message)
+                )
+                self._finish(job["id"], result=result)
+            except Exception as e:
+                traceback.print_exc()
+                self._finish(job["id"], error=str(e) or type(e).__name__)
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Diretório dos caches/bancos locais (fora do git)
+CACHE_DIR = os.environ.get("TENDA_CACHE_DIR", ".cache")
+
+
+def cache_path(*parts):
+    """Caminho dentro de CACHE_DIR, criando os diretórios necessários"""
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def cache_dir(*parts):
+    """Diretório dentro de CACHE_DIR (criado se não existir)"""
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+@contextmanager
+def connect(path):
+    """Conexão SQLite curta: commit ao sair sem erro, rollback em erro, sempre fecha"""
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+class LruCache:
+    """Base dos caches SQLite chave → valor com expiração por idade e por uso
+
+    Subclasses definem table e columns (colunas entre key e created_at/last_used). Entradas
+    mais velhas que max_age_days ou além de max_entries (as menos usadas primeiro) saem a
+    cada gravação.
+    """
+
+    table = None
+    columns = ""
+
+    def __init__(self, path, max_entries, max_age_days):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        with connect(self.path) as conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    key TEXT PRIMARY KEY,
+                    {self.columns},
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+
+    def stats(self):
+        with self._lock, connect(self.path) as conn:
+            entries = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        return {"entradas": entries, "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self._lock, connect(self.path) as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+
+    def _lookup(self, key, column):
+        """Valor da coluna para a chave (marcando o uso), ou None se ausente/expirado"""
+        now = time.time()
+        with self._lock, connect(self.path) as conn:
+            row = conn.execute(
+                f"SELECT {column}, created_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            conn.execute(f"UPDATE {self.table} SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def _store(self, key, *values):
+        """Grava (key, *values) substituindo a entrada anterior da mesma chave"""
+        now = time.time()
+        placeholders = ", ".join("?" * (len(values) + 3))
+        with self._lock, connect(self.path) as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} VALUES ({placeholders})", (key, *values, now, now)
+            )
+            self._evict(conn, now)
+
+    def _delete(self, key):
+        with self._lock, connect(self.path) as conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def _evict(self, conn, now):
+        conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.max_age,))
+        conn.execute(f"""
+            DELETE FROM {self.table} WHERE key NOT IN (
+                SELECT key FROM {self.table} ORDER BY last_used DESC LIMIT ?
+            )
+        """, (self.max_entries,))
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from assistants import OPENAI_BASE_URL
+from http_pool import get_session
+from local_store import cache_dir
+
+# Quadro MP3 silencioso (MPEG-1 Layer III, 128 kbps, 44,1 kHz): cabeçalho + corpo zerado
+SILENT_FRAME = bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(413)
+SILENT_FRAME_SECONDS = 1152 / 44100
+
+
+class NarrationError(Exception):
+    """Falha ao sintetizar a narração de uma cena"""
+
+
+class OpenAITTSBackend:
+    """Síntese pela API de áudio da OpenAI (/audio/speech), em MP3"""
+
+    name = "openai"
+    extension = "mp3"
+
+    def __init__(self, api_key, voice="nova", model="tts-1", speed=1.0):
+        self.voice = voice
+        self.model = model
+        self.speed = speed
+        self.session = get_session(OPENAI_BASE_URL)
+        self.headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+    def settings(self):
+        return {"voice": self.voice, "model": self.model, "speed": self.speed}
+
+    def synthesize(self, text):
+        response = self.session.post(
+            f"{OPENAI_BASE_URL}/audio/speech",
+            headers=self.headers,
+            json={"model": self.model, "voice": self.voice, "input": text, "speed": self.speed, "response_format": "mp3"}
+        )
+        if response.status_code != 200:
+            raise NarrationError(f"Erro na síntese de voz: {response.status_code} - {response.text[:200]}")
+        return response.content
+
+
+class SilentBackend:
+    """Backend offline para testes: MP3 silencioso com duração proporcional ao texto"""
+
+    name = "silencio"
+    extension = "mp3"
+
+    def __init__(self, voice="silencio", chars_per_second=15):
+        self.voice = voice
+        self.chars_per_second = chars_per_second
+
+    def settings(self):
+        return {"voice": self.voice, "chars_per_second": self.chars_per_second}
+
+    def synthesize(self, text):
+        seconds = max(len(text) / self.chars_per_second, 0.5)
+        return SILENT_FRAME * int(seconds / SILENT_FRAME_SECONDS)
+
+
+BACKENDS = {
+    OpenAITTSBackend.name: OpenAITTSBackend,
+    SilentBackend.name: SilentBackend,
+}
+
+
+def make_backend(name, **options):
+    """Backend de TTS pelo nome ("openai" ou "silencio")"""
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise NarrationError(f"Backend de voz desconhecido: {name}") from None
+    if backend is SilentBackend:
+        options.pop("api_key", None)
+    return backend(**options)
+
+
+class NarrationStore:
+    """Áudio das narrações em disco, sintetizado em paralelo e indexado por hash
+
+    A chave é o hash do texto (espaços normalizados) + backend + voz + ajustes: editar uma cena só
+    sintetiza de novo aquela cena, e trocar a voz gera arquivos novos sem apagar os
+    antigos. O áudio do episódio é montado copiando os arquivos em streaming.
+    """
+
+    def __init__(self, backend, root=None, max_workers=4):
+        self.backend = backend
+        self.root = root or cache_dir("audio")
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts")
+        self._lock = threading.Lock()
+        self._running = {}  # chave -> Future
+        self._errors = {}  # chave -> mensagem da última falha
+
+    def key(self, text):
+        # Só espaços são normalizados: maiúsculas e pontuação mudam a entonação
+        text = " ".join((text or "").split())
+        payload = json.dumps([self.backend.name, self.backend.settings(), text], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path(self, text):
+        return os.path.join(self.root, f"{self.key(text)}.{self.backend.extension}")
+
+    def cached(self, text):
+        """Caminho do áudio se já sintetizado, senão None"""
+        path = self.path(text)
+        return path if os.path.exists(path) else None
+
+    def pending(self, text):
+        with self._lock:
+            return self.key(text) in self._running
+
+    def error(self, text):
+        """Mensagem da última falha de síntese do texto (None se não falhou)"""
+        with self._lock:
+            return self._errors.get(self.key(text))
+
+    def submit(self, text):
+        """Agenda a síntese (se ainda não existe nem está em andamento); devolve um Future do caminho"""
+        key = self.key(text)
+        with self._lock:
+            future = self._running.get(key)
+            if future is None:
+                future = self._running[key] = self._executor.submit(self._synthesize, key, text)
+            return future
+
+    def synthesize_many(self, texts, timeout=None):
+        """Sintetiza em paralelo o que falta; devolve {texto: caminho ou exceção}"""
+        futures = {text: self.submit(text) for text in dict.fromkeys(texts) if text}
+        results = {}
+        for text, future in futures.items():
+            try:
+                results[text] = future.result(timeout=timeout)
+            except Exception as e:
+                results[text] = e
+        return results
+
+    def concat(self, texts, out_path=None):
+        """Junta o áudio das cenas num arquivo, em ordem, sem carregar tudo na memória
+
+        Sem out_path, o arquivo é nomeado pelo hash das cenas e reaproveitado enquanto
+        nenhuma delas mudar.
+        """
+        if out_path is None:
+            keys = hashlib.sha256(" ".join(self.key(text) for text in texts).encode("utf-8")).hexdigest()
+            out_path = os.path.join(cache_dir("audio", "episodios"), f"{keys}.{self.backend.extension}")
+            if os.path.exists(out_path):
+                return out_path
+        tmp_path = f"{out_path}.tmp{threading.get_ident()}"
+        with open(tmp_path, "wb") as out:
+            for i, text in enumerate(texts):
+                path = self.cached(text)
+                if path is None:
+                    raise NarrationError("Narração ainda não sintetizada para todas as cenas")
+                with open(path, "rb") as f:
+                    if i:
+                        _skip_id3(f)  # Tag ID3 só no começo do arquivo final
+                    shutil.copyfileobj(f, out, length=64 * 1024)
+        os.replace(tmp_path, out_path)
+        return out_path
+
+    def _synthesize(self, key, text):
+        try:
+            path = self.path(text)
+            if not os.path.exists(path):
+                data = self.backend.synthesize(text)
+                tmp_path = f"{path}.tmp{threading.get_ident()}"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            with self._lock:
+                self._errors.pop(key, None)
+            return path
+        except Exception as e:
+            with self._lock:
+                self._errors[key] = str(e) or type(e).__name__
+            raise
+        finally:
+            with self._lock:
+                self._running.pop(key, None)
+
+
+def _skip_id3(f):
+    """Posiciona o arquivo depois de uma tag ID3v2 inicial, se houver"""
+    header = f.read(10)
+    if len(header) == 10 and header[:3] == b"ID3":
+        size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        f.seek(10 + size)
+    else:
+        f.seek(0)
@@ -0,0 +1,356 @@
+import contextvars
+import os
+import threading
+import time
+
+from http_pool import get_session
+from polling import FETCH_ERROR_STATUS, PollScheduler
+from tracing import traced
+
+# PIAPI_BASE_URL permite apontar para um servidor local (devtools/fake_piapi.py)
+PIAPI_BASE_URL = os.environ.get("PIAPI_BASE_URL", "https://api.piapi.ai/mj/v2")
+WEBHOOK_FALLBACK_INTERVAL = 60  # com webhook, só uma consulta de segurança por minuto
+
+
+class PiapiError(Exception):
+    """Falha em uma tarefa PIAPI (erro HTTP, tarefa falhou ou timeout)"""
+
+
+def _headers(api_key):
+    return {
+        "Content-Type": "application/json",
+        "X-API-Key": api_key
+    }
+
+
+@traced("piapi.imagine")
+def submit_imagine(api_key, prompt, aspect_ratio="1:1", model="mj-6", webhook=None, checkpoints=None):
+    """Cria uma tarefa /imagine e devolve o task_id (com webhook, a PIAPI avisa ao terminar)
+
+    Com um CheckpointStore, uma tarefa do mesmo prompt ainda em andamento é retomada.
+    """
+    request = [prompt, aspect_ratio, model]
+    checkpoint = checkpoints.find("imagine", request) if checkpoints else None
+    if checkpoint:
+        return checkpoint["ref"]
+    response = get_session(PIAPI_BASE_URL).post(
+        f"{PIAPI_BASE_URL}/imagine",
+        headers=_headers(api_key),
+        json={
+            "prompt": prompt,
+            "aspect_ratio": aspect_ratio,
+            "model": model,
+            **(webhook.submit_params() if webhook else {})
+        }
+    )
+    if response.status_code != 200:
+        raise PiapiError(f"Erro na API PIAPI: {response.status_code} - {response.text}")
+    task_id = response.json().get("task_id")
+    if checkpoints and task_id:
+        checkpoints.save("imagine", request, task_id)
+    return task_id
+
+
+@traced("piapi.upscale")
+def submit_upscale(api_key, origin_task_id, index, webhook=None, checkpoints=None):
+    """Cria uma tarefa /upscale para a variação index (1-4) e devolve o task_id"""
+    request = [origin_task_id, index]
+    checkpoint = checkpoints.find("upscale", request) if checkpoints else None
+    if checkpoint:
+        return checkpoint["ref"]
+    response = get_session(PIAPI_BASE_URL).post(
+        f"{PIAPI_BASE_URL}/upscale",
+        headers=_headers(api_key),
+        json={
+            "origin_task_id": origin_task_id,
+            "index": index,
+            **(webhook.submit_params() if webhook else {})
+        }
+    )
+    if response.status_code != 200:
+        raise PiapiError(f"Erro no upscale: {response.status_code} - {response.text}")
+    task_id = response.json().get("task_id")
+    if checkpoints and task_id:
+        checkpoints.save("upscale", request, task_id)
+    return task_id
+
+
+@traced("piapi.fetch")
+def fetch_task(api_key, task_id):
+    """Consulta o estado atual de uma tarefa"""
+    response = get_session(PIAPI_BASE_URL).get(
+        f"{PIAPI_BASE_URL}/fetch",
+        headers=_headers(api_key),
+        params={"task_id": task_id}
+    )
+    if response.status_code != 200:
+        raise PiapiError(f"Erro ao verificar status: {response.status_code}")
+    return response.json()
+
+
+@traced("piapi.wait")
+def wait_for_task(api_key, task_id, max_wait=300, on_status=None, webhook=None, checkpoints=None):
+    """Aguarda a tarefa terminar e devolve o JSON final (levanta PiapiError se falhar)"""
+    if webhook:
+        result = wait_for_webhook(api_key, task_id, webhook, max_wait, on_status)
+    else:
+        scheduler = PollScheduler(lambda t: fetch_task(api_key, t), deadline=max_wait)
+        scheduler.add(task_id)
+        result = scheduler.run(
+            on_update=lambda _, result: on_status(result.get("status")) if on_status else None
+        )[task_id]
+    settle_checkpoint(checkpoints, task_id, result)
+    return check_result(result)
+
+
+@traced("piapi.wait_webhook")
+def wait_for_webhook(api_key, task_id, webhook, max_wait=300, on_status=None):
+    """Bloqueia no evento do webhook; uma consulta /fetch por minuto cobre callbacks perdidos"""
+    deadline = time.monotonic() + max_wait
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return {"task_id": task_id, "status": "timeout"}
+        result = webhook.wait(task_id, timeout=min(remaining, WEBHOOK_FALLBACK_INTERVAL))
+        if result is None:
+            try:
+                result = fetch_task(api_key, task_id)
+            except Exception as e:
+                # Consulta falhou, não a tarefa: continua esperando até o prazo
+                result = {"task_id": task_id, "status": FETCH_ERROR_STATUS, "error": str(e)}
+        if on_status:
+            on_status(result.get("status"))
+        if result.get("status") in ("finished", "failed"):
+            return result
+
+
+def check_result(result):
+    """Devolve o resultado final ou levanta PiapiError para falha/timeout"""
+    status = result.get("status")
+    if status == "finished":
+        return result
+    if status == "timeout":
+        raise PiapiError("Timeout: Geração de imagem demorou muito")
+    raise PiapiError(f"Geração falhou: {result.get('error', 'Erro desconhecido')}")
+
+
+def settle_checkpoint(checkpoints, task_id, result):
+    """Tarefa terminada (segundo a PIAPI) sai dos checkpoints; em timeout continua lá para ser retomada"""
+    if not checkpoints:
+        return
+    if result.get("status") in ("finished", "failed"):
+        checkpoints.finish(task_id)
+    elif result.get("status") == "timeout":
+        checkpoints.set_stage(task_id, "timeout")
+
+
+def result_image_url(result):
+    """Extrai a URL da imagem do JSON de uma tarefa concluída"""
+    if not result:
+        return ""
+    return result.get("image_url") or (result.get("task_result") or {}).get("image_url", "")
+
+
+class ImageBatch:
+    """Geração concorrente de imagens: um /imagine por personagem, acompanhados em paralelo
+
+    Os envios rodam no executor recebido (que limita a concorrência) e uma única thread
+    consulta todas as tarefas do lote com o PollScheduler. A interface lê progress() na
+    thread do script, já que as threads de trabalho não podem usar st.*.
+    Com um PromptCache, prompts já gerados voltam na hora (a menos que fresh=True).
+    Com um WebhookReceiver, as conclusões chegam por callback e o polling vira só uma
+    consulta de segurança por minuto. on_done(nome, estado), se passado, é chamado (numa
+    thread de trabalho) assim que cada imagem termina ou falha. Com um CheckpointStore,
+    tarefas de prompts interrompidas antes (timeout, rerun, reinício) são retomadas.
+
+    Com upscale (índice 1-4, ou função grade -> índice), cada grade pronta segue direto para o
+    /upscale no mesmo executor, sem esperar as outras nem a interface; o resultado final
+    passa a ser o do upscale e a grade fica em "grade".
+    """
+
+    def __init__(self, api_key, executor, max_wait=300, cache=None, fresh=False, webhook=None, on_done=None,
+                 checkpoints=None, upscale=None):
+        self.api_key = api_key
+        self.checkpoints = checkpoints
+        self.upscale = upscale
+        self.executor = executor
+        self.max_wait = max_wait
+        self.cache = cache
+        self.fresh = fresh
+        self.webhook = webhook
+        self.on_done = on_done
+        self._prompts = {}  # personagem -> prompt (para gravar no cache)
+        self._state = {}
+        self._names = {}  # task_id -> [personagens] (prompts iguais compartilham a tarefa)
+        self._settled = set()  # task_ids já tratados (webhook e consulta de segurança podem chegar os dois)
+        self._final = {}  # task_id -> resultado final, para quem entrar na tarefa depois de resolvida
+        self._poller = None
+        self._scheduler = PollScheduler(
+            lambda task_id: fetch_task(api_key, task_id),
+            deadline=max_wait,
+            **({"initial_interval": WEBHOOK_FALLBACK_INTERVAL, "max_interval": WEBHOOK_FALLBACK_INTERVAL} if webhook else {})
+        )
+        self._lock = threading.Lock()
+        if webhook:
+            webhook.store.add_listener(self._on_webhook)
+
+    def submit(self, name, prompt):
+        cached = self.cache.get(prompt) if self.cache and not self.fresh else None
+        with self._lock:
+            self._prompts[name] = prompt
+            self._state[name] = {
+                "status": "finished" if cached else "na fila",
+                "task_id": cached.get("task_id") if cached else None,
+                "started": None,
+                "result": cached,
+                "grid": None,
+                "upscale_index": None,
+                "error": None,
+                "cached": bool(cached),
+            }
+        if cached and self.upscale:
+            self._start_upscale(name, cached)
+        elif cached:
+            self._notify(name)
+        else:
+            # Contexto copiado: o envio conta no trace da execução que pediu a imagem
+            self.executor.submit(contextvars.copy_context().run, self._run, name, prompt)
+
+    def progress(self):
+        """Cópia do estado de cada personagem: status, tempo decorrido, resultado e erro"""
+        with self._lock:
+            snapshot = {}
+            for name, state in self._state.items():
+                state = dict(state)
+                state["elapsed"] = time.time() - state["started"] if state["started"] else 0.0
+                snapshot[name] = state
+            return snapshot
+
+    def done(self):
+        with self._lock:
+            return all(state["status"] in ("finished", "failed") for state in self._state.values())
+
+    def results(self):
+        """Resultados finais por personagem (None para os que falharam)"""
+        with self._lock:
+            return {name: state["result"] for name, state in self._state.items()}
+
+    def _update(self, name, **fields):
+        with self._lock:
+            self._state[name].update(fields)
+
+    def _notify(self, name):
+        if self.on_done:
+            with self._lock:
+                state = dict(self._state[name])
+            self.on_done(name, state)
+
+    def _run(self, name, prompt):
+        try:
+            self._update(name, status="enviando", started=time.time())
+            task_id = submit_imagine(self.api_key, prompt, webhook=self.webhook, checkpoints=self.checkpoints)
+            self._update(name, status="waiting", task_id=task_id)
+        except Exception as e:
+            self._update(name, status="failed", error=str(e))
+            self._notify(name)
+            return
+        self._track(name, task_id)
+
+    def _start_upscale(self, name, grid):
+        self._update(name, status="upscale na fila", grid=grid)
+        self.executor.submit(contextvars.copy_context().run, self._run_upscale, name, grid)
+
+    def _run_upscale(self, name, grid):
+        try:
+            index = self.upscale(grid) if callable(self.upscale) else self.upscale
+            self._update(name, status="enviando upscale", upscale_index=index)
+            task_id = submit_upscale(
+                self.api_key, grid.get("task_id"), index, webhook=self.webhook, checkpoints=self.checkpoints
+            )
+            self._update(name, status="upscale", task_id=task_id)
+        except Exception as e:
+            self._update(name, status="failed", error=f"Upscale: {e}")
+            self._notify(name)
+            return
+        self._track(name, task_id)
+
+    def _track(self, name, task_id):
+        with self._lock:
+            # Prompts iguais no lote podem voltar com o mesmo task_id (checkpoint): todos esperam a mesma tarefa
+            self._names.setdefault(task_id, []).append(name)
+            final = self._final.get(task_id)
+            if final is None:
+                self._scheduler.add(task_id)
+                if self._poller is None:
+                    self._poller = threading.Thread(
+                        target=contextvars.copy_context().run, args=(self._poll_loop,), name="piapi-poller", daemon=True
+                    )
+                    self._poller.start()
+
+        # Tarefa já resolvida para outro personagem do lote
+        if final is not None:
+            self._settle(name, task_id, final)
+            return
+        # Callback que chegou antes de o task_id ser registrado aqui
+        if self.webhook:
+            early = self.webhook.store.get(task_id)
+            if early:
+                self._on_webhook(task_id, early)
+
+    def _poll_loop(self):
+        while True:
+            with self._lock:
+                # Decidir a saída sob o lock: um envio concorrente recria o poller se preciso
+                if not self._scheduler.pending():
+                    self._poller = None
+                    return
+            for task_id, result in self._scheduler.tick():
+                self._on_result(task_id, result)
+            time.sleep(min(self._scheduler.next_wakeup(), 1.0))
+
+    def _on_webhook(self, task_id, result):
+        with self._lock:
+            ours = task_id in self._names
+        if ours:
+            self._scheduler.discard(task_id)
+            self._on_result(task_id, result)
+
+    def _on_result(self, task_id, result):
+        with self._lock:
+            if task_id in self._settled:
+                return
+            names = list(self._names[task_id])
+        if result.get("status") not in ("finished", "failed", "timeout"):
+            for name in names:
+                with self._lock:
+                    upscaling = self._state[name]["grid"] is not None
+                self._update(name, status=f"upscale: {result.get('status')}" if upscaling else result.get("status"))
+            return
+        with self._lock:
+            if task_id in self._settled:
+                return
+            self._settled.add(task_id)
+            self._final[task_id] = result
+            names = list(self._names[task_id])
+        for name in names:
+            self._settle(name, task_id, result)
+
+    def _settle(self, name, task_id, result):
+        """Aplica o resultado final de task_id a um personagem (grade ou upscale)"""
+        with self._lock:
+            upscaling = self._state[name]["grid"] is not None
+        try:
+            check_result(result)
+            if not upscaling and self.cache:
+                self.cache.put(self._prompts[name], result)
+            if not upscaling and self.upscale:
+                settle_checkpoint(self.checkpoints, task_id, result)
+                self._start_upscale(name, result)
+                return
+            self._update(name, status="finished", result=result)
+        except PiapiError as e:
+            self._update(name, status="failed", error=f"Upscale: {e}" if upscaling else str(e))
+        settle_checkpoint(self.checkpoints, task_id, result)
+        self._notify(name)
+        if self.webhook and self.done():
+            self.webhook.store.remove_listener(self._on_webhook)
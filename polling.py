@@ -0,0 +1,163 @@
+import random
+import statistics
+import threading
+import time
+from collections import deque
+
+TERMINAL_STATUS = {"finished", "failed"}
+# Falha ao consultar (rede, 5xx depois dos retries): não diz nada sobre a tarefa, segue consultando
+FETCH_ERROR_STATUS = "error"
+
+
+class PollStats:
+    """Estatísticas de polling: tempo até a primeira conclusão e consultas por tarefa
+
+    Serve para calibrar os intervalos com dados reais em vez de chutes.
+    """
+
+    def __init__(self, max_samples=500):
+        self._finish_times = deque(maxlen=max_samples)
+        self._polls = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, elapsed, polls):
+        with self._lock:
+            self._finish_times.append(elapsed)
+            self._polls.append(polls)
+
+    def summary(self):
+        with self._lock:
+            times = sorted(self._finish_times)
+            polls = list(self._polls)
+        if not times:
+            return {"tarefas": 0}
+        return {
+            "tarefas": len(times),
+            "media_s": statistics.fmean(times),
+            "p50_s": _percentile(times, 0.5),
+            "p90_s": _percentile(times, 0.9),
+            "max_s": times[-1],
+            "consultas_por_tarefa": statistics.fmean(polls),
+        }
+
+
+def _percentile(sorted_values, q):
+    index = min(int(q * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+# Estatísticas do processo inteiro (todas as sessões)
+POLL_STATS = PollStats()
+
+
+class PollScheduler:
+    """Polling adaptativo de várias tarefas num mesmo laço
+
+    Cada tarefa começa com um intervalo curto que cresce exponencialmente (com jitter)
+    até max_interval; a cada volta do laço são consultadas todas as tarefas vencidas.
+    Tarefas que passam de deadline segundos são encerradas com status "timeout"; uma
+    consulta que falha volta como FETCH_ERROR_STATUS e a tarefa continua sendo acompanhada.
+    Por padrão segue os status da PIAPI; terminal/success permitem usar outras APIs.
+    """
+
+    def __init__(self, fetch, deadline=300, initial_interval=2.0, max_interval=15.0,
+                 factor=1.5, jitter=0.25, stats=POLL_STATS, terminal=TERMINAL_STATUS,
+                 success="finished"):
+        self.fetch = fetch
+        self.terminal = terminal
+        self.success = success
+        self.deadline = deadline
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.jitter = jitter
+        self.stats = stats
+        self.results = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def add(self, task_id):
+        now = time.monotonic()
+        with self._lock:
+            self._tasks[task_id] = {
+                "added": now,
+                "next_poll": now + self._jittered(self.initial_interval),
+                "interval": self.initial_interval,
+                "polls": 0,
+            }
+
+    def discard(self, task_id):
+        """Para de acompanhar a tarefa (ex.: conclusão recebida por webhook)"""
+        with self._lock:
+            self._tasks.pop(task_id, None)
+
+    def pending(self):
+        with self._lock:
+            return list(self._tasks)
+
+    def tick(self):
+        """Consulta as tarefas vencidas; devolve [(task_id, resultado)] das consultas feitas"""
+        now = time.monotonic()
+        with self._lock:
+            due = [task_id for task_id, task in self._tasks.items() if task["next_poll"] <= now]
+
+        updates = []
+        for task_id in due:
+            try:
+                result = self.fetch(task_id)
+            except Exception as e:
+                result = {"task_id": task_id, "status": FETCH_ERROR_STATUS, "error": str(e)}
+            updates.append((task_id, result))
+            self._after_poll(task_id, result)
+
+        updates.extend(self._expire())
+        return updates
+
+    def next_wakeup(self):
+        """Segundos até a próxima consulta vencer (0 se não há tarefas)"""
+        with self._lock:
+            if not self._tasks:
+                return 0
+            return max(0.0, min(task["next_poll"] for task in self._tasks.values()) - time.monotonic())
+
+    def run(self, on_update=None):
+        """Roda até todas as tarefas terminarem; on_update(task_id, resultado) a cada consulta"""
+        while self.pending():
+            for task_id, result in self.tick():
+                if on_update:
+                    on_update(task_id, result)
+            time.sleep(self.next_wakeup())
+        return self.results
+
+    def _after_poll(self, task_id, result):
+        now = time.monotonic()
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return
+            task["polls"] += 1
+            task["last_error"] = result.get("error") if result.get("status") == FETCH_ERROR_STATUS else None
+            if result.get("status") in self.terminal:
+                del self._tasks[task_id]
+                self.results[task_id] = result
+                if result.get("status") == self.success and self.stats is not None:
+                    self.stats.record(now - task["added"], task["polls"])
+                return
+            task["interval"] = min(task["interval"] * self.factor, self.max_interval)
+            # Nunca dormir além do prazo da tarefa
+            task["next_poll"] = min(now + self._jittered(task["interval"]), task["added"] + self.deadline)
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for task_id in [t for t, task in self._tasks.items() if now - task["added"] >= self.deadline]:
+                task = self._tasks.pop(task_id)
+                self.results[task_id] = {"task_id": task_id, "status": "timeout"}
+                if task.get("last_error"):
+                    self.results[task_id]["error"] = task["last_error"]
+                expired.append((task_id, self.results[task_id]))
+        return expired
+
+    def _jittered(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
@@ -0,0 +1,67 @@
+import hashlib
+import json
+
+from local_store import LruCache, cache_path, connect
+
+
+def normalize_prompt(prompt):
+    """Normaliza o prompt para que variações de espaço/maiúsculas caiam na mesma chave"""
+    return " ".join((prompt or "").split()).lower()
+
+
+def cache_key(prompt, model, aspect_ratio):
+    payload = json.dumps([normalize_prompt(prompt), model, aspect_ratio])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PromptCache(LruCache):
+    """Cache persistente (SQLite) prompt → resultado das gerações Midjourney
+
+    A chave é o hash do prompt normalizado + modelo + aspect ratio. Guarda o JSON da
+    tarefa concluída e as URLs das imagens, para achar a tarefa a partir de uma imagem.
+    """
+
+    table = "generations"
+    columns = """
+                    prompt TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    aspect_ratio TEXT NOT NULL,
+                    task_id TEXT,
+                    result TEXT NOT NULL,
+                    image_urls TEXT NOT NULL"""
+
+    def __init__(self, path=None, max_entries=1000, max_age_days=30):
+        super().__init__(path or cache_path("midjourney.sqlite3"), max_entries, max_age_days)
+
+    def get(self, prompt, model="mj-6", aspect_ratio="1:1"):
+        """Resultado em cache (JSON da tarefa) ou None"""
+        result = self._lookup(cache_key(prompt, model, aspect_ratio), "result")
+        return json.loads(result) if result is not None else None
+
+    def put(self, prompt, result, model="mj-6", aspect_ratio="1:1"):
+        """Guarda o resultado de uma tarefa concluída (substitui o anterior do mesmo prompt)"""
+        self._store(
+            cache_key(prompt, model, aspect_ratio),
+            prompt,
+            model,
+            aspect_ratio,
+            result.get("task_id"),
+            json.dumps(result),
+            json.dumps(_image_urls(result)),
+        )
+
+    def find_by_image(self, url):
+        """Resultado da tarefa que gerou a imagem url (ou None), sem contar como hit/miss"""
+        with self._lock, connect(self.path) as conn:
+            row = conn.execute(
+                "SELECT result FROM generations WHERE instr(image_urls, ?) > 0 ORDER BY last_used DESC LIMIT 1",
+                (json.dumps(url),)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+def _image_urls(result):
+    task_result = result.get("task_result") or {}
+    urls = [result.get("image_url"), task_result.get("image_url")]
+    urls += task_result.get("image_urls") or []
+    return [url for url in dict.fromkeys(urls) if url]
@@ -0,0 +1,168 @@
+import contextvars
+import heapq
+import itertools
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import tracing
+
+INTERACTIVE = 0  # leituras e ações de quem está olhando a tela
+BACKGROUND = 1  # geração em segundo plano (fila de tarefas, pré-busca, sincronização)
+PRIORITY_NAMES = {INTERACTIVE: "interativa", BACKGROUND: "fundo"}
+
+# Threads novas começam sem contexto, portanto em BACKGROUND; o script do Streamlit se
+# declara interativo a cada execução (e asyncio.to_thread/copy_context herdam isso)
+_priority = contextvars.ContextVar("tenda_priority", default=BACKGROUND)
+
+
+class UpstreamLimiter:
+    """Token bucket por upstream com fila de prioridade e limite de requisições simultâneas
+
+    Os tokens voltam a per_minute/60 por segundo, até burst acumulados. Quem chega espera
+    na fila: primeiro a prioridade menor (INTERACTIVE), depois a ordem de chegada. Um 429
+    com Retry-After pausa o upstream inteiro pelo tempo pedido, em vez de cada thread
+    descobrir a quota sozinha e gerar uma tempestade de erros.
+    """
+
+    def __init__(self, host, per_minute, concurrency=None, burst=None, max_samples=500):
+        self.host = host
+        self.rate = per_minute / 60
+        self.capacity = burst or max(1, per_minute // 6)
+        self.concurrency = concurrency
+        self.tokens = float(self.capacity)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.pauses = 0
+        self._updated = time.monotonic()
+        self._waiting = []  # heap de (prioridade, chegada)
+        self._arrivals = itertools.count()
+        self._waits = deque(maxlen=max_samples)  # (prioridade, segundos de espera)
+        self._cond = threading.Condition()
+
+    def acquire(self, priority=None, slot=True):
+        """Bloqueia até haver token (e vaga, se slot=True); devolve os segundos de espera"""
+        priority = _priority.get() if priority is None else priority
+        ticket = (priority, next(self._arrivals))
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    delay = self._delay(time.monotonic(), slot)
+                    if self._waiting[0] == ticket and delay == 0:
+                        break
+                    # Fora da frente da fila, espera ser acordado; na frente, espera o token
+                    self._cond.wait(delay if self._waiting[0] == ticket else None)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+            self.tokens -= 1
+            if slot:
+                self.in_flight += 1
+        waited = time.monotonic() - start
+        self._waits.append((priority, waited))
+        tracing.TRACER.observe(
+            "tenda_ratelimit_wait_seconds", {"host": self.host, "prioridade": PRIORITY_NAMES[priority]}, waited
+        )
+        return waited
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        """Segura todas as requisições ao upstream por seconds (Retry-After de um 429)"""
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = min(self.tokens, 0.0)
+            self.pauses += 1
+            self._cond.notify_all()
+        tracing.TRACER.count("tenda_ratelimit_pauses_total", {"host": self.host})
+
+    @contextmanager
+    def request(self, priority=None):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._cond:
+            self._refill(time.monotonic())
+            waiting = [priority for priority, _ in self._waiting]
+            waits = list(self._waits)
+            stats = {
+                "em_andamento": self.in_flight,
+                "tokens": round(self.tokens, 1),
+                "pausado_s": max(0.0, self.paused_until - time.monotonic()),
+                "pausas_429": self.pauses,
+            }
+        for priority, name in PRIORITY_NAMES.items():
+            stats[f"fila_{name}"] = waiting.count(priority)
+            samples = sorted(waited for p, waited in waits if p == priority)
+            stats[f"espera_{name}_p50_ms"] = statistics.median(samples) * 1000 if samples else 0.0
+            stats[f"espera_{name}_max_ms"] = samples[-1] * 1000 if samples else 0.0
+        return stats
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _delay(self, now, slot):
+        """0 se pode seguir; segundos até o próximo token/fim da pausa; None se falta vaga"""
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        if slot and self.concurrency is not None and self.in_flight >= self.concurrency:
+            return None
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0
+
+
+_limiters = {}
+_lock = threading.Lock()
+
+
+def configure(limits):
+    """Define os limites por host: {host: (requisições por minuto, simultâneas ou None)}"""
+    with _lock:
+        for host, (per_minute, concurrency) in limits.items():
+            limiter = _limiters.get(host)
+            if limiter is None or (limiter.rate * 60, limiter.concurrency) != (per_minute, concurrency):
+                _limiters[host] = UpstreamLimiter(host, per_minute, concurrency)
+
+
+def limiter_for(host):
+    """Limitador do host (None se o host não tem limite configurado)"""
+    return _limiters.get(host)
+
+
+def stats():
+    with _lock:
+        limiters = dict(_limiters)
+    return {host: limiter.stats() for host, limiter in limiters.items()}
+
+
+def current_priority():
+    return _priority.get()
+
+
+def set_priority(priority):
+    """Prioridade das requisições feitas a partir deste contexto"""
+    _priority.set(priority)
+
+
+@contextmanager
+def priority(level):
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
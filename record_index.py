@@ -0,0 +1,54 @@
+import unicodedata
+from collections import defaultdict
+
+
+def normalize_text(text):
+    """Minúsculas, sem acentos e com espaços normalizados (para busca)"""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(text.split()).lower()
+
+
+class RecordIndex:
+    """Índice em memória dos registros de uma aba: posições por Status e texto normalizado
+
+    Montado uma vez por versão da réplica; filtros, contagens e paginação consultam o
+    índice em vez de percorrer os registros a cada rerun. As posições são as mesmas de
+    records() e servem só para leitura e paginação; escritas usam o ID estável do
+    registro (record["ID"]), nunca a posição.
+    """
+
+    def __init__(self, records, text_fields, status_field="Status", flags=None):
+        self.records = records
+        self.status_field = status_field
+        self.by_status = defaultdict(list)  # status -> posições, em ordem
+        self.search_text = []
+        self.flags = {name: [] for name in flags or {}}
+        for i, record in enumerate(records):
+            self.by_status[record.get(status_field, "")].append(i)
+            self.search_text.append(" ".join(normalize_text(record.get(field, "")) for field in text_fields))
+            for name, predicate in (flags or {}).items():
+                if predicate(record):
+                    self.flags[name].append(i)
+
+    def __len__(self):
+        return len(self.records)
+
+    def count(self, status=None):
+        return len(self.records) if status is None else len(self.by_status.get(status, []))
+
+    def status_counts(self):
+        return {status: len(positions) for status, positions in self.by_status.items()}
+
+    def flagged(self, name):
+        """[(posição, registro)] que satisfazem o predicado `name` passado em flags"""
+        return [(i, self.records[i]) for i in self.flags[name]]
+
+    def query(self, status=None, text="", offset=0, limit=None):
+        """(total filtrado, [(posição, registro)] da página) filtrando por status e texto"""
+        positions = self.by_status.get(status, []) if status is not None else range(len(self.records))
+        terms = normalize_text(text).split()
+        if terms:
+            positions = [i for i in positions if all(term in self.search_text[i] for term in terms)]
+        end = None if limit is None else offset + limit
+        return len(positions), [(i, self.records[i]) for i in positions[offset:end]]
@@ -0,0 +1,282 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from piapi_client import result_image_url
+from sheet_replica import new_row_id
+
+SCENES_SHEET = "Cenas"
+SCENES_HEADER = [
+    "Episódio ID", "Número", "Título", "Descrição", "Narração",
+    "Prompt Imagem 1", "Prompt Imagem 2", "Link Imagem 1", "Link Imagem 2", "Status", "ID",
+]
+IMAGES_PER_SCENE = 2
+# Uma linha por página de cenas concluída: página curta (menos cenas que o tamanho) = fim do episódio
+PAGES_SHEET = "Cenas Páginas"
+PAGES_HEADER = ["Episódio ID", "Página", "Cenas", "ID"]
+ERROR_COOLDOWN = 300  # página com erro só é gerada de novo depois disso (ou a pedido)
+
+
+def build_scenes_prompt(episode, first, count, previous):
+    """Prompt para o Assistant de cenas: cenas first..first+count-1, continuando as anteriores"""
+    resumo = "\n".join(
+        f"        {scene.get('Número')}. {scene.get('Título')}: {scene.get('Descrição')}"
+        for scene in previous
+    ) or "        (nenhuma, esta é a abertura do episódio)"
+    return """
+        EPISÓDIO: """ + episode.get('Episódio', '') + """
+        DESCRIÇÃO: """ + episode.get('Descrição Curta', '') + """
+        MORAL: """ + episode.get('Moral', '') + """
+
+        CENAS ANTERIORES:
+""" + resumo + """
+
+        Escreva as cenas """ + str(first) + """ a """ + str(first + count - 1) + """ deste episódio,
+        continuando a história das cenas anteriores.
+        Para cada cena, forneça:
+        - Título
+        - Descrição do que acontece
+        - Texto da narração (para criança, em voz alta)
+        - Dois prompts de imagem (estilo 3D Pixar), um para cada momento da cena
+
+        Responda em JSON formato:
+        [
+          {
+            "numero": """ + str(first) + """,
+            "titulo": "Título da cena",
+            "descricao": "O que acontece na cena",
+            "narracao": "Texto da narração",
+            "prompt_imagem_1": "Prompt específico para Midjourney",
+            "prompt_imagem_2": "Prompt específico para Midjourney"
+          }
+        ]
+        """
+
+
+class SceneEngine:
+    """Gera as cenas de um episódio em páginas de 5, em pipeline
+
+    O texto de uma página vem do Assistant em streaming: cada cena é gravada na réplica
+    (aba Cenas) assim que termina de chegar, e suas duas imagens vão na mesma hora para a
+    PIAPI, sem esperar as demais cenas. Quando o texto de uma página fica pronto, a página
+    seguinte começa a ser gerada em segundo plano (prefetch), então "Próximas 5 cenas"
+    normalmente só mostra o que já está pronto. Com um NarrationStore, a narração de cada
+    cena também é sintetizada assim que a cena chega. Tudo roda em threads: nada aqui usa st.*.
+
+    Uma página que falhou guarda o erro e o horário: reruns não chamam o Assistant de novo
+    até passar ERROR_COOLDOWN ou até ensure_page(..., retry=True). Páginas concluídas ficam
+    marcadas na aba PAGES_SHEET, então sobrevivem a reinícios; uma página com menos cenas
+    que page_size encerra o episódio (sem prefetch nem páginas seguintes). Cenas que ficaram
+    em "Gerando imagens" sem lote vivo (processo reiniciado) têm as imagens reenviadas.
+    """
+
+    def __init__(self, assistants, assistant_id, replica, new_image_batch, page_size=5, max_workers=2,
+                 narration=None):
+        self.assistants = assistants
+        self.assistant_id = assistant_id
+        self.replica = replica
+        self.new_image_batch = new_image_batch  # on_done -> ImageBatch
+        self.page_size = page_size
+        self.narration = narration
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scenes")
+        self._pages = {}  # (episódio, página) -> {"status", "erro", "em"}
+        self._indexes = {}  # aba -> (versão da réplica, episódio -> registros)
+        self._live_scenes = set()  # IDs de cenas com imagens num lote deste processo
+        self._lock = threading.Lock()
+
+    def scenes(self, episode_id):
+        """Cenas já geradas do episódio, em ordem (índice remontado só quando a aba muda)"""
+        return list(self._by_episode(SCENES_SHEET, "Número").get(episode_id, []))
+
+    def completed_pages(self, episode_id):
+        """{página: nº de cenas} das páginas já concluídas do episódio"""
+        return {
+            int(marker.get("Página") or 0): int(marker.get("Cenas") or 0)
+            for marker in self._by_episode(PAGES_SHEET, "Página").get(episode_id, [])
+        }
+
+    def last_page(self, episode_id):
+        """Página que encerrou o episódio (veio curta), ou None se ainda há mais"""
+        short = [page for page, count in self.completed_pages(episode_id).items() if count < self.page_size]
+        return min(short) if short else None
+
+    def page_state(self, episode_id, page):
+        """{"status": "pendente" | "gerando" | "pronta" | "erro" | "fim", "erro": ..., "em": ...} da página
+
+        page 0 = cenas 1-5; "fim" é uma página depois da última do episódio.
+        """
+        last = self.last_page(episode_id)
+        if last is not None and page > last:
+            return {"status": "fim", "erro": None}
+        with self._lock:
+            state = self._pages.get((episode_id, page))
+            if state is not None and state["status"] != "pronta":
+                return dict(state)
+        if page in self.completed_pages(episode_id) or len(self._page_scenes(episode_id, page)) >= self.page_size:
+            return {"status": "pronta", "erro": None}
+        return dict(state) if state else {"status": "pendente", "erro": None}
+
+    def ensure_page(self, episode, page, prefetch=True, retry=False):
+        """Garante que a página existe ou está sendo gerada; com prefetch, adianta a seguinte
+
+        Página com erro recente fica no erro (sem nova chamada paga) a menos que retry=True.
+        """
+        episode_id = episode["ID"]
+        self._resume_images(episode_id)
+        state = self.page_state(episode_id, page)
+        if state["status"] == "fim":
+            return state
+        if state["status"] == "pronta":
+            if prefetch and self.last_page(episode_id) != page:
+                self.ensure_page(episode, page + 1, prefetch=False)
+            return state
+        with self._lock:
+            current = self._pages.get((episode_id, page))
+            if current and current["status"] == "gerando":
+                return dict(current)
+            if current and current["status"] == "erro" and not retry and time.time() - current["em"] < ERROR_COOLDOWN:
+                return dict(current)
+            self._pages[(episode_id, page)] = {"status": "gerando", "erro": None}
+        self._executor.submit(self._generate_page, episode, page, prefetch)
+        return {"status": "gerando", "erro": None}
+
+    def images_pending(self, episode_id):
+        return any(s.get("Status") == "Gerando imagens" for s in self.scenes(episode_id))
+
+    def narration_pending(self, episode_id):
+        if self.narration is None:
+            return False
+        return any(self.narration.pending(s.get("Narração", "")) for s in self.scenes(episode_id))
+
+    def _by_episode(self, sheet, order_field):
+        version = self.replica.version(sheet)
+        with self._lock:
+            indexed_version, by_episode = self._indexes.get(sheet, (None, {}))
+        if indexed_version != version:
+            by_episode = {}
+            for record in self.replica.records(sheet):
+                by_episode.setdefault(record.get("Episódio ID"), []).append(record)
+            for records in by_episode.values():
+                records.sort(key=lambda r: int(r.get(order_field) or 0))
+            with self._lock:
+                self._indexes[sheet] = (version, by_episode)
+        return by_episode
+
+    def _page_scenes(self, episode_id, page):
+        first = page * self.page_size + 1
+        return [
+            s for s in self.scenes(episode_id)
+            if first <= int(s.get("Número") or 0) < first + self.page_size
+        ]
+
+    def _generate_page(self, episode, page, prefetch):
+        episode_id = episode["ID"]
+        first = page * self.page_size + 1
+        existing = {int(s.get("Número") or 0) for s in self._page_scenes(episode_id, page)}
+        previous = [s for s in self.scenes(episode_id) if int(s.get("Número") or 0) < first]
+        images = {"pending": {}, "failed": set()}  # cena -> imagens que faltam; cenas com falha
+        batch = self.new_image_batch(lambda name, state: self._on_image(name, state, images))
+        try:
+            prompt = build_scenes_prompt(episode, first, self.page_size, previous)
+            number = first
+            for scene in self.assistants.stream_json_objects(self.assistant_id, prompt):
+                # Numeração pelo que chegou, não pelo que o Assistant escreveu
+                if number >= first + self.page_size:
+                    break
+                if number not in existing:
+                    self._store_scene(episode_id, number, scene, batch, images)
+                number += 1
+        except Exception as e:
+            with self._lock:
+                self._pages[(episode_id, page)] = {
+                    "status": "erro", "erro": str(e) or type(e).__name__, "em": time.time()
+                }
+            return
+
+        count = number - first
+        if page not in self.completed_pages(episode_id):
+            self.replica.append(PAGES_SHEET, [{"Episódio ID": episode_id, "Página": str(page), "Cenas": str(count)}])
+        with self._lock:
+            self._pages[(episode_id, page)] = {"status": "pronta", "erro": None}
+        # Página curta: o episódio acabou, não há o que adiantar
+        if prefetch and count >= self.page_size:
+            self.ensure_page(episode, page + 1, prefetch=False)
+
+    def _store_scene(self, episode_id, number, scene, batch, images):
+        prompts = [scene.get(f"prompt_imagem_{slot}", "") for slot in range(1, IMAGES_PER_SCENE + 1)]
+        # ID antes de gravar: a cena já nasce com lote vivo, sem ser confundida com uma órfã
+        scene_id = new_row_id()
+        with self._lock:
+            self._live_scenes.add(scene_id)
+        self.replica.append(SCENES_SHEET, [{
+            "ID": scene_id,
+            "Episódio ID": episode_id,
+            "Número": str(number),
+            "Título": scene.get("titulo", ""),
+            "Descrição": scene.get("descricao", ""),
+            "Narração": scene.get("narracao", ""),
+            "Prompt Imagem 1": prompts[0],
+            "Prompt Imagem 2": prompts[1],
+            "Status": "Gerando imagens" if any(prompts) else "Pronta",
+        }])
+        if self.narration is not None and scene.get("narracao"):
+            self.narration.submit(scene["narracao"])
+        # As imagens desta cena começam já, enquanto as próximas cenas ainda chegam
+        self._submit_images(scene_id, dict(enumerate(prompts, start=1)), batch, images)
+
+    def _submit_images(self, scene_id, prompts, batch, images):
+        """Envia {slot: prompt} da cena no lote; a cena sai de _live_scenes quando todas terminam"""
+        prompts = {slot: prompt for slot, prompt in prompts.items() if prompt}
+        with self._lock:
+            images["pending"][scene_id] = set(prompts)
+            if not prompts:
+                self._live_scenes.discard(scene_id)
+        for slot, prompt in prompts.items():
+            batch.submit(f"{scene_id}:{slot}", prompt)
+
+    def _resume_images(self, episode_id):
+        """Reenvia as imagens de cenas em "Gerando imagens" sem lote vivo (ex.: depois de reiniciar)
+
+        Com checkpoints da PIAPI, o reenvio retoma a tarefa original em vez de pagar outra.
+        """
+        orphans = []
+        scenes = self.scenes(episode_id)
+        with self._lock:
+            for scene in scenes:
+                if scene.get("Status") == "Gerando imagens" and scene.get("ID") not in self._live_scenes:
+                    self._live_scenes.add(scene["ID"])
+                    orphans.append(scene)
+        if not orphans:
+            return
+        images = {"pending": {}, "failed": set()}
+        batch = self.new_image_batch(lambda name, state: self._on_image(name, state, images))
+        for scene in orphans:
+            missing = {
+                slot: scene.get(f"Prompt Imagem {slot}", "")
+                for slot in range(1, IMAGES_PER_SCENE + 1)
+                if not scene.get(f"Link Imagem {slot}", "").startswith("http")
+            }
+            if not any(missing.values()):
+                # Nada a gerar: as imagens que havia já estão gravadas
+                self.replica.update(SCENES_SHEET, [(scene["ID"], "Status", "Pronta")])
+            self._submit_images(scene["ID"], missing, batch, images)
+
+    def _on_image(self, name, state, images):
+        scene_id, slot = name.rsplit(":", 1)
+        image_url = result_image_url(state["result"]) if state["status"] == "finished" else None
+        updates = []
+        if image_url:
+            # Fica a grade 2×2 do /imagine; o vídeo usa a variação recortada (EpisodeRenderer.scene_frame)
+            updates.append((scene_id, f"Link Imagem {slot}", image_url))
+        with self._lock:
+            images["pending"][scene_id].discard(int(slot))
+            if not image_url:
+                images["failed"].add(scene_id)
+            finished = not images["pending"][scene_id]
+            failed = scene_id in images["failed"]
+            if finished:
+                self._live_scenes.discard(scene_id)
+        if finished:
+            updates.append((scene_id, "Status", "Erro nas imagens" if failed else "Pronta"))
+        if updates:
+            self.replica.update(SCENES_SHEET, updates)
@@ -0,0 +1,530 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import rowcol_to_a1
+
+from local_store import cache_path, connect
+from sheet_writes import append_rows_batched, batch_update_cells
+from tracing import traced
+
+TAIL_RANGE_LAST_COLUMN = "ZZ"
+ID_FIELD = "ID"
+SCHEMA_VERSION = 2  # 2: linhas identificadas por ID estável (coluna ID na planilha)
+LEGACY_CELLS_TABLE = "outbox_cells_v1"  # edições por posição herdadas da réplica v1
+
+logger = logging.getLogger(__name__)
+
+
+def new_row_id():
+    return uuid.uuid4().hex[:12]
+
+
+class SheetReplica:
+    """Réplica local (SQLite) das abas da planilha, sincronizada por deltas
+
+    A interface lê só do SQLite. Escritas vão para o banco e para uma fila de saída
+    (outbox), enviada em lotes pela sincronização em segundo plano. A cada ciclo a
+    sincronização compara o horário de modificação da planilha; se mudou, lê apenas as
+    linhas depois da última conhecida e, se não havia linhas novas (edição no meio da
+    aba), relê a aba e grava só as linhas cujo carimbo (hash) mudou.
+
+    Cada linha tem um ID estável na coluna ID da planilha (linhas antigas recebem um na
+    primeira sincronização). Escritas são endereçadas por ID; a linha física só é
+    resolvida no envio, pelo índice ID → linha mantido a cada leitura, então linhas
+    acrescentadas ou removidas por outros editores não deslocam as atualizações.
+    """
+
+    def __init__(self, spreadsheet, sheets, path=None, interval=30, full_sync_every=600):
+        self.spreadsheet = spreadsheet
+        self.sheets = sheets  # aba -> cabeçalho padrão (usado offline e ao criar a aba)
+        self.path = path or cache_path("planilha.sqlite3")
+        self.interval = interval
+        self.full_sync_every = full_sync_every
+        self._sync_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._worksheets = {}  # aba -> Worksheet (evita sheet.worksheet() a cada envio)
+        self._headers = {}  # aba -> cabeçalho
+        self._versions = Counter()  # aba -> muda a cada alteração local ou sincronizada
+        with connect(self.path) as conn:
+            legacy_rows = []
+            if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                legacy_rows = self._migrate_outbox(conn)
+                # rows/sync_state são só cache da planilha: recomeçam do zero
+                for table in ("rows", "sync_state", "outbox_rows"):
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rows (
+                    sheet TEXT NOT NULL,
+                    row_number INTEGER NOT NULL,
+                    row_id TEXT NOT NULL,
+                    row_values TEXT NOT NULL,
+                    stamp TEXT NOT NULL,
+                    PRIMARY KEY (sheet, row_number)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS rows_id ON rows (sheet, row_id)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    sheet TEXT PRIMARY KEY,
+                    header TEXT NOT NULL,
+                    modified TEXT,
+                    synced_at REAL,
+                    full_synced_at REAL,
+                    error TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox_rows (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sheet TEXT NOT NULL,
+                    row_id TEXT NOT NULL,
+                    row_values TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox_cells (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sheet TEXT NOT NULL,
+                    row_id TEXT NOT NULL,
+                    col INTEGER NOT NULL,
+                    value TEXT NOT NULL
+                )
+            """)
+            conn.executemany("INSERT INTO outbox_rows (sheet, row_id, row_values) VALUES (?, ?, ?)", legacy_rows)
+
+    def _migrate_outbox(self, conn):
+        """Preserva a outbox de uma réplica v1 (sem IDs) antes de reconstruir o resto
+
+        Linhas pendentes ganham um ID e continuam na outbox. Edições de células v1 eram
+        por posição e não há ID para elas ainda: ficam em LEGACY_CELLS_TABLE e são enviadas
+        como antes, na primeira sincronização da aba, antes de qualquer leitura.
+        """
+        tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        headers = {}
+        if "sync_state" in tables:
+            headers = {sheet: json.loads(header) for sheet, header in conn.execute("SELECT sheet, header FROM sync_state")}
+
+        legacy_rows = []
+        if "outbox_rows" in tables and "row_id" not in _columns(conn, "outbox_rows"):
+            for sheet, values in conn.execute("SELECT sheet, row_values FROM outbox_rows ORDER BY id").fetchall():
+                header = _with_id(headers.get(sheet) or self.sheets.get(sheet, []))
+                row_id = new_row_id()
+                legacy_rows.append((sheet, row_id, json.dumps(_set(json.loads(values), header.index(ID_FIELD) + 1, row_id))))
+
+        legacy_cells = 0
+        if "outbox_cells" in tables and "row_id" not in _columns(conn, "outbox_cells"):
+            legacy_cells = conn.execute("SELECT COUNT(*) FROM outbox_cells").fetchone()[0]
+            if legacy_cells and LEGACY_CELLS_TABLE not in tables:
+                conn.execute(f"ALTER TABLE outbox_cells RENAME TO {LEGACY_CELLS_TABLE}")
+            elif legacy_cells:
+                conn.execute(
+                    f"INSERT INTO {LEGACY_CELLS_TABLE} (sheet, row_number, col, value) "
+                    "SELECT sheet, row_number, col, value FROM outbox_cells ORDER BY id"
+                )
+                conn.execute("DROP TABLE outbox_cells")
+            else:
+                conn.execute("DROP TABLE outbox_cells")
+
+        if legacy_rows or legacy_cells:
+            logger.warning(
+                "Réplica da planilha migrada para a versão %s: %s linha(s) e %s célula(s) pendentes preservadas",
+                SCHEMA_VERSION, len(legacy_rows), legacy_cells
+            )
+        return legacy_rows
+
+    # Leitura (local)
+
+    def records(self, name):
+        """Registros da aba como em get_all_records (linhas ainda não enviadas no fim)"""
+        if self.spreadsheet is not None and self._state(name) is None:
+            # Primeira execução: uma carga completa antes de mostrar a aba
+            self.sync(name)
+        header = self.header(name)
+        with connect(self.path) as conn:
+            rows = [json.loads(v) for (v,) in conn.execute(
+                "SELECT row_values FROM rows WHERE sheet = ? ORDER BY row_number", (name,)
+            )]
+            rows += [json.loads(v) for (v,) in conn.execute(
+                "SELECT row_values FROM outbox_rows WHERE sheet = ? ORDER BY id", (name,)
+            )]
+        return [_record(header, values) for values in rows]
+
+    def record(self, name, row_id):
+        """Um registro pelo ID (leitura local pontual), ou None"""
+        with connect(self.path) as conn:
+            row = conn.execute(
+                "SELECT row_values FROM rows WHERE sheet = ? AND row_id = ?", (name, row_id)
+            ).fetchone() or conn.execute(
+                "SELECT row_values FROM outbox_rows WHERE sheet = ? AND row_id = ?", (name, row_id)
+            ).fetchone()
+        return _record(self.header(name), json.loads(row[0])) if row else None
+
+    def version(self, name):
+        """Número que muda sempre que os registros da aba mudam (chave para índices em memória)"""
+        return self._versions[name]
+
+    def header(self, name):
+        header = self._headers.get(name)
+        if header is None:
+            state = self._state(name)
+            header = json.loads(state["header"]) if state else _with_id(self.sheets.get(name, []))
+            self._headers[name] = header
+        return header
+
+    def row_number(self, name, row_id):
+        """Linha física (1 = cabeçalho) do ID na última sincronização, ou None"""
+        with connect(self.path) as conn:
+            row = conn.execute(
+                "SELECT row_number FROM rows WHERE sheet = ? AND row_id = ?", (name, row_id)
+            ).fetchone()
+        return row[0] if row else None
+
+    # Escrita (local + outbox)
+
+    def append(self, name, records):
+        """Acrescenta registros (dicts pelo cabeçalho); devolve os IDs gerados"""
+        header = self.header(name)
+        ids = []
+        rows = []
+        for record in records:
+            record = dict(record)
+            record[ID_FIELD] = record.get(ID_FIELD) or new_row_id()
+            ids.append(record[ID_FIELD])
+            rows.append((name, record[ID_FIELD], json.dumps([record.get(field, "") for field in header])))
+        with connect(self.path) as conn:
+            conn.executemany("INSERT INTO outbox_rows (sheet, row_id, row_values) VALUES (?, ?, ?)", rows)
+        self._versions[name] += 1
+        self.request_sync()
+        return ids
+
+    def update(self, name, updates):
+        """Atualiza campos [(ID, campo, valor)]: enviados como escritas pontuais de células"""
+        columns = {field: col for col, field in enumerate(self.header(name), start=1)}
+        with connect(self.path) as conn:
+            for row_id, field, value in updates:
+                col = columns[field]
+                row = conn.execute(
+                    "SELECT row_number, row_values FROM rows WHERE sheet = ? AND row_id = ?",
+                    (name, row_id)
+                ).fetchone()
+                if row is not None:
+                    values = _set(json.loads(row[1]), col, value)
+                    conn.execute(
+                        "UPDATE rows SET row_values = ?, stamp = ? WHERE sheet = ? AND row_number = ?",
+                        (json.dumps(values), _stamp(values), name, row[0])
+                    )
+                    conn.execute(
+                        "INSERT INTO outbox_cells (sheet, row_id, col, value) VALUES (?, ?, ?, ?)",
+                        (name, row_id, col, value)
+                    )
+                    continue
+                # Linha ainda na outbox: basta corrigir o que vai ser enviado
+                row = conn.execute(
+                    "SELECT id, row_values FROM outbox_rows WHERE sheet = ? AND row_id = ?",
+                    (name, row_id)
+                ).fetchone()
+                if row is None:
+                    raise KeyError(f"ID {row_id} não existe em {name}")
+                conn.execute(
+                    "UPDATE outbox_rows SET row_values = ? WHERE id = ?",
+                    (json.dumps(_set(json.loads(row[1]), col, value)), row[0])
+                )
+        self._versions[name] += 1
+        self.request_sync()
+
+    # Sincronização
+
+    def start(self):
+        """Inicia a sincronização periódica em segundo plano (uma vez por processo)"""
+        if self._thread is None and self.spreadsheet is not None:
+            self._thread = threading.Thread(target=self._loop, name="sheet-sync", daemon=True)
+            self._thread.start()
+
+    def request_sync(self):
+        """Antecipa o próximo ciclo (ex.: logo depois de uma escrita local)"""
+        self._wakeup.set()
+
+    @traced("replica.sync")
+    def sync(self, name=None, full=False):
+        """Sincroniza uma aba (ou todas) agora: puxa as mudanças remotas e envia a outbox"""
+        if self.spreadsheet is None:
+            return {}
+        names = [name] if name else list(self.sheets)
+        changed = {}
+        with self._sync_lock:
+            for sheet_name in names:
+                try:
+                    changed[sheet_name] = self._sync_sheet(sheet_name, full)
+                    self._set_error(sheet_name, None)
+                except Exception as e:
+                    self._set_error(sheet_name, str(e) or type(e).__name__)
+                    raise
+        return changed
+
+    def stats(self):
+        with connect(self.path) as conn:
+            counts = dict(conn.execute("SELECT sheet, COUNT(*) FROM rows GROUP BY sheet").fetchall())
+            pending_rows = dict(conn.execute("SELECT sheet, COUNT(*) FROM outbox_rows GROUP BY sheet").fetchall())
+            pending_cells = dict(conn.execute("SELECT sheet, COUNT(*) FROM outbox_cells GROUP BY sheet").fetchall())
+        stats = {}
+        for name in self.sheets:
+            state = self._state(name) or {}
+            stats[name] = {
+                "linhas": counts.get(name, 0),
+                "pendentes": pending_rows.get(name, 0) + pending_cells.get(name, 0),
+                "sincronizado_ha_s": time.time() - state["synced_at"] if state.get("synced_at") else None,
+                "erro": state.get("error"),
+            }
+        return stats
+
+    def _loop(self):
+        while True:
+            self._wakeup.wait(timeout=self.interval)
+            self._wakeup.clear()
+            try:
+                self.sync()
+            except Exception:
+                pass  # erro fica em sync_state e aparece em stats(); tenta de novo no próximo ciclo
+
+    def _sync_sheet(self, name, full):
+        ws = self._worksheet(name)
+        state = self._state(name)
+        # Carimbo lido antes de enviar: só mudanças de outros editores contam
+        modified = self._modified()
+
+        # Edições por posição da réplica v1: valem para a planilha como ela está agora
+        pushed = self._push_legacy_cells(ws, name)
+        changed = 0
+        if state is None or full or time.time() - (state["full_synced_at"] or 0) >= self.full_sync_every:
+            changed = self._pull_full(ws, name)
+        elif modified is None or modified != state["modified"]:
+            # Linhas novas no fim da aba? Se não, foi edição no meio: reler e comparar carimbos
+            changed = self._pull_tail(ws, name) or self._pull_full(ws, name)
+
+        # Depois de puxar: o índice ID → linha já reflete inserções/remoções remotas
+        pushed += self._push_cells(ws, name) + self._push_rows(ws, name)
+        if pushed:
+            # Nossas próprias escritas não devem disparar outra releitura no próximo ciclo
+            modified = self._modified()
+        with connect(self.path) as conn:
+            conn.execute(
+                "UPDATE sync_state SET modified = ?, synced_at = ? WHERE sheet = ?",
+                (modified, time.time(), name)
+            )
+        if changed:
+            self._versions[name] += 1
+        return changed + pushed
+
+    def _pull_full(self, ws, name):
+        values = [_trim(row) for row in ws.get_all_values()]
+        header = values[0] if values else list(self.sheets.get(name, []))
+        with connect(self.path) as conn:
+            if ID_FIELD not in header:
+                # Aba sem coluna ID: cria a coluna (o cabeçalho vai na próxima escrita)
+                header = header + [ID_FIELD]
+                self._queue_header_cell(conn, name, len(header))
+            current = dict(conn.execute(
+                "SELECT row_number, stamp FROM rows WHERE sheet = ?", (name,)
+            ).fetchall())
+            rows = []
+            for row_number, row in enumerate(values[1:], start=2):
+                if current.pop(row_number, None) != _stamp(row):
+                    rows.append((row_number, row))
+            # Linhas que sumiram da planilha
+            conn.executemany(
+                "DELETE FROM rows WHERE sheet = ? AND row_number = ?",
+                [(name, row_number) for row_number in current]
+            )
+            self._store_rows(conn, name, header, rows)
+            conn.execute(
+                "INSERT INTO sync_state (sheet, header, full_synced_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(sheet) DO UPDATE SET header = excluded.header, full_synced_at = excluded.full_synced_at",
+                (name, json.dumps(header), time.time())
+            )
+        self._headers[name] = header
+        return len(rows) + len(current)
+
+    def _pull_tail(self, ws, name):
+        """Lê a partir da última linha conhecida; 0 se ela mudou de lugar (precisa de leitura completa)"""
+        header = self.header(name)
+        with connect(self.path) as conn:
+            last, last_id = conn.execute(
+                "SELECT row_number, row_id FROM rows WHERE sheet = ? ORDER BY row_number DESC LIMIT 1", (name,)
+            ).fetchone() or (1, None)
+        tail = [_trim(row) for row in ws.get(f"{rowcol_to_a1(last, 1)}:{TAIL_RANGE_LAST_COLUMN}")]
+        if last_id is not None:
+            # A linha de sobreposição tem de ser a mesma: senão houve inserção/remoção no meio
+            id_col = header.index(ID_FIELD)
+            if not tail or (tail[0][id_col] if len(tail[0]) > id_col else "") != last_id:
+                return 0
+        rows = [(last + 1 + i, row) for i, row in enumerate(tail[1:])]
+        with connect(self.path) as conn:
+            self._store_rows(conn, name, header, rows)
+        return len(rows)
+
+    def _store_rows(self, conn, name, header, rows):
+        """Grava [(linha, valores)] lidos da planilha, gerando IDs e reaplicando edições locais"""
+        id_col = header.index(ID_FIELD) + 1
+        pending = {}
+        for row_id, col, value in conn.execute(
+            "SELECT row_id, col, value FROM outbox_cells WHERE sheet = ? ORDER BY id", (name,)
+        ):
+            pending.setdefault(row_id, []).append((col, value))
+
+        for row_number, values in rows:
+            stamp = _stamp(values)
+            row_id = values[id_col - 1] if len(values) >= id_col else ""
+            if not row_id:
+                # Linha criada fora do app: ganha um ID, gravado na planilha no próximo envio
+                row_id = new_row_id()
+                values = _set(values, id_col, row_id)
+                conn.execute(
+                    "INSERT INTO outbox_cells (sheet, row_id, col, value) VALUES (?, ?, ?, ?)",
+                    (name, row_id, id_col, row_id)
+                )
+            # Células editadas localmente e ainda não enviadas continuam valendo
+            for col, value in pending.get(row_id, []):
+                values = _set(values, col, value)
+            conn.execute(
+                "INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?, ?)",
+                (name, row_number, row_id, json.dumps(values), stamp)
+            )
+
+    def _queue_header_cell(self, conn, name, col):
+        conn.execute(
+            "INSERT INTO outbox_cells (sheet, row_id, col, value) VALUES (?, '', ?, ?)",
+            (name, col, ID_FIELD)
+        )
+
+    def _push_cells(self, ws, name):
+        with connect(self.path) as conn:
+            cells = conn.execute(
+                "SELECT c.id, c.row_id, CASE WHEN c.row_id = '' THEN 1 ELSE r.row_number END, c.col, c.value "
+                "FROM outbox_cells c LEFT JOIN rows r ON r.sheet = c.sheet AND r.row_id = c.row_id "
+                "WHERE c.sheet = ? ORDER BY c.id",
+                (name,)
+            ).fetchall()
+        if not cells:
+            return 0
+        # Linha removida da planilha por outro editor: a edição é descartada
+        targeted = [(row_number, col, value) for _, _, row_number, col, value in cells if row_number]
+        batch_update_cells(ws, targeted)
+        with connect(self.path) as conn:
+            conn.execute("DELETE FROM outbox_cells WHERE sheet = ? AND id <= ?", (name, cells[-1][0]))
+        return len(targeted)
+
+    def _push_legacy_cells(self, ws, name):
+        with connect(self.path) as conn:
+            if not conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (LEGACY_CELLS_TABLE,)
+            ).fetchone():
+                return 0
+            cells = conn.execute(
+                f"SELECT id, row_number, col, value FROM {LEGACY_CELLS_TABLE} WHERE sheet = ? ORDER BY id", (name,)
+            ).fetchall()
+        if not cells:
+            return 0
+        batch_update_cells(ws, [(row_number, col, value) for _, row_number, col, value in cells])
+        with connect(self.path) as conn:
+            conn.execute(f"DELETE FROM {LEGACY_CELLS_TABLE} WHERE sheet = ? AND id <= ?", (name, cells[-1][0]))
+            if not conn.execute(f"SELECT 1 FROM {LEGACY_CELLS_TABLE} LIMIT 1").fetchone():
+                conn.execute(f"DROP TABLE {LEGACY_CELLS_TABLE}")
+        return len(cells)
+
+    def _push_rows(self, ws, name):
+        with connect(self.path) as conn:
+            pending = conn.execute(
+                "SELECT id, row_id, row_values FROM outbox_rows WHERE sheet = ? ORDER BY id", (name,)
+            ).fetchall()
+            last = conn.execute(
+                "SELECT COALESCE(MAX(row_number), 1) FROM rows WHERE sheet = ?", (name,)
+            ).fetchone()[0]
+        if not pending:
+            return 0
+        rows = [_trim(json.loads(values)) for _, _, values in pending]
+        append_rows_batched(ws, rows)
+        # append_rows escreve logo depois da última linha com dados (já puxada acima)
+        with connect(self.path) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?, ?)",
+                [
+                    (name, last + 1 + i, row_id, json.dumps(row), _stamp(row))
+                    for i, ((_, row_id, _), row) in enumerate(zip(pending, rows))
+                ]
+            )
+            conn.execute("DELETE FROM outbox_rows WHERE sheet = ? AND id <= ?", (name, pending[-1][0]))
+        return len(rows)
+
+    def _worksheet(self, name):
+        ws = self._worksheets.get(name)
+        if ws is None:
+            try:
+                ws = self.spreadsheet.worksheet(name)
+            except WorksheetNotFound:
+                header = _with_id(self.sheets[name])
+                ws = self.spreadsheet.add_worksheet(title=name, rows="100", cols=str(len(header)))
+                append_rows_batched(ws, [header])
+            self._worksheets[name] = ws
+        return ws
+
+    def _modified(self):
+        try:
+            return self.spreadsheet.get_lastUpdateTime()
+        except Exception:
+            return None  # sem acesso ao Drive: sempre olha o fim da aba
+
+    def _state(self, name):
+        with connect(self.path) as conn:
+            row = conn.execute(
+                "SELECT header, modified, synced_at, full_synced_at, error FROM sync_state WHERE sheet = ?",
+                (name,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("header", "modified", "synced_at", "full_synced_at", "error"), row))
+
+    def _set_error(self, name, error):
+        with connect(self.path) as conn:
+            conn.execute(
+                "INSERT INTO sync_state (sheet, header, error) VALUES (?, ?, ?) "
+                "ON CONFLICT(sheet) DO UPDATE SET error = excluded.error",
+                (name, json.dumps(self.header(name)), error)
+            )
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _with_id(header):
+    return list(header) if ID_FIELD in header else list(header) + [ID_FIELD]
+
+
+def _stamp(values):
+    return hashlib.sha1(json.dumps(values).encode("utf-8")).hexdigest()
+
+
+def _trim(values):
+    """Sem células vazias no fim: get() e get_all_values() devolvem larguras diferentes"""
+    values = [str(v) if v is not None else "" for v in values]
+    while values and values[-1] == "":
+        values.pop()
+    return values
+
+
+def _set(values, col, value):
+    values = list(values) + [""] * (col - len(values))
+    values[col - 1] = value
+    return values
+
+
+def _record(header, values):
+    return {field: values[i] if i < len(values) else "" for i, field in enumerate(header)}
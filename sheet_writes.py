@@ -0,0 +1,67 @@
+import time
+
+from gspread.exceptions import APIError
+from gspread.utils import rowcol_to_a1
+
+MAX_ROWS_PER_REQUEST = 500  # linhas por append_rows / ranges por batch_update
+MAX_RETRIES = 4
+RETRY_STATUS = {429, 500, 502, 503, 504}  # quota ou erro temporário: repetir o mesmo lote
+SPLIT_STATUS = {400, 413}  # lote grande demais: dividir ao meio e tentar de novo
+
+
+def append_rows_batched(worksheet, rows, chunk_size=MAX_ROWS_PER_REQUEST):
+    """Adiciona todas as linhas com um único append_rows (ou poucos, se o lote for grande)"""
+    rows = [list(r) for r in rows]
+    if not rows:
+        return 0
+    _send_chunked(rows, chunk_size, lambda chunk: worksheet.append_rows(chunk))
+    return len(rows)
+
+
+def batch_update_cells(worksheet, cells, chunk_size=MAX_ROWS_PER_REQUEST):
+    """Atualiza várias células [(linha, coluna, valor)] num único batch_update"""
+    # A última escrita de cada célula vence, como aconteceria com update_cell em sequência
+    latest = {}
+    for row, col, value in cells:
+        latest[(row, col)] = value
+
+    data = [
+        {"range": rowcol_to_a1(row, col), "values": [[value]]}
+        for (row, col), value in latest.items()
+    ]
+    if not data:
+        return 0
+    _send_chunked(data, chunk_size, lambda chunk: worksheet.batch_update(chunk))
+    return len(data)
+
+
+def _send_chunked(items, chunk_size, send):
+    """Envia items em blocos, repetindo em 429/5xx e dividindo blocos recusados por tamanho"""
+    pending = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+    while pending:
+        chunk = pending.pop(0)
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                send(chunk)
+                break
+            except APIError as e:
+                status = e.response.status_code
+                if status in SPLIT_STATUS and len(chunk) > 1:
+                    half = len(chunk) // 2
+                    pending[:0] = [chunk[:half], chunk[half:]]
+                    break
+                if status in RETRY_STATUS and attempt < MAX_RETRIES:
+                    time.sleep(_retry_delay(e, attempt))
+                    continue
+                raise
+
+
+def _retry_delay(error, attempt):
+    retry_after = error.response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return min(2 ** attempt, 30)
@@ -0,0 +1,242 @@
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+HISTOGRAM_WINDOW = 600  # segundos de observações mantidas nos histogramas (janela móvel)
+
+_trace = contextvars.ContextVar("tenda_trace", default=None)
+_depth = contextvars.ContextVar("tenda_trace_depth", default=0)
+
+
+class Trace:
+    """Spans e requisições upstream de uma execução do script (um rerun)
+
+    Só o que roda no contexto da execução entra aqui (a thread do script e o que ela
+    repassa com asyncio.to_thread); threads de fundo alimentam apenas os histogramas.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []  # (nome, início relativo, duração, profundidade, erro)
+        self.hosts = defaultdict(lambda: {"requisicoes": 0, "retries": 0, "erros": 0, "bytes": 0, "tempo_s": 0.0})
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, duration, depth, error):
+        with self._lock:
+            self.spans.append((name, start - self.started, duration, depth, error))
+
+    def add_request(self, host, seconds, sent, received, status):
+        with self._lock:
+            stats = self.hosts[host]
+            stats["requisicoes"] += 1
+            stats["erros"] += status >= 400
+            stats["bytes"] += sent + received
+            stats["tempo_s"] += seconds
+
+    def add_retry(self, host):
+        with self._lock:
+            self.hosts[host]["retries"] += 1
+
+    def summary(self):
+        """Spans agregados por nome e totais por host, para o painel de debug"""
+        with self._lock:
+            spans = list(self.spans)
+            hosts = {host: dict(stats) for host, stats in self.hosts.items()}
+        by_name = {}
+        for name, _, duration, _, error in spans:
+            row = by_name.setdefault(name, {"span": name, "chamadas": 0, "total_ms": 0.0, "max_ms": 0.0, "erros": 0})
+            row["chamadas"] += 1
+            row["total_ms"] += duration * 1000
+            row["max_ms"] = max(row["max_ms"], duration * 1000)
+            row["erros"] += error
+        return {
+            "duracao_s": time.perf_counter() - self.started,
+            "spans": sorted(by_name.values(), key=lambda row: -row["total_ms"]),
+            "hosts": hosts,
+            "requisicoes": sum(stats["requisicoes"] for stats in hosts.values()),
+            "retries": sum(stats["retries"] for stats in hosts.values()),
+            "bytes": sum(stats["bytes"] for stats in hosts.values()),
+        }
+
+
+class Tracer:
+    """Métricas do processo: histogramas em janela móvel e contadores, exportáveis para Prometheus"""
+
+    def __init__(self, window=HISTOGRAM_WINDOW, buckets=HISTOGRAM_BUCKETS):
+        self.window = window
+        self.buckets = buckets
+        self._observations = defaultdict(deque)  # (métrica, rótulos) -> deque[(instante, valor)]
+        self._counters = defaultdict(float)  # (métrica, rótulos) -> total
+        self._lock = threading.Lock()
+        self._exporter = None
+
+    def observe(self, metric, labels, value):
+        key = (metric, tuple(sorted(labels.items())))
+        now = time.monotonic()
+        with self._lock:
+            observations = self._observations[key]
+            observations.append((now, value))
+            while observations and now - observations[0][0] > self.window:
+                observations.popleft()
+
+    def count(self, metric, labels, value=1):
+        with self._lock:
+            self._counters[(metric, tuple(sorted(labels.items())))] += value
+
+    def histograms(self):
+        """{(métrica, rótulos): {"buckets": [...], "soma", "total"}} da janela atual"""
+        now = time.monotonic()
+        result = {}
+        with self._lock:
+            for key, observations in self._observations.items():
+                values = [value for at, value in observations if now - at <= self.window]
+                if values:
+                    result[key] = {
+                        "buckets": [sum(value <= bound for value in values) for bound in self.buckets],
+                        "soma": sum(values),
+                        "total": len(values),
+                    }
+        return result
+
+    def prometheus_text(self):
+        lines = []
+        histograms = self.histograms()
+        for metric in sorted({metric for metric, _ in histograms}):
+            lines.append(f"# TYPE {metric} histogram")
+            for (name, labels), data in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                for bound, count in zip(self.buckets, data["buckets"]):
+                    lines.append(f"{metric}_bucket{_labels(labels + (('le', f'{bound:g}'),))} {count}")
+                lines.append(f"{metric}_bucket{_labels(labels + (('le', '+Inf'),))} {data['total']}")
+                lines.append(f"{metric}_sum{_labels(labels)} {data['soma']:.6f}")
+                lines.append(f"{metric}_count{_labels(labels)} {data['total']}")
+        with self._lock:
+            counters = dict(self._counters)
+        for metric in sorted({metric for metric, _ in counters}):
+            lines.append(f"# TYPE {metric} counter")
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f"{metric}{_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def export_prometheus(self, path):
+        """Grava as métricas no formato texto do Prometheus (troca atômica do arquivo)"""
+        tmp_path = f"{path}.tmp{threading.get_ident()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+        return path
+
+    def export_every(self, path, interval=60):
+        """Exporta periodicamente numa thread (para o textfile collector do node_exporter)"""
+        with self._lock:
+            if self._exporter is not None:
+                return
+            self._exporter = threading.Thread(
+                target=self._export_loop, args=(path, interval), name="metrics-export", daemon=True
+            )
+        self._exporter.start()
+
+    def _export_loop(self, path, interval):
+        while True:
+            try:
+                self.export_prometheus(path)
+            except OSError:
+                pass
+            time.sleep(interval)
+
+
+# Métricas do processo inteiro (todas as sessões)
+TRACER = Tracer()
+
+
+def start_trace(name="rerun"):
+    """Começa o trace da execução atual do script"""
+    trace = Trace(name)
+    _trace.set(trace)
+    _depth.set(0)
+    return trace
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextmanager
+def span(name):
+    """Mede um trecho: entra no histograma tenda_span_seconds e no trace da execução"""
+    trace = _trace.get()
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _depth.reset(token)
+        TRACER.observe("tenda_span_seconds", {"span": name}, duration)
+        if error:
+            TRACER.count("tenda_span_errors_total", {"span": name})
+        if trace is not None:
+            trace.add_span(name, start, duration, depth, error)
+
+
+def traced(name):
+    """Decorator: a função (ou gerador, até esgotar) roda dentro de span(name)"""
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                with span(name):
+                    yield from fn(*args, **kwargs)
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_request(host, seconds, sent, received, status):
+    """Uma requisição HTTP upstream concluída (chamado pelo adapter do http_pool)"""
+    labels = {"host": host}
+    TRACER.observe("tenda_upstream_request_seconds", labels, seconds)
+    TRACER.count("tenda_upstream_requests_total", labels)
+    TRACER.count("tenda_upstream_bytes_total", {"host": host, "direcao": "enviados"}, sent)
+    TRACER.count("tenda_upstream_bytes_total", {"host": host, "direcao": "recebidos"}, received)
+    if status >= 400:
+        TRACER.count("tenda_upstream_errors_total", {"host": host, "status": str(status)})
+    trace = _trace.get()
+    if trace is not None:
+        trace.add_request(host, seconds, sent, received, status)
+
+
+def record_retry(host):
+    TRACER.count("tenda_upstream_retries_total", {"host": host})
+    trace = _trace.get()
+    if trace is not None:
+        trace.add_retry(host)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
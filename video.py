@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from local_store import cache_dir
+
+FFMPEG = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+VIDEO_SIZE = (1280, 720)
+VIDEO_FPS = 25
+SILENT_SCENE_SECONDS = 4  # duração de uma cena sem narração
+# Entra no hash dos clipes: mudar parâmetros de codificação invalida o cache
+RENDER_SETTINGS = {
+    "size": VIDEO_SIZE, "fps": VIDEO_FPS, "vcodec": "libx264", "crf": 23, "preset": "veryfast",
+    "acodec": "aac", "audio_rate": 44100, "audio_bitrate": "128k", "silent_seconds": SILENT_SCENE_SECONDS,
+}
+
+
+class RenderError(Exception):
+    """Falha ao renderizar um clipe ou o vídeo do episódio"""
+
+
+class EpisodeRenderer:
+    """Vídeo do episódio montado a partir de clipes por cena, renderizados em paralelo
+
+    Cada cena vira um clipe (imagens da cena em sequência + narração) renderizado por um
+    processo ffmpeg próprio, um por núcleo; as threads do pool só esperam os processos (um
+    pool multiprocessing reimportaria o app.py em cada worker). O clipe é guardado pelo hash das
+    entradas (arquivos de imagem e de áudio, que já são endereçados por conteúdo, mais os
+    parâmetros de codificação): trocar a imagem de uma cena renderiza só aquele clipe.
+    Todos os clipes saem com os mesmos codecs, então o episódio é só um concat com
+    cópia de streams, sem recodificar. As cenas guardam a grade 2×2 do /imagine; o quadro
+    do vídeo é a variação escolhida por ImageStore.best_variant, recortada localmente.
+    """
+
+    def __init__(self, image_store, narration=None, root=None, max_workers=None, ffmpeg=FFMPEG):
+        self.image_store = image_store
+        self.narration = narration
+        self.root = root or cache_dir("video")
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.ffmpeg = ffmpeg
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ffmpeg")
+
+    def available(self):
+        return shutil.which(self.ffmpeg) is not None
+
+    def clip_inputs(self, scene):
+        """(imagens, áudio) locais de uma cena; baixa imagens e sintetiza a narração se preciso"""
+        urls = [scene.get(f"Link Imagem {slot}", "") for slot in (1, 2)]
+        images = [self.scene_frame(url) for url in urls if url.startswith("http")]
+        audio = None
+        text = scene.get("Narração", "")
+        if self.narration is not None and text:
+            audio = self.narration.cached(text) or self.narration.synthesize_many([text])[text]
+            if isinstance(audio, Exception):
+                raise RenderError(f"Narração da cena {scene.get('Número')}: {audio}")
+        return [image for image in images if image], audio
+
+    def scene_frame(self, url):
+        """Caminho local da imagem de uma cena: a melhor variação da grade, não a grade inteira"""
+        variants = self.image_store.variants(url)
+        if not variants:
+            return self.image_store.original(url)
+        return variants[self.image_store.best_variant(url) - 1]
+
+    def clip_path(self, images, audio):
+        payload = json.dumps(
+            [[os.path.basename(image) for image in images], os.path.basename(audio or ""), RENDER_SETTINGS],
+            sort_keys=True
+        )
+        return os.path.join(self.root, f"{hashlib.sha256(payload.encode('utf-8')).hexdigest()}.mp4")
+
+    def render(self, scenes, on_progress=None):
+        """Renderiza os clipes que faltam e junta o episódio
+
+        on_progress(feitos, total) é chamado na thread de quem chamou. Devolve
+        {"caminho", "renderizados", "reaproveitados"}.
+        """
+        if not scenes:
+            raise RenderError("Nenhuma cena para renderizar")
+        if not self.available():
+            raise RenderError(f"ffmpeg não encontrado ({self.ffmpeg})")
+
+        # Entradas de todas as cenas antes de renderizar: downloads, recortes e sínteses em paralelo
+        self.image_store.prefetch_variants(
+            scene.get(f"Link Imagem {slot}", "") for scene in scenes for slot in (1, 2)
+        )
+        if self.narration is not None:
+            self.narration.synthesize_many([scene.get("Narração", "") for scene in scenes])
+        clips = []
+        for scene in scenes:
+            images, audio = self.clip_inputs(scene)
+            clips.append((images, audio, self.clip_path(images, audio)))
+
+        missing = {path: (images, audio) for images, audio, path in clips if not os.path.exists(path)}
+        done = len(clips) - len(missing)
+        if on_progress:
+            on_progress(done, len(clips))
+        if missing:
+            threads = max(1, (os.cpu_count() or 1) // min(self.max_workers, len(missing)))
+            futures = [
+                self._executor.submit(render_clip, self.ffmpeg, images, audio, path, threads)
+                for path, (images, audio) in missing.items()
+            ]
+            for future in as_completed(futures):
+                future.result()
+                done += 1
+                if on_progress:
+                    on_progress(done, len(clips))
+
+        return {
+            "caminho": self.concat([path for _, _, path in clips]),
+            "renderizados": len(missing),
+            "reaproveitados": len(clips) - len(missing),
+        }
+
+    def concat(self, clip_paths):
+        """Junta os clipes com cópia de streams; o arquivo final também é cacheado pelos clipes"""
+        key = hashlib.sha256(" ".join(os.path.basename(path) for path in clip_paths).encode("utf-8")).hexdigest()
+        out_path = os.path.join(cache_dir("video", "episodios"), f"{key}.mp4")
+        if os.path.exists(out_path):
+            return out_path
+        list_path = f"{out_path}.txt"
+        with open(list_path, "w", encoding="utf-8") as f:
+            for path in clip_paths:
+                f.write(f"file '{os.path.abspath(path)}'\n")
+        tmp_path = f"{out_path}.tmp{threading.get_ident()}.mp4"
+        try:
+            _run([
+                self.ffmpeg, "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path,
+                "-c", "copy", "-movflags", "+faststart", tmp_path
+            ])
+            os.replace(tmp_path, out_path)
+        finally:
+            os.remove(list_path)
+        return out_path
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+def render_clip(ffmpeg, images, audio, out_path, threads=1):
+    """Renderiza o clipe de uma cena num processo ffmpeg"""
+    width, height = RENDER_SETTINGS["size"]
+    fps = RENDER_SETTINGS["fps"]
+    duration = audio_duration(ffmpeg, audio) if audio else RENDER_SETTINGS["silent_seconds"]
+
+    args = [ffmpeg, "-y", "-v", "error"]
+    if images:
+        # Cada imagem fica na tela uma fração igual da narração
+        for image in images:
+            args += ["-loop", "1", "-framerate", str(fps), "-t", f"{duration / len(images):.3f}", "-i", image]
+    else:
+        args += ["-f", "lavfi", "-t", f"{duration:.3f}", "-i", f"color=c=black:s={width}x{height}:r={fps}"]
+    if audio:
+        args += ["-i", audio]
+    else:
+        args += ["-f", "lavfi", "-t", f"{duration:.3f}", "-i", f"anullsrc=r={RENDER_SETTINGS['audio_rate']}:cl=stereo"]
+    video_inputs = max(len(images), 1)
+
+    filters = [
+        f"[{i}:v]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps},format=yuv420p[v{i}]"
+        for i in range(video_inputs)
+    ]
+    filters.append("".join(f"[v{i}]" for i in range(video_inputs)) + f"concat=n={video_inputs}:v=1:a=0[v]")
+    args += [
+        "-filter_complex", ";".join(filters),
+        "-map", "[v]", "-map", f"{video_inputs}:a",
+        "-c:v", RENDER_SETTINGS["vcodec"], "-preset", RENDER_SETTINGS["preset"], "-crf", str(RENDER_SETTINGS["crf"]),
+        "-threads", str(threads),
+        "-c:a", RENDER_SETTINGS["acodec"], "-b:a", RENDER_SETTINGS["audio_bitrate"],
+        "-ar", str(RENDER_SETTINGS["audio_rate"]), "-ac", "2",
+        "-t", f"{duration:.3f}",
+    ]
+    tmp_path = f"{out_path}.tmp{threading.get_ident()}.mp4"
+    _run(args + [tmp_path])
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def audio_duration(ffmpeg, path):
+    """Duração em segundos lida do cabeçalho que o ffmpeg imprime (dispensa o ffprobe)"""
+    result = subprocess.run([ffmpeg, "-hide_banner", "-i", path], capture_output=True, text=True)
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if not match:
+        raise RenderError(f"Duração do áudio desconhecida: {path}")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _run(args):
+    result = subprocess.run(args, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RenderError(f"ffmpeg falhou ({result.returncode}): {result.stderr.strip()[-500:]}")
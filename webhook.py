@@ -0,0 +1,152 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from local_store import cache_path, connect
+
+WEBHOOK_PATH = "/piapi/webhook"
+TERMINAL_STATUS = {"finished", "failed"}
+
+_receivers = {}
+_lock = threading.Lock()
+
+
+class CompletionStore:
+    """Conclusões de tarefas PIAPI recebidas por webhook (SQLite + eventos em memória)
+
+    Quem espera uma tarefa bloqueia num threading.Event em vez de consultar /fetch;
+    conclusões que chegam sem ninguém esperando ficam gravadas para depois.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or cache_path("webhooks.sqlite3")
+        self._events = {}  # task_id -> [evento, nº de quem espera]
+        self._listeners = []
+        self._lock = threading.Lock()
+        with connect(self.path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS completions (
+                    task_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    received_at REAL NOT NULL
+                )
+            """)
+
+    def record(self, result):
+        task_id = result.get("task_id")
+        if not task_id or result.get("status") not in TERMINAL_STATUS:
+            return
+        with connect(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)",
+                (task_id, result["status"], json.dumps(result), time.time())
+            )
+        with self._lock:
+            waiting = self._events.get(task_id)
+            listeners = list(self._listeners)
+        if waiting:
+            waiting[0].set()
+        for listener in listeners:
+            listener(task_id, result)
+
+    def get(self, task_id):
+        with connect(self.path) as conn:
+            row = conn.execute("SELECT result FROM completions WHERE task_id = ?", (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def wait(self, task_id, timeout):
+        """Bloqueia até o webhook da tarefa chegar (ou timeout); devolve o resultado ou None
+
+        Várias threads podem esperar a mesma tarefa: o evento só sai com a última delas.
+        """
+        with self._lock:
+            waiting = self._events.setdefault(task_id, [threading.Event(), 0])
+            waiting[1] += 1
+        try:
+            result = self.get(task_id)
+            if result is None and waiting[0].wait(timeout):
+                result = self.get(task_id)
+            return result
+        finally:
+            with self._lock:
+                waiting[1] -= 1
+                if waiting[1] == 0:
+                    self._events.pop(task_id, None)
+
+    def add_listener(self, listener):
+        """listener(task_id, resultado) é chamado (na thread do servidor) a cada conclusão"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+
+class WebhookReceiver:
+    """Servidor HTTP embutido que recebe os callbacks da PIAPI"""
+
+    def __init__(self, public_url, port=8765, host="0.0.0.0", secret="", store=None):
+        self.public_url = public_url.rstrip("/")
+        self.secret = secret
+        self.store = store or CompletionStore()
+        self.server = ThreadingHTTPServer((host, port), _handler_for(self))
+        self.thread = threading.Thread(target=self.server.serve_forever, name="piapi-webhook", daemon=True)
+        self.thread.start()
+
+    @property
+    def endpoint(self):
+        """URL enviada à PIAPI como webhook_endpoint"""
+        return f"{self.public_url}{WEBHOOK_PATH}"
+
+    def submit_params(self):
+        """Campos a acrescentar no corpo de /imagine e /upscale"""
+        params = {"webhook_endpoint": self.endpoint}
+        if self.secret:
+            params["webhook_secret"] = self.secret
+        return params
+
+    def wait(self, task_id, timeout):
+        return self.store.wait(task_id, timeout)
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_receiver(public_url, port=8765, secret=""):
+    """Receptor do processo para a porta (criado na primeira chamada)"""
+    with _lock:
+        receiver = _receivers.get(port)
+        if receiver is None:
+            receiver = _receivers[port] = WebhookReceiver(public_url, port=port, secret=secret)
+        return receiver
+
+
+def _handler_for(receiver):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            if self.path.split("?")[0] != WEBHOOK_PATH:
+                return self._reply(404)
+            if receiver.secret and self.headers.get("x-webhook-secret") != receiver.secret:
+                return self._reply(401)
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            except json.JSONDecodeError:
+                return self._reply(400)
+            # Formato v2 (tarefa no corpo) ou unificado ({"data": tarefa})
+            receiver.store.record(body.get("data", body))
+            self._reply(200)
+
+        def _reply(self, code):
+            self.send_response(code)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    return Handler